@@ -19,21 +19,26 @@ import warnings
 warnings.filterwarnings('ignore')
 from sklearn.metrics import mean_squared_error, explained_variance_score, max_error
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import RobustScaler
+from data_loader import load_dataset
+from features import load_features
+from preprocessing import Preprocessor
+from windowing import make_windows, valid_starts, window_count
+from input_pipeline import train_val_datasets
+from precision import output_dtype, set_precision
+from training_budget import TrainingBudget
+
+# Numeric precision of the whole pipeline: 'float32', 'mixed_float16' / 'mixed_bfloat16'
+# (half-precision compute in the Keras models) or 'float64' for a reference run
+set_precision('float32')
 
 """# **LOAD DATA**"""
 
-# Import the CSV file
-df = pd.read_csv("/content/busan_dataset.csv")
-df.head()
-
-# Remove spaces on the column
-df.columns = df.columns.str.lstrip()
-df.columns = df.columns.str.rstrip()
+# Columns the models use; only these are loaded (hour/month are derived below)
+required_cols = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure', 'Water', 'AOD', 'wv_500', 'CI_Beyer', 'hour', 'month']
 
-# Parse the "Date" column
-df['Date'] = pd.to_datetime(df['Date'])
-df.set_index('Date', inplace=True)
+# Load the dataset through the columnar cache (float32, column names stripped, indexed by Date)
+df = load_dataset("/content/busan_dataset.csv", columns=required_cols)
+df.head()
 
 """# **DATA EXPLORATION**"""
 
@@ -53,12 +58,10 @@ df.isna().sum()
 
 """# **DATA ENGINEERING**"""
 
-# Extracting features from the index before filtering the DataFrame
-df['hour'] = df.index.hour
-df['month'] = df.index.month
+# Calendar features from the cached feature stage (float32, computed once per new row)
+df = df.join(load_features("/content/busan_dataset.csv", ['hour', 'month']))
 
 # Now filter the DataFrame to include only the required columns and the new features
-required_cols = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure', 'Water', 'AOD', 'wv_500', 'CI_Beyer', 'hour', 'month']
 df = df[required_cols]
 
 # Display the first few rows to confirm the columns are present
@@ -118,37 +121,45 @@ print('Validation size:', len(validation))
 # Input Scaling
 cols = ['SunZenith_KMU', 'Ambient_Pressure', 'Water', 'AOD', 'wv_500', 'CI_Beyer', 'hour', 'month']
 
-scaler = RobustScaler()
-scaler = scaler.fit(np.asarray(train[cols]))
-
-train.loc[:, cols] = scaler.transform(np.asarray(train[cols]))
-test.loc[:, cols] = scaler.transform(np.asarray(test[cols]))
-
-# scaling GHI
-GHI_scaler = RobustScaler()
-GHI_scaler = GHI_scaler.fit(train[['GHI_Average']])
-train['GHI_Average'] = GHI_scaler.transform(train[['GHI_Average']])
-test['GHI_Average'] = GHI_scaler.transform(test[['GHI_Average']])
+# Fit the input scaler (cols) and the GHI scaler on the training split, then scale
+# float32 copies of train/test in one fused pass (no chained assignment on slices of df)
+prep = Preprocessor(required_cols, cols, target='GHI_Average').fit(train)
+scaler, GHI_scaler = prep.scaler, prep.target_scaler
+train = prep.transform_frame(train)
+test = prep.transform_frame(test)
 
 print('Train shape:',train.shape)
 print('Test shape:', test.shape)
 
 """# **MODEL BUILDING**"""
 
-def create_dataset(X, y, time_steps=1):
-    Xs, ys = [], []
-    for i in range(len(X) - time_steps):
-        v = X.iloc[i:(i + time_steps)].values
-        Xs.append(v)
-        ys.append(y.iloc[i + time_steps])
-    return np.array(Xs), np.array(ys)
-
 time_steps = 7
-# reshape to [samples, time_steps, features]
-X_train, y_train = create_dataset(train, train.GHI_Average, time_steps)
-X_test, y_test = create_dataset(test, test.GHI_Average, time_steps)
+# Only gap-free windows (see windowing); gap_aware = False restores every window
+gap_aware = True
+train_starts = valid_starts(train, time_steps, gap_aware=gap_aware)
+test_starts = valid_starts(test, time_steps, gap_aware=gap_aware)
+print(f'Windows kept: train {len(train_starts)} of {window_count(len(train), time_steps)}, '
+      f'test {len(test_starts)} of {window_count(len(test), time_steps)}')
+# [samples, time_steps, features] windows starting at those rows
+X_train, y_train = make_windows(train, time_steps, target='GHI_Average', starts=train_starts)
+X_test, y_test = make_windows(test, time_steps, target='GHI_Average', starts=test_starts)
 print(X_train.shape, y_train.shape)
 
+# tf.data pipelines for the Keras models: windows are gathered on the fly, batched in
+# parallel, cached and prefetched; the last 15% are held out as validation_split=0.15 did
+train_ds, val_ds = train_val_datasets(train, time_steps, target='GHI_Average', batch_size=64, validation_split=0.15,
+                                      starts=train_starts)
+train_flat_ds, val_flat_ds = train_val_datasets(train, time_steps, target='GHI_Average', batch_size=64,
+                                                validation_split=0.15, flatten=True, starts=train_starts)
+
+# Shared training policy for every fit: early stopping on val_loss (best weights restored),
+# learning rate reduced on plateaus, and optional per-fit epoch / wall-clock caps
+budget = TrainingBudget(patience=10, schedule='plateau', max_epochs=None, max_seconds=None)
+
+# True compiles every model's train / predict steps with XLA; see the FAST KERNEL
+# BENCHMARK section for whether it pays off on this machine
+jit_compile = False
+
 """# **GRU**"""
 
 # GRU model design
@@ -156,11 +167,12 @@ print(X_train.shape, y_train.shape)
 gru_model = tf.keras.Sequential()
 gru_model.add(tf.keras.layers.GRU(units=100, input_shape=(X_train.shape[1], X_train.shape[2])))
 gru_model.add(tf.keras.layers.Dropout(rate=0.5))
-gru_model.add(tf.keras.layers.Dense(units=1))
-gru_model.compile(loss='mean_squared_error', optimizer='adam')
+gru_model.add(tf.keras.layers.Dense(units=1, dtype=output_dtype()))
+gru_model.compile(loss='mean_squared_error', optimizer='adam', jit_compile=jit_compile)
 gru_model.summary()
 
-gru_history = gru_model.fit(X_train, y_train,epochs=100,batch_size=64,validation_split=0.15,shuffle=False)
+gru_history = gru_model.fit(train_ds, validation_data=val_ds, epochs=100,
+                            callbacks=budget.callbacks('GRU'))
 
 # history plotting
 plt.plot(gru_history.history['loss'], label='train')
@@ -230,10 +242,11 @@ gru_accuracy_metrics(y_test_inv, y_pred_GRU_inv)
 lstm_model = tf.keras.Sequential()
 lstm_model.add(tf.keras.layers.LSTM(units=100, input_shape=(X_train.shape[1], X_train.shape[2])))
 lstm_model.add(tf.keras.layers.Dropout(rate=0.5))
-lstm_model.add(tf.keras.layers.Dense(units=1))
-lstm_model.compile(loss='mse', optimizer='adam')
+lstm_model.add(tf.keras.layers.Dense(units=1, dtype=output_dtype()))
+lstm_model.compile(loss='mse', optimizer='adam', jit_compile=jit_compile)
 
-lstm_history = lstm_model.fit(X_train, y_train,epochs=100,batch_size=64,validation_split=0.15,shuffle=False)
+lstm_history = lstm_model.fit(train_ds, validation_data=val_ds, epochs=100,
+                              callbacks=budget.callbacks('LSTM'))
 
 lstm_model.summary()
 
@@ -299,11 +312,12 @@ LSTM_accuracy_metrics(y_test_inv, y_pred_LSTM_inv)
 rnn_model = tf.keras.Sequential()
 rnn_model.add(tf.keras.layers.SimpleRNN(units=100, activation='relu', input_shape=(time_steps, X_train.shape[2])))
 rnn_model.add(tf.keras.layers.Dropout(rate=0.5))
-rnn_model.add(tf.keras.layers.Dense(units=1))
-rnn_model.compile(loss='mse', optimizer='adam')
+rnn_model.add(tf.keras.layers.Dense(units=1, dtype=output_dtype()))
+rnn_model.compile(loss='mse', optimizer='adam', jit_compile=jit_compile)
 
 # Train the model
-rnn_history = rnn_model.fit(X_train, y_train, epochs=100, batch_size=64, validation_split=0.15, shuffle=False)
+rnn_history = rnn_model.fit(train_ds, validation_data=val_ds, epochs=100,
+                            callbacks=budget.callbacks('RNN'))
 
 # Model summary
 rnn_model.summary()
@@ -372,20 +386,11 @@ import tensorflow as tf
 ann_train = train.copy()
 ann_test = test.copy()
 
-# Function to flatten and reshape the data for ANN input
-def create_ann_dataset(X, y, time_steps=1):
-    Xs, ys = [], []
-    for i in range(len(X) - time_steps):
-        v = X.iloc[i:(i + time_steps)].values
-        Xs.append(v.flatten())  # Flatten the input for ANN
-        ys.append(y.iloc[i + time_steps])
-    return np.array(Xs), np.array(ys)
-
 time_steps = 7
 
-# Use the copied datasets to flatten and reshape for ANN
-X_ANN_train, y_ANN_train = create_ann_dataset(ann_train, ann_train['GHI_Average'], time_steps)
-X_ANN_test, y_ANN_test = create_ann_dataset(ann_test, ann_test['GHI_Average'], time_steps)
+# Use the copied datasets to build flattened [samples, time_steps * features] windows for ANN
+X_ANN_train, y_ANN_train = make_windows(ann_train, time_steps, target='GHI_Average', flatten=True, starts=train_starts)
+X_ANN_test, y_ANN_test = make_windows(ann_test, time_steps, target='GHI_Average', flatten=True, starts=test_starts)
 
 print("X_ANN_train shape:", X_ANN_train.shape)
 print("y_ANN_train shape:", y_ANN_train.shape)
@@ -396,12 +401,13 @@ print("y_ANN_test shape:", y_ANN_test.shape)
 ann_model = tf.keras.Sequential()
 ann_model.add(tf.keras.layers.Dense(units=100, activation='relu', input_shape=(X_ANN_train.shape[1],)))  # Flattened input
 ann_model.add(tf.keras.layers.Dropout(rate=0.5))
-ann_model.add(tf.keras.layers.Dense(units=1))
-ann_model.compile(loss='mean_squared_error', optimizer='adam')
+ann_model.add(tf.keras.layers.Dense(units=1, dtype=output_dtype()))
+ann_model.compile(loss='mean_squared_error', optimizer='adam', jit_compile=jit_compile)
 ann_model.summary()
 
 # Train the model
-ann_history = ann_model.fit(X_ANN_train, y_ANN_train, epochs=100, batch_size=64, validation_split=0.15, shuffle=False)
+ann_history = ann_model.fit(train_flat_ds, validation_data=val_flat_ds, epochs=100,
+                            callbacks=budget.callbacks('ANN'))
 
 # model validation
 plt.plot(ann_history.history['loss'], label='train')
@@ -478,13 +484,14 @@ cnn_model.add(tf.keras.layers.Dropout(rate=0.5))
 cnn_model.add(tf.keras.layers.Flatten())
 
 # Add a Dense layer for the output
-cnn_model.add(tf.keras.layers.Dense(units=1))
+cnn_model.add(tf.keras.layers.Dense(units=1, dtype=output_dtype()))
 
 # Compile the CNN model
-cnn_model.compile(loss='mse', optimizer='adam')
+cnn_model.compile(loss='mse', optimizer='adam', jit_compile=jit_compile)
 
 # Train the CNN model
-cnn_history = cnn_model.fit(X_train, y_train, epochs=100, batch_size=64, validation_split=0.15, shuffle=False)
+cnn_history = cnn_model.fit(train_ds, validation_data=val_ds, epochs=100,
+                            callbacks=budget.callbacks('CNN'))
 
 # Model summary
 cnn_model.summary()
@@ -550,19 +557,20 @@ CNN_accuracy_metrics(y_test_inv, y_pred_CNN_inv)
 
 import numpy as np
 
-# Flatten the input data for MLP
-X_train_flat = X_train.reshape(X_train.shape[0], -1).copy()  # Flatten and make a copy
-X_test_flat = X_test.reshape(X_test.shape[0], -1).copy()    # Flatten and make a copy
+# Flatten the input data for MLP (a view of the same windows, no copy)
+X_train_flat = X_train.reshape(X_train.shape[0], -1)
+X_test_flat = X_test.reshape(X_test.shape[0], -1)
 
 # MLP model building
 mlp_model = tf.keras.Sequential()
 mlp_model.add(tf.keras.layers.Dense(units=100, activation='relu', input_shape=(X_train_flat.shape[1],)))  # Change input shape to (63,)
 mlp_model.add(tf.keras.layers.Dropout(rate=0.5))
-mlp_model.add(tf.keras.layers.Dense(units=1))  # Output layer
-mlp_model.compile(loss='mse', optimizer='adam')
+mlp_model.add(tf.keras.layers.Dense(units=1, dtype=output_dtype()))  # Output layer
+mlp_model.compile(loss='mse', optimizer='adam', jit_compile=jit_compile)
 
 # Train the model
-mlp_history = mlp_model.fit(X_train_flat, y_train, epochs=100, batch_size=64, validation_split=0.15, shuffle=False)
+mlp_history = mlp_model.fit(train_flat_ds, validation_data=val_flat_ds, epochs=100,
+                            callbacks=budget.callbacks('MLP'))
 
 # Model summary
 mlp_model.summary()
@@ -627,14 +635,13 @@ MLP_accuracy_metrics(y_test_inv, y_pred_MLP_inv)
 """# **SVR**"""
 
 from sklearn.svm import SVR
-from sklearn.preprocessing import MinMaxScaler
 from sklearn.metrics import mean_squared_error, r2_score
 import matplotlib.pyplot as plt
 import numpy as np
 
-# Flatten X_train and X_test to be 2D arrays for SVR
-X_train_flat = X_train.reshape(X_train.shape[0], -1).copy()
-X_test_flat = X_test.reshape(X_test.shape[0], -1).copy()
+# Flatten X_train and X_test to be 2D arrays for SVR (views, no copy)
+X_train_flat = X_train.reshape(X_train.shape[0], -1)
+X_test_flat = X_test.reshape(X_test.shape[0], -1)
 
 # Initialize the SVR model
 svr_model = SVR(kernel='rbf', C=100, gamma=0.1, epsilon=0.1)
@@ -700,11 +707,12 @@ X_test_flat = X_test.reshape(X_test.shape[0], -1)
 dnn_model = tf.keras.Sequential()
 dnn_model.add(tf.keras.layers.Dense(units=100, activation='relu', input_shape=(X_train_flat.shape[1],)))
 dnn_model.add(tf.keras.layers.Dropout(rate=0.5))
-dnn_model.add(tf.keras.layers.Dense(units=1))  # Output layer
-dnn_model.compile(loss='mse', optimizer='adam')
+dnn_model.add(tf.keras.layers.Dense(units=1, dtype=output_dtype()))  # Output layer
+dnn_model.compile(loss='mse', optimizer='adam', jit_compile=jit_compile)
 
 # Train the DNN model
-dnn_history = dnn_model.fit(X_train_flat, y_train, epochs=100, batch_size=64, validation_split=0.15, shuffle=False)
+dnn_history = dnn_model.fit(train_flat_ds, validation_data=val_flat_ds, epochs=100,
+                            callbacks=budget.callbacks('DNN'))
 
 # Model summary
 dnn_model.summary()
@@ -911,4 +919,71 @@ plt.ylabel('GHI')
 plt.legend()
 
 # Show the plot
-plt.show()
\ No newline at end of file
+plt.show()
+
+"""# **PARALLEL MODEL ZOO**
+
+Trains all eight models concurrently in worker processes (windows shared through
+shared memory, intra-op threads capped per worker) and collects the comparison table.
+"""
+
+from zoo_runner import train_zoo
+
+# Epochs and seconds saved by the training budget in the sequential runs above
+budget.report()
+
+# Same policy for the parallel runs; each worker applies it to its own fit
+zoo_budget = TrainingBudget(patience=10, schedule='plateau')
+zoo_results, zoo_metrics_df = train_zoo(X_train, y_train, X_test, y_test, GHI_scaler,
+                                        epochs=100, batch_size=64, validation_split=0.15,
+                                        budget=zoo_budget)
+zoo_budget.report()
+
+# Display the comparison table
+zoo_metrics_df
+
+"""# **PRECISION REPORT**
+
+Retrains the zoo in float64 (reference), float32 and mixed_float16 and reports
+every metric next to its difference from the float64 run, plus the size of the
+train/test arrays at each precision.
+"""
+
+from zoo_runner import compare_precision
+
+precision_df = compare_precision(X_train, y_train, X_test, y_test, GHI_scaler,
+                                 precisions=('float64', 'float32', 'mixed_float16'),
+                                 epochs=100, batch_size=64, validation_split=0.15)
+
+# Display the precision report
+precision_df
+
+"""# **FAST KERNEL BENCHMARK**
+
+Per-epoch time and test accuracy of the current GRU / LSTM / SimpleRNN
+configurations against fused-kernel compatible, unrolled and XLA-compiled ones
+(CPU, same seed, a few epochs each).
+"""
+
+from kernel_benchmark import benchmark_recurrent
+
+kernel_df = benchmark_recurrent(X_train, y_train, X_test, y_test, GHI_scaler, epochs=5, batch_size=64)
+
+# Display the benchmark table
+kernel_df
+
+"""# **HYPERPARAMETER SEARCH**
+
+Searches units / dropout / filters, time_steps, batch size and the SVR C / gamma /
+epsilon for every architecture with asynchronous successive halving in parallel
+worker processes. Results persist in search_results/, so rerunning this cell
+resumes an interrupted search.
+"""
+
+from hyperparameter_search import best_configs, search
+
+search_trials = search(train, n_trials=20, min_epochs=5, max_epochs=100, eta=3,
+                       directory='/content/search_results')
+
+# Best configuration per architecture
+best_configs(search_trials)
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""Parallel walk-forward (rolling-origin) backtesting.
+
+Instead of one static split, the time index is cut into `n_folds`
+consecutive test blocks; each fold trains on the rows before its block (all
+of them for 'expanding' folds, the last `train_size` for 'sliding' ones)
+and forecasts the block. The unscaled [rows, features] matrix is shared
+once through shared memory and the valid windows (windowing.valid_starts)
+are computed once; every fold only slices its window starts, fits its own
+scalers on its training rows and scales the windows it gathers. Folds train
+concurrently in zoo_runner worker processes.
+
+    folds, predictions = backtest(df[required_cols], 'LSTM', n_folds=5)
+    summarize(folds)
+    seasonal_metrics(predictions)
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from metrics import accuracy_metrics
+from precision import get_precision
+from windowing import as_matrix, valid_starts, windows
+from zoo_runner import attach_cached, init_worker, share_arrays
+
+SEASONS = {12: 'Winter', 1: 'Winter', 2: 'Winter', 3: 'Spring', 4: 'Spring', 5: 'Spring',
+           6: 'Summer', 7: 'Summer', 8: 'Summer', 9: 'Autumn', 10: 'Autumn', 11: 'Autumn'}
+
+
+def walk_forward_folds(rows, n_folds=5, mode='expanding', test_size=None, train_size=None):
+    """Row ranges of the folds: [{'train': (start, stop), 'test': (start, stop)}, ...].
+
+    The last n_folds * test_size rows form the test blocks, in order
+    (test_size defaults to rows // (n_folds + 1)). 'expanding' folds train
+    on every earlier row, 'sliding' folds on the `train_size` rows before
+    their block (by default the first fold's training length).
+    """
+    if mode not in ('expanding', 'sliding'):
+        raise ValueError("mode must be 'expanding' or 'sliding', got %r" % (mode,))
+    test_size = test_size or rows // (n_folds + 1)
+    first_test = rows - n_folds * test_size
+    if first_test <= 0:
+        raise ValueError('%d folds of %d test rows do not fit in %d rows' % (n_folds, test_size, rows))
+    train_size = train_size or first_test
+    folds = []
+    for k in range(n_folds):
+        test_start = first_test + k * test_size
+        train_start = 0 if mode == 'expanding' else max(test_start - train_size, 0)
+        folds.append({'train': (train_start, test_start), 'test': (test_start, test_start + test_size)})
+    return folds
+
+
+def fold_starts(starts, fold, time_steps, horizon=1):
+    """Split window `starts` into a fold's train windows (wholly inside its training
+    rows) and test windows (target inside its test block)."""
+    target = starts + time_steps + horizon - 1
+    (train_start, train_stop), (test_start, test_stop) = fold['train'], fold['test']
+    train = starts[(starts >= train_start) & (target < train_stop)]
+    test = starts[(target >= test_start) & (target < test_stop)]
+    return train, test
+
+
+def _run_fold(k, arch, specs, train_starts, test_starts, train_rows, columns, cols, target, time_steps,
+              horizon, epochs, batch_size, validation_split, model_kwargs, budget, seed):
+    from preprocessing import Preprocessor
+
+    name = '%s fold %d' % (arch, k)
+    values = attach_cached(specs)['values']
+    start = time.perf_counter()
+    prep = Preprocessor(columns, cols, target=target, dtype=values.dtype).fit(values[slice(*train_rows)])
+    target_idx = prep.target_idx
+    view = windows(values, time_steps)
+
+    def gather(starts):
+        X = view[starts]
+        prep.transform_(X.reshape(-1, X.shape[-1]))
+        y = prep.transform_target(values[starts + time_steps + horizon - 1, target_idx])
+        return X, y
+
+    X_train, y_train = gather(train_starts)
+    X_test, y_test = gather(test_starts)
+    if arch == 'SVR':
+        from sklearn.svm import SVR
+
+        model = SVR(**{'kernel': 'rbf', 'C': 100, 'gamma': 0.1, 'epsilon': 0.1, **model_kwargs})
+        model.fit(X_train.reshape(len(X_train), -1), y_train)
+        y_pred = model.predict(X_test.reshape(len(X_test), -1))
+    else:
+        import tensorflow as tf
+        from models import ZOO, build_model
+
+        tf.keras.utils.set_random_seed(seed)
+        model = build_model(arch, time_steps, len(columns), **model_kwargs)
+        if ZOO[arch][1]:
+            X_train, X_test = X_train.reshape(len(X_train), -1), X_test.reshape(len(X_test), -1)
+        callbacks = budget.callbacks(name) if budget is not None else None
+        model.fit(X_train, y_train, epochs=epochs, batch_size=batch_size, validation_split=validation_split,
+                  shuffle=False, verbose=0, callbacks=callbacks)
+        y_pred = model.predict(X_test, batch_size=batch_size, verbose=0)
+    return {'fold': k, 'y_true': prep.inverse_target(y_test),
+            'y_pred': prep.inverse_target(np.asarray(y_pred).reshape(-1)),
+            'train_windows': len(X_train), 'seconds': time.perf_counter() - start,
+            'budget': budget.records.get(name) if budget is not None else None}
+
+
+def backtest(data, arch='LSTM', n_folds=5, mode='expanding', time_steps=7, horizon=1,
+             target='GHI_Average', cols=None, test_size=None, train_size=None, epochs=100,
+             batch_size=64, validation_split=0.15, model_kwargs=None, budget=None, workers=None,
+             threads_per_worker=None, seed=0, precision=None):
+    """Walk-forward backtest of zoo model `arch` on the unscaled, Date-indexed frame `data`.
+
+    `cols` are the inputs scaled by the feature scaler (every column but
+    `target` by default); each fold fits its scalers on its own training
+    rows. Returns (folds, predictions): one row of metrics per fold, and
+    every test forecast with its Date and fold. With a
+    training_budget.TrainingBudget, each fold's fit is recorded in `budget`
+    as '<arch> fold <k>'.
+    """
+    columns = list(data.columns)
+    cols = [c for c in columns if c != target] if cols is None else list(cols)
+    folds = walk_forward_folds(len(data), n_folds, mode, test_size, train_size)
+    starts = valid_starts(data, time_steps, horizon, target=target)
+    workers = workers or min(n_folds, os.cpu_count() or 1)
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    precision = precision or get_precision()
+    index = data.index
+
+    handles, specs = share_arrays(values=as_matrix(data, dtype=np.float32))
+    results = {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                 initializer=init_worker, initargs=(threads_per_worker, precision)) as pool:
+            futures = {}
+            for k, fold in enumerate(folds):
+                train_starts, test_starts = fold_starts(starts, fold, time_steps, horizon)
+                future = pool.submit(_run_fold, k, arch, specs, train_starts, test_starts, fold['train'],
+                                     columns, cols, target, time_steps, horizon, epochs, batch_size,
+                                     validation_split, model_kwargs or {}, budget, seed)
+                futures[future] = test_starts
+            for future in as_completed(futures):
+                result = future.result()
+                if result['budget'] is not None:
+                    budget.records['%s fold %d' % (arch, result['fold'])] = result['budget']
+                result['dates'] = index[futures[future] + time_steps + horizon - 1]
+                results[result['fold']] = result
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+    fold_rows, predictions = [], []
+    for k, fold in enumerate(folds):
+        result = results[k]
+        (train_start, train_stop), (test_start, test_stop) = fold['train'], fold['test']
+        fold_rows.append({'Fold': k, 'Model': arch,
+                          'Train from': index[train_start], 'Train to': index[train_stop - 1],
+                          'Test from': index[test_start], 'Test to': index[test_stop - 1],
+                          'Train windows': result['train_windows'], 'Test windows': len(result['y_true']),
+                          **accuracy_metrics(result['y_true'], result['y_pred']),
+                          'Seconds': result['seconds']})
+        predictions.append(pd.DataFrame({'Date': result['dates'], 'Fold': k, 'Actual': result['y_true'],
+                                         'Predicted': result['y_pred']}))
+    return pd.DataFrame(fold_rows), pd.concat(predictions, ignore_index=True)
+
+
+def summarize(folds):
+    """Mean and standard deviation of every metric across the folds."""
+    metrics = folds.drop(columns=['Fold']).select_dtypes('number')
+    return metrics.agg(['mean', 'std']).T
+
+
+def seasonal_metrics(predictions, by='season'):
+    """Metrics of the pooled test forecasts per 'season', 'month' or 'hour'."""
+    dates = pd.DatetimeIndex(predictions['Date'])
+    keys = {'season': dates.month.map(SEASONS), 'month': dates.month, 'hour': dates.hour}[by]
+    rows = {}
+    for key, group in predictions.groupby(np.asarray(keys)):
+        rows[key] = {**accuracy_metrics(group['Actual'], group['Predicted']), 'Windows': len(group)}
+    return pd.DataFrame.from_dict(rows, orient='index').rename_axis(by.capitalize())
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""Command-line entry point for the GHI forecasting workflow, with lazy imports.
+
+The scripts import TensorFlow, sklearn, matplotlib and seaborn before they
+do any work, so even scoring a saved model pays seconds of imports. Each
+subcommand here imports only what its own code path needs:
+
+    ingest    build the column and calendar-feature caches of a CSV   numpy, pandas
+    train     fit the scalers and a zoo model and save both           + sklearn, TensorFlow
+    predict   next-hour forecasts of a saved model                    + h5py
+    evaluate  metrics on the rows the model was not trained on        + sklearn
+    report    evaluate, plus per-season metrics and plots             + matplotlib
+    startup   fresh-process startup time and heavy imports per command
+
+predict runs the NumPy engine (numpy_inference) by default, so it imports
+neither TensorFlow nor sklearn (the saved scalers are applied through their
+affine maps), and no command but report imports the plotting stack.
+--engine keras scores with TensorFlow instead (Keras itself imports
+matplotlib when it is installed).
+
+    python cli.py ingest /content/busan_dataset.csv
+    python cli.py train /content/busan_dataset.csv /content/lstm.keras --arch LSTM --epochs 50
+    python cli.py predict /content/busan_dataset.csv /content/lstm.keras --last 24
+    python cli.py evaluate /content/busan_dataset.csv /content/lstm.keras
+    python cli.py report /content/busan_dataset.csv /content/lstm.keras --out /content/report
+    python cli.py startup /content/busan_dataset.csv /content/lstm.keras
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import warnings
+
+# The "8 MODEL.py" inputs; the target is scaled on its own and is an input as well
+REQUIRED_COLS = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure', 'Water', 'AOD', 'wv_500',
+                 'CI_Beyer', 'hour', 'month']
+ENGINES = ('numpy', 'keras')
+
+# Top-level packages reported by startup(), slowest to import first
+HEAVY_MODULES = ('tensorflow', 'keras', 'sklearn', 'scipy', 'matplotlib', 'seaborn', 'pandas', 'h5py')
+
+
+def ingest(path, refresh=False, use_hash=False, features=('hour', 'month')):
+    """Build (or refresh) the column cache and calendar features of `path`; returns a summary."""
+    import data_loader
+    from features import load_features
+
+    start = time.perf_counter()
+    fresh = not refresh and data_loader.is_cache_fresh(path, use_hash=use_hash)
+    arrays = data_loader.load_columns(path, use_hash=use_hash, refresh=refresh)
+    calendar = load_features(path, list(features))
+    dates = arrays[data_loader.DATE_COL].astype('datetime64[s]')
+    return {'path': path, 'cache': data_loader.default_cache_dir(path), 'cached': fresh, 'rows': len(dates),
+            'columns': len(arrays) - 1 + calendar.shape[1],
+            'first': str(dates[0]) if len(dates) else None, 'last': str(dates[-1]) if len(dates) else None,
+            'seconds': time.perf_counter() - start}
+
+
+def train(path, model_path, arch='LSTM', time_steps=7, horizon=1, columns=REQUIRED_COLS, target='GHI_Average',
+          train_ratio=0.7, epochs=50, batch_size=32, validation_split=0.1, model_kwargs=None, seed=0):
+    """Fit the scalers and zoo model `arch` on the first `train_ratio` of `path` and save both.
+
+    The model, its Preprocessor and the training extent go where
+    incremental.save_state puts them, so predict / evaluate (and
+    IncrementalTrainer) pick them up from `model_path`. Returns the history.
+    """
+    import tensorflow as tf
+
+    from incremental import load_frame, save_state
+    from models import ZOO, build_model
+    from preprocessing import Preprocessor
+    from windowing import make_windows, valid_starts
+
+    df = load_frame(path, columns)
+    trained = df.iloc[:int(len(df) * train_ratio)]
+    prep = Preprocessor(columns, [c for c in columns if c != target], target=target).fit(trained)
+    scaled = prep.transform_frame(trained)
+    X, y = make_windows(scaled, time_steps, target=target, horizon=horizon, flatten=ZOO[arch][1],
+                        starts=valid_starts(scaled, time_steps, horizon, target=target))
+    tf.keras.utils.set_random_seed(seed)
+    model = build_model(arch, time_steps, len(columns), **(model_kwargs or {}))
+    history = model.fit(X, y, epochs=epochs, batch_size=batch_size, validation_split=validation_split,
+                        shuffle=False, verbose=2)
+    os.makedirs(os.path.dirname(os.path.abspath(model_path)), exist_ok=True)
+    save_state(model, prep, model_path, trained, time_steps, horizon)
+    return history.history
+
+
+def _engine(model_path, engine):
+    # (predict function, input shape) of the saved model
+    if engine == 'numpy':
+        import numpy_inference
+
+        model = numpy_inference.load(model_path)
+        return lambda X: model.predict(X, batch_size=1024), tuple(model.input_shape)
+    if engine == 'keras':
+        from models import load_model
+
+        model = load_model(model_path)
+        return lambda X: model.predict(X, batch_size=1024, verbose=0), tuple(model.input_shape[1:])
+    raise ValueError('engine must be one of %r, got %r' % (ENGINES, engine))
+
+
+def forecast(path, model_path, engine='numpy', start=0, last=None, scored=False):
+    """Forecasts of a model saved by train (or incremental.save_state) on the data file `path`.
+
+    By default every gap-free window of time_steps rows is scored and its
+    forecast is stamped `horizon` hours after the window's last row. Windows
+    cannot span a gap (see windowing.valid_starts), so the last forecast is
+    the next hour beyond the file only if the file's final time_steps rows
+    are contiguous. Otherwise it is older, and a warning names the time of
+    the last forecast and the time the file ends. With `scored`, only
+    windows whose target row exists are scored, next to the actual GHI.
+    `start` skips windows whose target row comes before it and `last` keeps
+    the last `last`. Returns a Date-indexed DataFrame with 'Predicted' (and
+    'Actual').
+    """
+    import numpy as np
+    import pandas as pd
+
+    from incremental import STATE_SUFFIX, load_frame
+    from preprocessing import Preprocessor, artifact_path
+    from windowing import HOURLY, WindowIndex, make_windows
+
+    with open(model_path + STATE_SUFFIX) as f:
+        state = json.load(f)
+    time_steps, horizon = state['time_steps'], state['horizon']
+    prep = Preprocessor.load(artifact_path(model_path))
+    df = load_frame(path, prep.columns)
+    # Rows before `start` are only needed as the context of its first window
+    frame = df.iloc[max(start - time_steps - horizon + 1, 0):]
+    window_horizon = horizon if scored else 0
+    starts = WindowIndex.from_frame(frame, prep.target).valid_starts(time_steps, window_horizon)
+    if not scored and (not len(starts) or starts[-1] + time_steps != len(frame)):
+        after = (' the last forecast is for %s' % (frame.index[starts[-1] + time_steps - 1]
+                                                   + horizon * pd.Timedelta(HOURLY)) if len(starts)
+                 else ' there are no forecasts')
+        warnings.warn('%s ends at %s, but its last %d rows span a gap or hold NaNs, so%s'
+                      % (path, frame.index[-1], time_steps, after), stacklevel=2)
+    if last:
+        starts = starts[-last:]
+    X, y = make_windows(frame, time_steps, target=prep.target, horizon=window_horizon, starts=starts,
+                        dtype=prep.dtype)
+    prep.transform_(X.reshape(-1, X.shape[-1]))
+
+    predict, input_shape = _engine(model_path, engine)
+    if len(input_shape) == 1:
+        X = X.reshape(len(X), -1)
+    if X.shape[1:] != input_shape:
+        raise ValueError('%s takes inputs of shape %s, but its scalers give windows of %s'
+                         % (model_path, input_shape, X.shape[1:]))
+    y_pred = np.asarray(predict(X), dtype=prep.dtype) if len(X) else np.zeros((0, 1), dtype=prep.dtype)
+    dates = frame.index[starts + time_steps - 1] + horizon * pd.Timedelta(HOURLY)
+    result = pd.DataFrame({'Predicted': prep.inverse_target(y_pred[:, 0])},
+                          index=pd.DatetimeIndex(dates, name='Date'))
+    if scored:
+        result['Actual'] = y
+    return result
+
+
+def _held_out(model_path):
+    # The first row the saved model was not trained on
+    from incremental import STATE_SUFFIX
+
+    with open(model_path + STATE_SUFFIX) as f:
+        return json.load(f)['rows']
+
+
+def evaluate(path, model_path, engine='numpy', start=None):
+    """accuracy_metrics of the model on the windows whose target row is at or after `start`.
+
+    `start` defaults to the first row after the training rows. Returns
+    (metrics, forecasts).
+    """
+    from metrics import accuracy_metrics
+
+    start = _held_out(model_path) if start is None else start
+    forecasts = forecast(path, model_path, engine, start=start, scored=True)
+    if forecasts.empty:
+        raise ValueError('%s has no windows after row %d to evaluate on' % (path, start))
+    metrics = {key: float(value) for key, value in accuracy_metrics(forecasts['Actual'],
+                                                                      forecasts['Predicted']).items()}
+    return {**metrics, 'Windows': len(forecasts)}, forecasts
+
+
+def report(path, model_path, out, engine='numpy', start=None, hours=7 * 24):
+    """Write evaluate's metrics, per-season and per-hour metrics, the forecasts and plots to `out`."""
+    import matplotlib
+
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    from backtest import seasonal_metrics
+
+    metrics, forecasts = evaluate(path, model_path, engine, start)
+    os.makedirs(out, exist_ok=True)
+    with open(os.path.join(out, 'metrics.json'), 'w') as f:
+        json.dump(metrics, f, indent=1)
+    forecasts.to_csv(os.path.join(out, 'forecasts.csv'))
+    pooled = forecasts.reset_index()
+    tables = {by: seasonal_metrics(pooled, by) for by in ('season', 'hour')}
+    for by, table in tables.items():
+        table.to_csv(os.path.join(out, 'metrics_by_%s.csv' % by))
+
+    recent = forecasts.iloc[-hours:]
+    fig, ax = plt.subplots(figsize=(12, 5))
+    ax.plot(recent.index, recent['Actual'], marker='.', label='true')
+    ax.plot(recent.index, recent['Predicted'], 'r', label='predicted')
+    ax.set_title('True vs Predicted GHI Values (last %d forecasts)' % len(recent))
+    ax.legend()
+    fig.savefig(os.path.join(out, 'forecasts.png'), bbox_inches='tight')
+
+    fig, axs = plt.subplots(1, 2, figsize=(12, 5))
+    axs[0].scatter(forecasts['Actual'], forecasts['Predicted'], s=2, alpha=0.3)
+    limit = float(max(forecasts['Actual'].max(), forecasts['Predicted'].max()))
+    axs[0].plot([0, limit], [0, limit], 'k--', linewidth=1)
+    axs[0].set_xlabel('True GHI')
+    axs[0].set_ylabel('Predicted GHI')
+    axs[1].bar(tables['hour'].index, tables['hour']['RMSE'])
+    axs[1].set_xlabel('Hour')
+    axs[1].set_ylabel('RMSE')
+    fig.tight_layout()
+    fig.savefig(os.path.join(out, 'errors.png'), bbox_inches='tight')
+    plt.close('all')
+    return metrics
+
+
+# Imported up front by the scripts; startup() times this as the baseline
+SCRIPT_IMPORTS = ('tensorflow', 'sklearn.metrics', 'sklearn.preprocessing', 'matplotlib.pyplot', 'seaborn')
+
+_STARTUP = '''
+import contextlib, importlib, io, json, sys, time
+start = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    if {argv!r} is None:
+        for name in {imports!r}:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                pass
+    else:
+        import cli
+        try:
+            cli.main({argv!r})
+        except SystemExit:
+            pass
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds': seconds, 'modules': [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def _run_fresh(argv):
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL='3')
+    here = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [here, env.get('PYTHONPATH')]))
+    code = _STARTUP.format(argv=argv, imports=SCRIPT_IMPORTS, heavy=HEAVY_MODULES)
+    start = time.perf_counter()
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, check=True)
+    result = json.loads(out.stdout.splitlines()[-1])
+    result['process seconds'] = time.perf_counter() - start
+    return result
+
+
+def startup(path, model_path=None, repeats=3):
+    """Median wall time of each subcommand in a fresh process, and the heavy packages it imported.
+
+    The baseline row imports what the scripts import up front
+    (SCRIPT_IMPORTS) and does nothing else. train and report are left out:
+    their time goes to training and plotting, not to starting up.
+    """
+    import numpy as np
+    import pandas as pd
+
+    commands = {'script imports (baseline)': None, 'cli --help': ['--help'], 'ingest': ['ingest', path]}
+    if model_path:
+        commands.update({'predict --last 1': ['predict', path, model_path, '--last', '1'],
+                         'predict --engine keras --last 1': ['predict', path, model_path, '--engine', 'keras',
+                                                             '--last', '1'],
+                         'evaluate': ['evaluate', path, model_path]})
+    _run_fresh(['ingest', path])  # warm the data cache and the OS page cache
+    rows = []
+    for name, argv in commands.items():
+        runs = [_run_fresh(argv) for _ in range(repeats)]
+        rows.append({'Command': name, 'In-process s': float(np.median([r['seconds'] for r in runs])),
+                     'Process s': float(np.median([r['process seconds'] for r in runs])),
+                     'Heavy imports': ' '.join(runs[-1]['modules']) or '-'})
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('ingest', help='build the column and calendar-feature caches of a CSV')
+    p.add_argument('path')
+    p.add_argument('--refresh', action='store_true', help='rebuild the cache even if it is fresh')
+    p.add_argument('--hash', action='store_true', help='check freshness by content hash, not size and mtime')
+
+    p = commands.add_parser('train', help='fit the scalers and a zoo model and save both')
+    p.add_argument('path')
+    p.add_argument('model', help='where to save the model (.keras)')
+    p.add_argument('--arch', default='LSTM', help='models.ZOO architecture')
+    p.add_argument('--time-steps', type=int, default=7)
+    p.add_argument('--horizon', type=int, default=1)
+    p.add_argument('--train-ratio', type=float, default=0.7)
+    p.add_argument('--epochs', type=int, default=50)
+    p.add_argument('--batch-size', type=int, default=32)
+    p.add_argument('--units', type=int, help='units of the recurrent / dense layer')
+    p.add_argument('--seed', type=int, default=0)
+
+    for name, help_text in (('predict', 'next-hour forecasts of a saved model'),
+                            ('evaluate', 'metrics on the rows the model was not trained on'),
+                            ('report', 'evaluate, plus per-season metrics and plots')):
+        p = commands.add_parser(name, help=help_text)
+        p.add_argument('path')
+        p.add_argument('model', help='model saved by train')
+        p.add_argument('--engine', choices=ENGINES, default='numpy')
+        if name == 'predict':
+            p.add_argument('--last', type=int, help='only the last LAST forecasts')
+            p.add_argument('--out', help='CSV path (default: stdout)')
+        else:
+            p.add_argument('--start', type=int, help='first target row (default: the first untrained row)')
+        if name == 'report':
+            p.add_argument('--out', required=True, help='directory for the report files')
+
+    p = commands.add_parser('startup', help='startup time and heavy imports of each command')
+    p.add_argument('path')
+    p.add_argument('model', nargs='?', help='model saved by train, to time predict and evaluate')
+    p.add_argument('--repeats', type=int, default=3)
+
+    args = parser.parse_args(argv)
+    if args.command == 'ingest':
+        summary = ingest(args.path, refresh=args.refresh, use_hash=args.hash)
+        print(json.dumps(summary, indent=1))
+        return summary
+    if args.command == 'train':
+        model_kwargs = {} if args.units is None else {'units': args.units}
+        history = train(args.path, args.model, args.arch, args.time_steps, args.horizon,
+                        train_ratio=args.train_ratio, epochs=args.epochs, batch_size=args.batch_size,
+                        model_kwargs=model_kwargs, seed=args.seed)
+        print(args.model)
+        return history
+    if args.command == 'predict':
+        forecasts = forecast(args.path, args.model, args.engine, last=args.last)
+        forecasts.to_csv(args.out or sys.stdout, float_format='%.4f')
+        return forecasts
+    if args.command == 'evaluate':
+        metrics, _ = evaluate(args.path, args.model, args.engine, args.start)
+        print(json.dumps(metrics, indent=1))
+        return metrics
+    if args.command == 'report':
+        metrics = report(args.path, args.model, args.out, args.engine, args.start)
+        print(json.dumps(metrics, indent=1))
+        return metrics
+    import pandas as pd
+
+    df = startup(args.path, args.model, args.repeats)
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_colwidth', None):
+        print(df.round(3).to_string(index=False))
+    return df
+
+
+if __name__ == '__main__':
+    main()
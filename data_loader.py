@@ -0,0 +1,484 @@
+# -*- coding: utf-8 -*-
+"""Shared loader for busan_dataset.csv.
+
+Columns are typed by a declared schema (float32 measurements, one 'Date'
+column) and the 'Date' strings are parsed with explicit formats, so mixed
+'1/25/18 12:00' and '31/12/2019 15:00:00' rows never fall back to per-element
+inference or get their day and month swapped.
+
+The first load parses the CSV once and writes every column to its own .npy
+file in a cache directory next to the source file. Later loads check that the
+cache is still fresh (by size and mtime, or by content hash) and memory-map
+only the requested columns instead of re-parsing the text. When the file
+has only grown (rows appended, the bytes the cache was built from
+unchanged), only the new bytes are parsed and appended to the column files.
+"""
+
+import hashlib
+import io
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+from windowing import HOURLY, WindowIndex, make_windows, target_view, valid_starts, window_count, windows
+
+CACHE_VERSION = 2
+META_FILE = 'meta.json'
+DATE_COL = 'Date'
+
+# Declared column types; columns not listed here are read as float32 as well
+SCHEMA = {
+    'Date': 'datetime',
+    'SunZenith_KMU': 'float32',
+    'DHI_Average': 'float32',
+    'GHI_Average': 'float32',
+    'DNI_Average': 'float32',
+    'Ambient_Pressure': 'float32',
+    'Un': 'float32',
+    'Uo': 'float32',
+    'Water': 'float32',
+    'Un (atm-cm)': 'float32',
+    'Uo (atm-cm)': 'float32',
+    'AOD': 'float32',
+    'Alpha': 'float32',
+    'OT': 'float32',
+    'wv_500': 'float32',
+    'wv_625': 'float32',
+    'CI_Beyer': 'float32',
+    'CI_Perez': 'float32',
+    'CI_Hammer': 'float32',
+    'CI_ESRA': 'float32',
+    'GHI_FARMS /10': 'float32',
+    'GHI_FARMS': 'float32',
+    'Dif': 'float32',
+    'New_CC': 'float32',
+}
+
+# Timestamp layouts found in the station exports, tried in order. They differ in
+# year width and seconds, so a string can only ever match one of them.
+DATE_FORMATS = ('%m/%d/%y %H:%M', '%d/%m/%Y %H:%M:%S')
+
+# Calendar columns derived from the index (see features.py); skipped when projecting
+CALENDAR_COLS = ('hour', 'day_of_month', 'day_of_week', 'month', 'day_of_year',
+                 'hour_sin', 'hour_cos', 'day_of_week_sin', 'day_of_week_cos',
+                 'month_sin', 'month_cos', 'day_of_year_sin', 'day_of_year_cos')
+
+# Rows per chunk when building the cache or streaming windows
+CHUNK_ROWS = 100_000
+
+
+def default_cache_dir(path):
+    """Cache directory used for `path` when none is given."""
+    return os.fspath(path) + '.cache'
+
+
+def file_fingerprint(path, use_hash=False):
+    """Size and mtime of `path`, plus its SHA-1 when `use_hash` is set."""
+    st = os.stat(path)
+    fingerprint = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    if use_hash:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        fingerprint['sha1'] = digest.hexdigest()
+    return fingerprint
+
+
+def _read_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, META_FILE)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_cache_fresh(path, cache_dir=None, use_hash=False):
+    """True if the cache for `path` exists and matches the source file."""
+    cache_dir = cache_dir or default_cache_dir(path)
+    meta = _read_meta(cache_dir)
+    if meta is None or meta.get('version') != CACHE_VERSION:
+        return False
+    cached = meta['source']
+    current = file_fingerprint(path, use_hash=use_hash and 'sha1' in cached)
+    if use_hash and 'sha1' in cached:
+        # Content hash decides; a touched but unchanged file stays fresh
+        return current['sha1'] == cached['sha1']
+    return current['size'] == cached['size'] and current['mtime_ns'] == cached['mtime_ns']
+
+
+def parse_dates(values, formats=DATE_FORMATS):
+    """Parse timestamp strings that mix several explicit `formats`, in bulk.
+
+    Each format is applied vectorized to the rows no earlier format matched.
+    Raises ValueError if any non-empty string matches none of them.
+    """
+    values = pd.Series(values, copy=False).astype(str).str.strip()
+    parsed = pd.Series(pd.NaT, index=values.index, dtype='datetime64[ns]')
+    pending = np.ones(len(values), dtype=bool)
+    for fmt in formats:
+        rows = np.flatnonzero(pending)
+        if not len(rows):
+            break
+        attempt = pd.to_datetime(values.iloc[rows], format=fmt, errors='coerce')
+        hit = attempt.notna().to_numpy()
+        parsed.iloc[rows[hit]] = attempt[hit]
+        pending[rows[hit]] = False
+    unparsed = values[pending]
+    unparsed = unparsed[~unparsed.isin(['', 'nan', 'NaT'])]
+    if len(unparsed):
+        raise ValueError('unrecognised timestamps in %r, e.g. %r' % (DATE_COL, unparsed.iloc[0]))
+    return parsed
+
+
+def _projection(path, columns):
+    """Map stripped column names to the raw (possibly padded) CSV headers."""
+    header = pd.read_csv(path, nrows=0).columns
+    raw_by_name = {raw.strip(): raw for raw in header}
+    if columns is None:
+        return raw_by_name
+    names = [DATE_COL] + [c for c in columns if c != DATE_COL and c not in CALENDAR_COLS]
+    missing = [name for name in names if name not in raw_by_name]
+    if missing:
+        raise KeyError('columns not in %s: %s' % (path, missing))
+    return {name: raw_by_name[name] for name in names}
+
+
+def _apply_schema(df):
+    # Remove spaces on the column names once, here
+    df.columns = df.columns.str.strip()
+    for name in df.columns:
+        dtype = SCHEMA.get(name, 'float32')
+        if name == DATE_COL:
+            df[name] = parse_dates(df[name])
+        elif df[name].dtype != dtype:
+            # Stray text cells (e.g. 'B' in 'Un (atm-cm)') become NaN
+            df[name] = pd.to_numeric(df[name], errors='coerce').astype(dtype)
+    return df
+
+
+def read_csv_typed(path, columns=None, **kwargs):
+    """Read only `columns` (plus 'Date') from the CSV with the declared dtypes.
+
+    Extra keyword arguments go to pd.read_csv (e.g. chunksize, nrows,
+    skiprows); with `chunksize` an iterator of typed frames is returned.
+    """
+    projection = _projection(path, columns)
+
+    # Numbers are left to the C parser and cast afterwards: a column with stray
+    # text in one chunk must not abort the whole read
+    reader = pd.read_csv(path, usecols=list(projection.values()),
+                         dtype={projection[DATE_COL]: str}, **kwargs)
+    if 'chunksize' in kwargs:
+        return (_apply_schema(chunk) for chunk in reader)
+    return _apply_schema(reader)
+
+
+def _npy_header(dtype, rows):
+    """Magic string and header of a 1-D .npy file of `rows` `dtype` values."""
+    buf = io.BytesIO()
+    np.lib.format.write_array_header_1_0(buf, {'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                                               'fortran_order': False, 'shape': (rows,)})
+    return buf.getvalue()
+
+
+def _write_npy(filename, raw_filename, dtype, rows):
+    """Turn a raw column dump into an .npy file without loading it."""
+    with open(filename, 'wb') as out, open(raw_filename, 'rb') as raw:
+        out.write(_npy_header(dtype, rows))
+        shutil.copyfileobj(raw, out, 1 << 22)
+    os.remove(raw_filename)
+
+
+def build_cache(path, cache_dir=None, use_hash=False, chunksize=CHUNK_ROWS):
+    """Parse the CSV at `path` and write its columnar cache. Returns the cache dir.
+
+    The CSV is read `chunksize` rows at a time and each column appended to
+    its file, so building the cache never holds the whole table in memory.
+    The file's SHA-1 is recorded whatever `use_hash` says; `use_hash` only
+    decides whether is_cache_fresh compares it.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # Fingerprint before parsing so a file rewritten mid-parse is seen as stale. The
+    # SHA-1 is always kept: append_cache checks the cached prefix against it
+    source = file_fingerprint(path, use_hash=True)
+
+    columns, handles, rows = [], [], 0
+    try:
+        for chunk in read_csv_typed(path, chunksize=chunksize):
+            if not columns:
+                for i, name in enumerate(chunk.columns):
+                    kind = 'datetime' if name == DATE_COL else SCHEMA.get(name, 'float32')
+                    columns.append({'name': name, 'file': 'col_%03d.npy' % i, 'kind': kind})
+                    handles.append(open(os.path.join(cache_dir, 'col_%03d.raw' % i), 'wb'))
+            for entry, f in zip(columns, handles):
+                values = chunk[entry['name']].to_numpy()
+                if entry['kind'] == 'datetime':
+                    values = values.astype('datetime64[ns]').view(np.int64)
+                f.write(np.ascontiguousarray(values).tobytes())
+            rows += len(chunk)
+    finally:
+        for f in handles:
+            f.close()
+
+    for i, entry in enumerate(columns):
+        dtype = np.int64 if entry['kind'] == 'datetime' else entry['kind']
+        _write_npy(os.path.join(cache_dir, entry['file']),
+                   os.path.join(cache_dir, 'col_%03d.raw' % i), dtype, rows)
+
+    meta = {'version': CACHE_VERSION, 'source': source, 'rows': rows, 'columns': columns}
+
+    # meta.json is written last and atomically, so a half-written cache is never fresh
+    tmp = os.path.join(cache_dir, META_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp, os.path.join(cache_dir, META_FILE))
+    return cache_dir
+
+
+def append_cache(path, cache_dir=None):
+    """Extend the cache of `path` with the rows appended since it was built.
+
+    Returns False, leaving the cache as it is, unless the file only grew: it
+    is at least as long as when cached, those leading bytes still have the
+    cached SHA-1, and they end on a row boundary. Then only the bytes past
+    the old size are parsed, and each column file is cut back to the cached
+    row count (dropping whatever an interrupted append left behind) and
+    extended in place. meta.json is replaced last.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    meta = _read_meta(cache_dir)
+    if meta is None or meta.get('version') != CACHE_VERSION or 'sha1' not in meta['source']:
+        return False
+    old_size, rows = meta['source']['size'], meta['rows']
+    st = os.stat(path)
+    if st.st_size < old_size or not rows:
+        return False
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1()
+        for block in iter(lambda: f.read(min(1 << 20, old_size - f.tell())), b''):
+            digest.update(block)
+        if digest.hexdigest() != meta['source']['sha1']:
+            return False
+        f.seek(old_size - 1)
+        last = f.read(1)
+        tail = f.read()
+        f.seek(0)
+        header = f.readline()
+    digest.update(tail)
+    # The cached last row must be complete: either it ended with a newline or the
+    # appended bytes start a new line
+    if tail and last != b'\n' and not tail.startswith((b'\n', b'\r\n')):
+        return False
+
+    columns = meta['columns']
+    new_rows = 0
+    if tail.strip():
+        raw = pd.read_csv(io.BytesIO(header), nrows=0).columns
+        chunk = pd.read_csv(io.BytesIO(header + tail), dtype={c: str for c in raw if c.strip() == DATE_COL})
+        chunk = _apply_schema(chunk)
+        if list(chunk.columns) != [c['name'] for c in columns]:
+            return False
+        new_rows = len(chunk)
+    total = rows + new_rows
+    if new_rows:
+        # A header that grows with the row count would shift the data: rebuild instead
+        for entry in columns:
+            dtype = np.int64 if entry['kind'] == 'datetime' else entry['kind']
+            if len(_npy_header(dtype, rows)) != len(_npy_header(dtype, total)):
+                return False
+        for entry in columns:
+            dtype = np.int64 if entry['kind'] == 'datetime' else entry['kind']
+            values = chunk[entry['name']].to_numpy()
+            if entry['kind'] == 'datetime':
+                values = values.astype('datetime64[ns]').view(np.int64)
+            offset = len(_npy_header(dtype, rows))
+            with open(os.path.join(cache_dir, entry['file']), 'r+b') as f:
+                f.truncate(offset + rows * np.dtype(dtype).itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+                f.seek(0)
+                f.write(_npy_header(dtype, total))
+
+    meta['source'] = {'size': old_size + len(tail), 'mtime_ns': st.st_mtime_ns, 'sha1': digest.hexdigest()}
+    meta['rows'] = total
+    tmp = os.path.join(cache_dir, META_FILE + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f, indent=1)
+    os.replace(tmp, os.path.join(cache_dir, META_FILE))
+    return True
+
+
+def load_columns(path, columns=None, cache_dir=None, use_hash=False, refresh=False):
+    """Return {column name: memory-mapped array}, updating a stale cache first.
+
+    A file that only grew has its new rows appended (append_cache); any
+    other change, or `refresh`, rebuilds the cache. The 'Date' column comes
+    back as datetime64[ns]; all others with their SCHEMA dtype.
+    """
+    cache_dir = cache_dir or default_cache_dir(path)
+    if refresh or not (is_cache_fresh(path, cache_dir, use_hash=use_hash) or append_cache(path, cache_dir)):
+        build_cache(path, cache_dir, use_hash=use_hash)
+    meta = _read_meta(cache_dir)
+
+    by_name = {c['name']: c for c in meta['columns']}
+    names = list(by_name) if columns is None else list(columns)
+    missing = [name for name in names if name not in by_name]
+    if missing:
+        raise KeyError('columns not in %s: %s' % (path, missing))
+
+    arrays = {}
+    for name in names:
+        entry = by_name[name]
+        values = np.load(os.path.join(cache_dir, entry['file']), mmap_mode='r')
+        if entry['kind'] == 'datetime':
+            values = values.view('datetime64[ns]')
+        arrays[name] = values
+    return arrays
+
+
+def load_dataset(path, columns=None, cache_dir=None, use_hash=False, refresh=False, cache=True):
+    """Load the dataset as a DataFrame indexed by 'Date', going through the cache.
+
+    `columns` projects the frame to the given names; calendar features such as
+    'hour' or 'month' are derived from the index by the caller and skipped.
+    With `cache=False` the CSV is read directly, parsing only those columns.
+    """
+    if not cache:
+        return read_csv_typed(path, columns).set_index(DATE_COL)
+    wanted = None if columns is None else [DATE_COL] + [c for c in columns
+                                                       if c != DATE_COL and c not in CALENDAR_COLS]
+    arrays = load_columns(path, wanted, cache_dir=cache_dir, use_hash=use_hash, refresh=refresh)
+    index = pd.DatetimeIndex(arrays.pop(DATE_COL), name=DATE_COL)
+    return pd.DataFrame(arrays, index=index)
+
+
+def iter_chunks(path, columns=None, chunksize=CHUNK_ROWS, cache=True, cache_dir=None):
+    """Yield the dataset as Date-indexed frames of at most `chunksize` rows.
+
+    With `cache` the chunks are sliced from the memory-mapped columns, so only
+    the pages a chunk touches are ever resident; otherwise the CSV is parsed
+    chunk by chunk. Calendar columns in `columns` are derived from the index.
+    """
+    if cache:
+        wanted = None if columns is None else [DATE_COL] + [c for c in columns
+                                                           if c != DATE_COL and c not in CALENDAR_COLS]
+        arrays = load_columns(path, wanted, cache_dir=cache_dir)
+        dates = arrays.pop(DATE_COL)
+        for start in range(0, len(dates), chunksize):
+            stop = start + chunksize
+            index = pd.DatetimeIndex(dates[start:stop], name=DATE_COL)
+            chunk = pd.DataFrame({name: values[start:stop] for name, values in arrays.items()}, index=index)
+            yield _with_calendar(chunk, columns)
+    else:
+        for chunk in read_csv_typed(path, columns, chunksize=chunksize):
+            yield _with_calendar(chunk.set_index(DATE_COL), columns)
+
+
+def _with_calendar(df, columns):
+    if columns is None:
+        return df
+    calendar = [c for c in columns if c in CALENDAR_COLS]
+    if calendar:
+        from features import calendar_features
+        df = df.join(calendar_features(df.index, calendar))
+    return df[list(columns)]
+
+
+def _scaled_chunks(path, columns, scaler, cols, GHI_scaler, target, chunksize, cache, cache_dir):
+    # (dates, scaled float32 block) per chunk
+    columns = list(columns)
+    scaled_cols = [columns.index(c) for c in cols]
+    target_idx = columns.index(target)
+    for chunk in iter_chunks(path, columns, chunksize=chunksize, cache=cache, cache_dir=cache_dir):
+        # A writable copy: the memory-mapped columns (and copy-on-write frames) are read-only
+        values = chunk.to_numpy(dtype=np.float32, copy=True)
+        values[:, scaled_cols] = scaler.transform(values[:, scaled_cols])
+        values[:, [target_idx]] = GHI_scaler.transform(values[:, [target_idx]])
+        yield chunk.index.to_numpy(dtype='datetime64[ns]'), values
+
+
+def stream_scaled(path, columns, scaler, cols, GHI_scaler, target='GHI_Average',
+                  chunksize=CHUNK_ROWS, cache=True, cache_dir=None):
+    """Yield float32 [rows, len(columns)] blocks scaled with the fitted scalers.
+
+    `columns` is the feature order (the scripts' required_cols), `cols` the
+    inputs the fitted `scaler` was fitted on and `GHI_scaler` the fitted
+    target scaler, exactly as in the scripts.
+    """
+    for _, values in _scaled_chunks(path, columns, scaler, cols, GHI_scaler, target, chunksize, cache, cache_dir):
+        yield values
+
+
+def stream_windows(path, columns, scaler, cols, GHI_scaler, target='GHI_Average',
+                   time_steps=10, horizon=1, chunksize=CHUNK_ROWS, cache=True, cache_dir=None,
+                   starts=None, gap_aware=True, freq=HOURLY):
+    """Yield scaled (X, y) windows chunk by chunk with bounded memory.
+
+    Arguments are those of stream_scaled(). Windows are the ones make_windows
+    builds: X = rows [i, i + time_steps) and y = target at
+    i + time_steps + horizon - 1. The last time_steps + horizon - 1 rows of
+    each chunk and their dates are carried into the next, so no window is
+    lost or repeated and a segment that crosses a chunk boundary is still
+    seen whole. With `gap_aware` only the windows valid_starts would keep
+    are yielded (none spans a gap or holds a NaN); `starts` (row numbers in
+    the file, e.g. valid_starts of the full frame) picks them instead.
+    """
+    target_idx = list(columns).index(target)
+    starts = None if starts is None else np.asarray(starts)
+    carry = carry_dates = None
+    offset = 0  # file row of buf[0]
+    for dates, values in _scaled_chunks(path, columns, scaler, cols, GHI_scaler, target, chunksize, cache,
+                                        cache_dir):
+        buf = values if carry is None else np.concatenate([carry, values])
+        buf_dates = dates if carry is None else np.concatenate([carry_dates, dates])
+        n = window_count(len(buf), time_steps, horizon)
+        if n > 0:
+            X, y = windows(buf, time_steps, n), target_view(buf[:, target_idx], time_steps, horizon, n)
+            if starts is not None:
+                keep = starts[np.searchsorted(starts, offset):np.searchsorted(starts, offset + n)] - offset
+                X, y = X[keep], y[keep]
+            elif gap_aware:
+                nan_rows = np.isnan(buf)
+                index = WindowIndex(buf_dates, nan_rows.any(axis=1), nan_rows[:, target_idx], freq=freq)
+                keep = index.valid_starts(time_steps, horizon)
+                X, y = X[keep], y[keep]
+            yield X, y
+        carry, carry_dates = buf[n:], buf_dates[n:]
+        offset += n
+
+
+def check_stream_windows(path, columns, scaler, cols, GHI_scaler, target='GHI_Average', time_steps=10,
+                         horizon=1, chunksize=CHUNK_ROWS, cache=True, cache_dir=None, gap_aware=True):
+    """Compare stream_windows with make_windows over the whole scaled dataset.
+
+    Arguments are those of stream_windows(). The reference loads every row,
+    scales it in one pass and builds its windows with make_windows (at the
+    valid_starts of the whole frame with `gap_aware`). Returns the window
+    count; raises AssertionError if any window or target differs.
+    """
+    columns = list(columns)
+    frame = _with_calendar(load_dataset(path, columns, cache_dir=cache_dir, cache=cache), columns)
+    values = frame.to_numpy(dtype=np.float32, copy=True)
+    scaled_cols = [columns.index(c) for c in cols]
+    target_idx = columns.index(target)
+    values[:, scaled_cols] = scaler.transform(values[:, scaled_cols])
+    values[:, [target_idx]] = GHI_scaler.transform(values[:, [target_idx]])
+    starts = valid_starts(frame, time_steps, horizon, target=target, gap_aware=gap_aware)
+    X_ref, y_ref = make_windows(values, time_steps, target=target_idx, horizon=horizon, starts=starts)
+
+    streamed = list(stream_windows(path, columns, scaler, cols, GHI_scaler, target=target, time_steps=time_steps,
+                                   horizon=horizon, chunksize=chunksize, cache=cache, cache_dir=cache_dir,
+                                   gap_aware=gap_aware))
+    X = np.concatenate([X for X, _ in streamed]) if streamed else X_ref[:0]
+    y = np.concatenate([y for _, y in streamed]) if streamed else y_ref[:0]
+    if X.shape != X_ref.shape or not (np.array_equal(X, X_ref, equal_nan=True)
+                                      and np.array_equal(y, y_ref, equal_nan=True)):
+        raise AssertionError('stream_windows gave %d windows, make_windows %d, and they differ'
+                             % (len(X), len(X_ref)))
+    return len(X)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Local multi-worker data-parallel training on sharded window files.
+
+write_shards turns a scaled frame into an on-disk window dataset: the
+training windows are striped over `n_shards` pairs of .npy files (window i
+goes to shard i % n_shards, so every shard covers the whole period) and
+the validation tail goes to its own pair. train_distributed then launches
+one spawned worker process per shard; each memory-maps only its own shard.
+
+Training is synchronous parameter averaging (local SGD): every round the
+coordinator broadcasts the current weights, each worker fits `sync_every`
+epochs on its shard and returns its weights, and the coordinator averages
+them (weighted by shard size) and scores the average on the validation
+windows. Optimizer state stays local to each worker. This stands in for
+MultiWorkerMirroredStrategy, which Keras 3 cannot fit with; it needs no
+cluster setup and runs entirely on localhost.
+
+    write_shards(train, 'train_shards', n_shards=4, time_steps=10, validation_split=0.1)
+    lstm_model, history = train_distributed('train_shards', 'LSTM', epochs=50, batch_size=32,
+                                            model_kwargs={'units': 128, 'dropout': 0.2})
+"""
+
+import json
+import os
+import time
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from precision import data_dtype, get_precision
+from windowing import make_windows, valid_starts
+from zoo_runner import init_worker
+
+MANIFEST = 'shards.json'
+
+
+def write_shards(data, directory, n_shards, time_steps, target='GHI_Average', horizon=1,
+                 validation_split=0.0, starts=None, dtype=None):
+    """Write the windows of the scaled frame `data` as `n_shards` shards plus a validation shard.
+
+    Windows are the valid_starts windows (or `starts`); the last
+    `validation_split` of them are kept out of the training shards, as
+    fit(validation_split=...) does. Shards are gathered and written one at
+    a time. Returns the manifest.
+    """
+    dtype = dtype or data_dtype()
+    starts = valid_starts(data, time_steps, horizon, target=target) if starts is None else np.asarray(starts)
+    split_at = len(starts) - int(len(starts) * validation_split)
+    os.makedirs(directory, exist_ok=True)
+    parts = {'shard_%03d' % k: starts[k:split_at:n_shards] for k in range(n_shards)}
+    parts['validation'] = starts[split_at:]
+    for name, part in parts.items():
+        X, y = make_windows(data, time_steps, target=target, horizon=horizon, starts=part, dtype=dtype)
+        np.save(os.path.join(directory, name + '_X.npy'), X)
+        np.save(os.path.join(directory, name + '_y.npy'), y)
+    manifest = {'shards': ['shard_%03d' % k for k in range(n_shards)],
+                'windows': [len(parts['shard_%03d' % k]) for k in range(n_shards)],
+                'validation_windows': len(parts['validation']), 'time_steps': time_steps,
+                'features': data.shape[1], 'horizon': horizon, 'target': target,
+                'dtype': np.dtype(dtype).name}
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        return json.load(f)
+
+
+def open_shard(directory, name):
+    """Memory-mapped (X, y) of shard `name` ('shard_000', ..., or 'validation')."""
+    return (np.load(os.path.join(directory, name + '_X.npy'), mmap_mode='r'),
+            np.load(os.path.join(directory, name + '_y.npy'), mmap_mode='r'))
+
+
+def _worker(conn, directory, shard, arch, model_kwargs, batch_size, shuffle, threads, precision, seed):
+    init_worker(threads, precision)
+    try:
+        import tensorflow as tf
+        from models import ZOO, build_model
+
+        X, y = open_shard(directory, shard)
+        _, time_steps, n_features = X.shape
+        if ZOO[arch][1]:
+            X = X.reshape(len(X), -1)
+        tf.keras.utils.set_random_seed(seed)
+        model = build_model(arch, time_steps, n_features, **model_kwargs)
+        conn.send('ready')
+    except Exception as exc:
+        conn.send(exc)
+        return
+    while True:
+        message = conn.recv()
+        if message is None:
+            break
+        weights, epochs = message
+        try:
+            model.set_weights(weights)
+            history = model.fit(X, y, epochs=epochs, batch_size=batch_size, shuffle=shuffle, verbose=0)
+            conn.send((model.get_weights(), history.history['loss'][-1]))
+        except Exception as exc:
+            conn.send(exc)
+
+
+def _receive(conn):
+    message = conn.recv()
+    if isinstance(message, Exception):
+        raise message
+    return message
+
+
+def train_distributed(directory, arch='LSTM', epochs=50, sync_every=1, batch_size=32, model_kwargs=None,
+                      patience=None, min_delta=0.0, shuffle=False, workers=None, threads_per_worker=None,
+                      seed=0, precision=None):
+    """Train zoo model `arch` on the shards in `directory`, one worker process per shard.
+
+    Runs ceil(epochs / sync_every) averaging rounds of `sync_every` local
+    epochs. With `patience`, training stops once the validation loss has not
+    improved by `min_delta` for that many rounds, and the best averaged
+    weights are restored. Returns (model, history) where history has one row
+    per round: epochs, mean worker loss, val_loss and seconds.
+    """
+    import tensorflow as tf
+    from models import ZOO, build_model
+
+    manifest = read_manifest(directory)
+    shards = manifest['shards']
+    if workers is not None and workers != len(shards):
+        raise ValueError('%s holds %d shards, one per worker; rewrite it with n_shards=%d'
+                         % (directory, len(shards), workers))
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // len(shards))
+    precision = precision or get_precision()
+    model_kwargs = model_kwargs or {}
+
+    tf.keras.utils.set_random_seed(seed)
+    model = build_model(arch, manifest['time_steps'], manifest['features'], **model_kwargs)
+    X_val, y_val = open_shard(directory, 'validation')
+    if ZOO[arch][1]:
+        X_val = X_val.reshape(len(X_val), -1)
+    shard_weights = np.asarray(manifest['windows'], dtype=np.float64) / sum(manifest['windows'])
+
+    ctx = get_context('spawn')
+    conns, processes = [], []
+    for k, shard in enumerate(shards):
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(target=_worker, daemon=True,
+                              args=(child_conn, directory, shard, arch, model_kwargs, batch_size, shuffle,
+                                    threads_per_worker, precision, seed + k))
+        process.start()
+        conns.append(parent_conn)
+        processes.append(process)
+
+    rows, best, best_loss, waited, done = [], None, np.inf, 0, 0
+    try:
+        for conn in conns:
+            _receive(conn)
+        while done < epochs:
+            start = time.perf_counter()
+            round_epochs = min(sync_every, epochs - done)
+            weights = model.get_weights()
+            for conn in conns:
+                conn.send((weights, round_epochs))
+            results = [_receive(conn) for conn in conns]
+            model.set_weights([sum(w * results[k][0][i] for k, w in enumerate(shard_weights))
+                               for i in range(len(weights))])
+            done += round_epochs
+            row = {'epochs': done, 'loss': float(np.dot(shard_weights, [loss for _, loss in results]))}
+            if len(X_val):
+                row['val_loss'] = float(model.evaluate(X_val, y_val, batch_size=batch_size, verbose=0))
+            row['seconds'] = time.perf_counter() - start
+            rows.append(row)
+            if patience is not None and 'val_loss' in row:
+                if row['val_loss'] < best_loss - min_delta:
+                    best, best_loss, waited = model.get_weights(), row['val_loss'], 0
+                else:
+                    waited += 1
+                    if waited >= patience:
+                        break
+    finally:
+        for conn in conns:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+    if best is not None:
+        model.set_weights(best)
+    return model, pd.DataFrame(rows)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Calendar and time features derived from the 'Date' index.
+
+All features are computed in one vectorized pass over the int64 timestamps
+and returned as float32. load_features caches them next to the ingested
+data (in the data_loader cache directory) and, when the dataset grows, only
+computes the rows that were appended since the last call.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import data_loader
+
+CALENDAR_FEATURES = data_loader.CALENDAR_COLS
+
+FEATURE_DIR = 'features'
+
+
+def calendar_features(index, names=CALENDAR_FEATURES):
+    """DataFrame of calendar features `names` (float32) for a DatetimeIndex."""
+    dates = np.asarray(index, dtype='datetime64[ns]')
+    days = dates.astype('datetime64[D]')
+    months = dates.astype('datetime64[M]')
+    years = dates.astype('datetime64[Y]')
+
+    # Fractional hour so sub-hourly data keeps its position within the day
+    hour = (dates - days).astype(np.int64) / 3.6e12
+    day_of_week = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday; Monday = 0
+    month = months.astype(np.int64) % 12 + 1
+    day_of_month = (days - months.astype('datetime64[D]')).astype(np.int64) + 1
+    day_of_year = (days - years.astype('datetime64[D]')).astype(np.int64) + 1
+    year_length = ((years + 1).astype('datetime64[D]') - years.astype('datetime64[D]')).astype(np.int64)
+
+    base = {'hour': hour, 'day_of_month': day_of_month, 'day_of_week': day_of_week,
+            'month': month, 'day_of_year': day_of_year}
+    angles = {'hour': 2 * np.pi * hour / 24,
+              'day_of_week': 2 * np.pi * day_of_week / 7,
+              'month': 2 * np.pi * (month - 1) / 12,
+              'day_of_year': 2 * np.pi * (day_of_year - 1) / year_length}
+
+    columns = {}
+    for name in names:
+        if name in base:
+            columns[name] = base[name].astype(np.float32)
+        elif name.endswith('_sin') and name[:-4] in angles:
+            columns[name] = np.sin(angles[name[:-4]]).astype(np.float32)
+        elif name.endswith('_cos') and name[:-4] in angles:
+            columns[name] = np.cos(angles[name[:-4]]).astype(np.float32)
+        else:
+            raise KeyError('unknown calendar feature %r' % (name,))
+    return pd.DataFrame(columns, index=index)
+
+
+def _feature_meta(feature_dir):
+    try:
+        with open(os.path.join(feature_dir, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def update_feature_cache(path, cache_dir=None):
+    """Bring the cached calendar features of `path` up to date; returns the row count.
+
+    Rows already cached are kept if their timestamps are unchanged (the data
+    only grew); only the new tail is computed and appended. Anything else
+    rebuilds the feature cache.
+    """
+    cache_dir = cache_dir or data_loader.default_cache_dir(path)
+    dates = data_loader.load_columns(path, [data_loader.DATE_COL], cache_dir=cache_dir)[data_loader.DATE_COL]
+    feature_dir = os.path.join(cache_dir, FEATURE_DIR)
+    os.makedirs(feature_dir, exist_ok=True)
+
+    meta = _feature_meta(feature_dir)
+    done = 0
+    if meta is not None and meta['names'] == list(CALENDAR_FEATURES) and 0 < meta['rows'] <= len(dates):
+        rows = meta['rows']
+        if (dates[rows - 1].astype(np.int64) == meta['last'] and dates[0].astype(np.int64) == meta['first']
+                and all(os.path.exists(os.path.join(feature_dir, name + '.f32')) for name in CALENDAR_FEATURES)):
+            done = rows
+    if done == len(dates):
+        return done
+
+    new = calendar_features(pd.DatetimeIndex(dates[done:]))
+    for name in CALENDAR_FEATURES:
+        with open(os.path.join(feature_dir, name + '.f32'), 'r+b' if done else 'wb') as f:
+            # Cut back to the rows meta.json vouches for: a run interrupted between its
+            # append and the meta update must not leave those rows to be appended twice
+            f.truncate(done * 4)
+            f.seek(0, os.SEEK_END)
+            f.write(new[name].to_numpy().tobytes())
+
+    meta = {'names': list(CALENDAR_FEATURES), 'rows': len(dates),
+            'first': int(dates[0].astype(np.int64)) if len(dates) else 0,
+            'last': int(dates[-1].astype(np.int64)) if len(dates) else 0}
+    tmp = os.path.join(feature_dir, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(feature_dir, 'meta.json'))
+    return len(dates)
+
+
+def load_features(path, names=('hour', 'month'), cache_dir=None):
+    """Cached calendar features of `path`, indexed like data_loader.load_dataset."""
+    cache_dir = cache_dir or data_loader.default_cache_dir(path)
+    rows = update_feature_cache(path, cache_dir)
+    dates = data_loader.load_columns(path, [data_loader.DATE_COL], cache_dir=cache_dir)[data_loader.DATE_COL]
+    feature_dir = os.path.join(cache_dir, FEATURE_DIR)
+    columns = {}
+    for name in names:
+        if name not in CALENDAR_FEATURES:
+            raise KeyError('unknown calendar feature %r' % (name,))
+        columns[name] = np.memmap(os.path.join(feature_dir, name + '.f32'), dtype=np.float32,
+                                  mode='r', shape=(rows,)) if rows else np.empty(0, np.float32)
+    return pd.DataFrame(columns, index=pd.DatetimeIndex(dates, name=data_loader.DATE_COL))
@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""Local HTTP forecast service with request micro-batching.
+
+Loads a trained model and its Preprocessor (the scalers saved next to it
+with artifact_path) and serves inverse-scaled GHI forecasts. A single
+predict call costs milliseconds of fixed overhead. MicroBatcher therefore
+coalesces the windows of concurrent requests: a batch closes once it holds
+`max_batch` windows or `max_latency` seconds after its first request
+arrived, and is scored by one predict call.
+
+Endpoints (JSON; rows are raw values in the order of `columns`):
+    POST /predict  {"windows": [[[...], ...], ...]}  -> {"ghi": [...]}
+                   {"rows": [[...], ...]}  (one site's latest rows; the last
+                   time_steps are used)      -> {"ghi": [...]}
+    GET  /health   model path, columns, time_steps
+    GET  /stats    requests, windows and batches served
+
+    python forecast_service.py /content/best_model.h5.keras --port 8080 --max-latency-ms 5
+    python forecast_service.py /content/best_model.h5.keras --unix /tmp/forecast.sock
+    python forecast_service.py /content/best_model.h5.keras --bench
+"""
+
+import argparse
+import http.client
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+
+class ForecastModel:
+    """A trained model with its Preprocessor, mapping raw windows to GHI.
+
+    Windows are [n, time_steps, len(prep.columns)] raw values. The model's
+    inputs are `features` of those columns: by default all of them, or all
+    but the target when the model has one input fewer (the multivariate
+    script). Dense models on flattened windows need `time_steps`.
+    """
+
+    def __init__(self, model_path, prep_path=None, features=None, time_steps=None):
+        from models import load_model
+        from preprocessing import Preprocessor, artifact_path
+
+        self.model_path = model_path
+        self.model = load_model(model_path)
+        self.prep = Preprocessor.load(prep_path or artifact_path(model_path))
+        columns = self.prep.columns
+        shape = self.model.input_shape
+        self.flatten = len(shape) == 2
+        if self.flatten and time_steps is None:
+            raise ValueError('%s takes flattened windows; pass time_steps' % (model_path,))
+        self.time_steps = time_steps if self.flatten else shape[1]
+        n_inputs = shape[1] // self.time_steps if self.flatten else shape[2]
+        if features is None:
+            if n_inputs == len(columns):
+                features = columns
+            elif n_inputs == len(columns) - 1:
+                features = [c for c in columns if c != self.prep.target]
+            else:
+                raise ValueError('%s takes %d features per step but its scalers cover %d columns; '
+                                 'pass features' % (model_path, n_inputs, len(columns)))
+        self.features = list(features)
+        self.feature_idx = np.array([columns.index(c) for c in self.features])
+
+    @property
+    def columns(self):
+        return self.prep.columns
+
+    def as_windows(self, payload):
+        """Windows [n, time_steps, columns] from a request's 'windows' or 'rows'."""
+        if 'windows' in payload:
+            X = np.asarray(payload['windows'], dtype=self.prep.dtype)
+            if X.ndim != 3 or X.shape[1:] != (self.time_steps, len(self.columns)):
+                raise ValueError('windows must be [n, %d, %d], got %s'
+                                 % (self.time_steps, len(self.columns), list(X.shape)))
+            return X
+        if 'rows' in payload:
+            rows = np.asarray(payload['rows'], dtype=self.prep.dtype)
+            if rows.ndim != 2 or rows.shape[0] < self.time_steps or rows.shape[1] != len(self.columns):
+                raise ValueError('rows must be [>= %d, %d], got %s'
+                                 % (self.time_steps, len(self.columns), list(rows.shape)))
+            return rows[None, -self.time_steps:]
+        raise ValueError("request needs 'windows' or 'rows'")
+
+    def predict(self, X):
+        """Inverse-scaled forecasts [n] (or [n, outputs]) for raw windows X."""
+        X = np.array(X, dtype=self.prep.dtype)
+        self.prep.transform_(X.reshape(-1, X.shape[-1]))
+        X = X[..., self.feature_idx]
+        if self.flatten:
+            X = X.reshape(len(X), -1)
+        y = np.asarray(self.model.predict_on_batch(X), dtype=self.prep.dtype)
+        return self.prep.inverse_target(y[:, 0] if y.shape[-1] == 1 else y)
+
+
+class MicroBatcher:
+    """Coalesces concurrent predict calls into batches scored by one `predict(X)` call."""
+
+    def __init__(self, predict, max_batch=1024, max_latency=0.005):
+        self._predict = predict
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.stats = {'requests': 0, 'windows': 0, 'batches': 0}
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, X):
+        """Queue windows X; returns a Future of their forecasts."""
+        if self._closed:
+            raise RuntimeError('the batcher is closed')
+        future = Future()
+        self._queue.put((X, future))
+        return future
+
+    def predict(self, X, timeout=None):
+        return self.submit(X).result(timeout)
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch, n = [item], len(item[0])
+            deadline = time.monotonic() + self.max_latency
+            while n < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # finish this batch, then stop
+                    break
+                batch.append(item)
+                n += len(item[0])
+            self._run(batch, n)
+
+    def _run(self, batch, n):
+        try:
+            y = self._predict(np.concatenate([X for X, _ in batch]))
+        except Exception as exc:
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        self.stats['requests'] += len(batch)
+        self.stats['windows'] += n
+        self.stats['batches'] += 1
+        offset = 0
+        for X, future in batch:
+            future.set_result(y[offset:offset + len(X)])
+            offset += len(X)
+
+    def close(self):
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive: clients reuse their connection
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        forecaster, batcher = self.server.forecaster, self.server.batcher
+        if self.path == '/health':
+            self._reply(200, {'model': forecaster.model_path, 'columns': forecaster.columns,
+                              'features': forecaster.features, 'time_steps': forecaster.time_steps})
+        elif self.path == '/stats':
+            self._reply(200, batcher.stats)
+        else:
+            self._reply(404, {'error': 'unknown path %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._reply(404, {'error': 'unknown path %s' % self.path})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            if not isinstance(payload, dict):
+                raise ValueError('request body must be a JSON object, got %s' % type(payload).__name__)
+            X = self.server.forecaster.as_windows(payload)
+        except (ValueError, TypeError) as exc:
+            # TypeError: values that are not numbers, e.g. {"windows": null}
+            self._reply(400, {'error': str(exc)})
+            return
+        try:
+            y = self.server.batcher.predict(X)
+        except Exception as exc:
+            self._reply(500, {'error': '%s: %s' % (type(exc).__name__, exc)})
+            return
+        self._reply(200, {'ghi': y.tolist()})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # listen backlog; the default 5 resets bursts of new clients
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+
+def serve(forecaster, host='127.0.0.1', port=8080, unix_socket=None, max_batch=1024, max_latency=0.005):
+    """Start serving `forecaster` (a ForecastModel) on a TCP port or a Unix socket, in a background thread.
+
+    Returns the server; server.shutdown() then server.batcher.close() stops it.
+    """
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = _UnixHTTPServer(unix_socket, _Handler)
+    else:
+        server = _HTTPServer((host, port), _Handler)
+    server.forecaster = forecaster
+    server.batcher = MicroBatcher(forecaster.predict, max_batch=max_batch, max_latency=max_latency)
+    threading.Thread(target=server.serve_forever, name='forecast-service', daemon=True).start()
+    return server
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def connect(address, timeout=60):
+    """An HTTP connection to the service at (host, port) or a Unix socket path."""
+    if isinstance(address, str):
+        return _UnixConnection(address, timeout)
+    return http.client.HTTPConnection(*address, timeout=timeout)
+
+
+def request(conn, payload):
+    """POST /predict on `conn`; returns the forecasts."""
+    conn.request('POST', '/predict', body=json.dumps(payload), headers={'Content-Type': 'application/json'})
+    response = conn.getresponse()
+    body = json.loads(response.read())
+    if response.status != 200:
+        raise RuntimeError('forecast service: %s' % body.get('error'))
+    return body['ghi']
+
+
+def load_test(address, windows, concurrency=64, requests=2000):
+    """Send `requests` single-window requests from `concurrency` client threads.
+
+    Returns requests per second and the median / 99th percentile latency.
+    """
+    payloads = [json.dumps({'windows': windows[i % len(windows)][None].tolist()}) for i in range(requests)]
+    latencies = []
+    lock = threading.Lock()
+    next_request = iter(range(requests))
+
+    def client():
+        conn = connect(address)
+        own = []
+        while True:
+            with lock:
+                i = next(next_request, None)
+            if i is None:
+                break
+            start = time.perf_counter()
+            conn.request('POST', '/predict', body=payloads[i], headers={'Content-Type': 'application/json'})
+            conn.getresponse().read()
+            own.append(time.perf_counter() - start)
+        conn.close()
+        with lock:
+            latencies.extend(own)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    latencies = np.asarray(latencies) * 1e3
+    return {'Requests/s': requests / seconds, 'p50 ms': float(np.percentile(latencies, 50)),
+            'p99 ms': float(np.percentile(latencies, 99))}
+
+
+def benchmark(forecaster, windows, settings=((1, 0.0), (256, 0.002), (1024, 0.005)), concurrency=64,
+              requests=2000):
+    """load_test a local server per (max_batch, max_latency) setting; (1, 0) is one predict per request."""
+    rows = []
+    for max_batch, max_latency in settings:
+        server = serve(forecaster, port=0, max_batch=max_batch, max_latency=max_latency)
+        try:
+            result = load_test(server.server_address[:2], windows, concurrency, requests)
+        finally:
+            server.shutdown()
+            server.server_close()
+            server.batcher.close()
+        stats = server.batcher.stats
+        rows.append({'Max batch': max_batch, 'Max latency ms': max_latency * 1e3, **result,
+                     'Mean batch': stats['windows'] / max(stats['batches'], 1)})
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('model', help='saved model; its scalers are read from <model>.scalers.npz')
+    parser.add_argument('--scalers', help='Preprocessor file, if not next to the model')
+    parser.add_argument('--time-steps', type=int, help='window length of Dense models on flattened windows')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--unix', help='serve on this Unix socket instead of TCP')
+    parser.add_argument('--max-batch', type=int, default=1024)
+    parser.add_argument('--max-latency-ms', type=float, default=5.0)
+    parser.add_argument('--bench', action='store_true', help='load-test batching settings and exit')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    forecaster = ForecastModel(args.model, args.scalers, time_steps=args.time_steps)
+    if args.bench:
+        rng = np.random.default_rng(0)
+        windows = rng.standard_normal((256, forecaster.time_steps, len(forecaster.columns)))
+        windows = forecaster.prep.inverse_transform_(windows.astype(forecaster.prep.dtype).reshape(
+            -1, len(forecaster.columns))).reshape(windows.shape)
+        df = benchmark(forecaster, windows, concurrency=args.concurrency, requests=args.requests)
+        print(df.round(3).to_string(index=False))
+        return df
+    server = serve(forecaster, args.host, args.port, args.unix, args.max_batch, args.max_latency_ms / 1e3)
+    print('serving %s on %s' % (args.model, args.unix or '%s:%d' % server.server_address[:2]))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        server.batcher.close()
+
+
+if __name__ == '__main__':
+    main()
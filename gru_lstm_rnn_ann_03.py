@@ -19,21 +19,20 @@ import warnings
 warnings.filterwarnings('ignore')
 from sklearn.metrics import mean_squared_error, explained_variance_score, max_error
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import RobustScaler
+from data_loader import load_dataset
+from features import load_features
+from preprocessing import Preprocessor
+from windowing import make_windows, valid_starts, window_count
+from training_budget import TrainingBudget
 
 """# **LOAD DATA**"""
 
-# Import the CSV file
-df = pd.read_csv("/content/busan_dataset.csv")
-df.head()
-
-# Remove spaces on the column
-df.columns = df.columns.str.lstrip()
-df.columns = df.columns.str.rstrip()
+# Columns the models use; only these are loaded (hour/month are derived below)
+required_cols = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure', 'Water', 'AOD', 'wv_500', 'CI_Beyer', 'hour', 'month']
 
-# Parse the "Date" column
-df['Date'] = pd.to_datetime(df['Date'])
-df.set_index('Date', inplace=True)
+# Load the dataset through the columnar cache (float32, column names stripped, indexed by Date)
+df = load_dataset("/content/busan_dataset.csv", columns=required_cols)
+df.head()
 
 """# **DATA EXPLORATION**"""
 
@@ -53,12 +52,10 @@ df.isna().sum()
 
 """# **DATA ENGINEERING**"""
 
-# Extracting features from the index before filtering the DataFrame
-df['hour'] = df.index.hour
-df['month'] = df.index.month
+# Calendar features from the cached feature stage (float32, computed once per new row)
+df = df.join(load_features("/content/busan_dataset.csv", ['hour', 'month']))
 
 # Now filter the DataFrame to include only the required columns and the new features
-required_cols = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure', 'Water', 'AOD', 'wv_500', 'CI_Beyer', 'hour', 'month']
 df = df[required_cols]
 
 # Display the first few rows to confirm the columns are present
@@ -118,37 +115,34 @@ print('Validation size:', len(validation))
 # Input Scaling
 cols = ['SunZenith_KMU', 'Ambient_Pressure', 'Water', 'AOD', 'wv_500', 'CI_Beyer', 'hour', 'month']
 
-scaler = RobustScaler()
-scaler = scaler.fit(np.asarray(train[cols]))
-
-train.loc[:, cols] = scaler.transform(np.asarray(train[cols]))
-test.loc[:, cols] = scaler.transform(np.asarray(test[cols]))
-
-# scaling GHI
-GHI_scaler = RobustScaler()
-GHI_scaler = GHI_scaler.fit(train[['GHI_Average']])
-train['GHI_Average'] = GHI_scaler.transform(train[['GHI_Average']])
-test['GHI_Average'] = GHI_scaler.transform(test[['GHI_Average']])
+# Fit the input scaler (cols) and the GHI scaler on the training split, then scale
+# float32 copies of train/test in one fused pass (no chained assignment on slices of df)
+prep = Preprocessor(required_cols, cols, target='GHI_Average').fit(train)
+scaler, GHI_scaler = prep.scaler, prep.target_scaler
+train = prep.transform_frame(train)
+test = prep.transform_frame(test)
 
 print('Train shape:',train.shape)
 print('Test shape:', test.shape)
 
 """# **MODEL BUILDING**"""
 
-def create_dataset(X, y, time_steps=1):
-    Xs, ys = [], []
-    for i in range(len(X) - time_steps):
-        v = X.iloc[i:(i + time_steps)].values
-        Xs.append(v)
-        ys.append(y.iloc[i + time_steps])
-    return np.array(Xs), np.array(ys)
-
 time_steps = 7
-# reshape to [samples, time_steps, features]
-X_train, y_train = create_dataset(train, train.GHI_Average, time_steps)
-X_test, y_test = create_dataset(test, test.GHI_Average, time_steps)
+# Only gap-free windows (see windowing); gap_aware = False restores every window
+gap_aware = True
+train_starts = valid_starts(train, time_steps, gap_aware=gap_aware)
+test_starts = valid_starts(test, time_steps, gap_aware=gap_aware)
+print(f'Windows kept: train {len(train_starts)} of {window_count(len(train), time_steps)}, '
+      f'test {len(test_starts)} of {window_count(len(test), time_steps)}')
+# [samples, time_steps, features] windows starting at those rows
+X_train, y_train = make_windows(train, time_steps, target='GHI_Average', starts=train_starts)
+X_test, y_test = make_windows(test, time_steps, target='GHI_Average', starts=test_starts)
 print(X_train.shape, y_train.shape)
 
+# Shared training policy for every fit: early stopping on val_loss (best weights restored),
+# learning rate reduced on plateaus, and optional per-fit epoch / wall-clock caps
+budget = TrainingBudget(patience=10, schedule='plateau', max_epochs=None, max_seconds=None)
+
 """# **GRU**"""
 
 # GRU model design
@@ -160,7 +154,8 @@ gru_model.add(tf.keras.layers.Dense(units=1))
 gru_model.compile(loss='mean_squared_error', optimizer='adam')
 gru_model.summary()
 
-gru_history = gru_model.fit(X_train, y_train,epochs=100,batch_size=64,validation_split=0.15,shuffle=False)
+gru_history = gru_model.fit(X_train, y_train,epochs=100,batch_size=64,validation_split=0.15,shuffle=False,
+                            callbacks=budget.callbacks('GRU'))
 
 # history plotting
 plt.plot(gru_history.history['loss'], label='train')
@@ -233,7 +228,8 @@ lstm_model.add(tf.keras.layers.Dropout(rate=0.5))
 lstm_model.add(tf.keras.layers.Dense(units=1))
 lstm_model.compile(loss='mse', optimizer='adam')
 
-lstm_history = lstm_model.fit(X_train, y_train,epochs=100,batch_size=64,validation_split=0.15,shuffle=False)
+lstm_history = lstm_model.fit(X_train, y_train,epochs=100,batch_size=64,validation_split=0.15,shuffle=False,
+                              callbacks=budget.callbacks('LSTM'))
 
 lstm_model.summary()
 
@@ -303,7 +299,8 @@ rnn_model.add(tf.keras.layers.Dense(units=1))
 rnn_model.compile(loss='mse', optimizer='adam')
 
 # Train the model
-rnn_history = rnn_model.fit(X_train, y_train, epochs=100, batch_size=64, validation_split=0.15, shuffle=False)
+rnn_history = rnn_model.fit(X_train, y_train, epochs=100, batch_size=64, validation_split=0.15, shuffle=False,
+                            callbacks=budget.callbacks('RNN'))
 
 # Model summary
 rnn_model.summary()
@@ -372,20 +369,11 @@ import tensorflow as tf
 ann_train = train.copy()
 ann_test = test.copy()
 
-# Function to flatten and reshape the data for ANN input
-def create_ann_dataset(X, y, time_steps=1):
-    Xs, ys = [], []
-    for i in range(len(X) - time_steps):
-        v = X.iloc[i:(i + time_steps)].values
-        Xs.append(v.flatten())  # Flatten the input for ANN
-        ys.append(y.iloc[i + time_steps])
-    return np.array(Xs), np.array(ys)
-
 time_steps = 7
 
-# Use the copied datasets to flatten and reshape for ANN
-X_ANN_train, y_ANN_train = create_ann_dataset(ann_train, ann_train['GHI_Average'], time_steps)
-X_ANN_test, y_ANN_test = create_ann_dataset(ann_test, ann_test['GHI_Average'], time_steps)
+# Use the copied datasets to build flattened [samples, time_steps * features] windows for ANN
+X_ANN_train, y_ANN_train = make_windows(ann_train, time_steps, target='GHI_Average', flatten=True, starts=train_starts)
+X_ANN_test, y_ANN_test = make_windows(ann_test, time_steps, target='GHI_Average', flatten=True, starts=test_starts)
 
 print("X_ANN_train shape:", X_ANN_train.shape)
 print("y_ANN_train shape:", y_ANN_train.shape)
@@ -401,7 +389,8 @@ ann_model.compile(loss='mean_squared_error', optimizer='adam')
 ann_model.summary()
 
 # Train the model
-ann_history = ann_model.fit(X_ANN_train, y_ANN_train, epochs=100, batch_size=64, validation_split=0.15, shuffle=False)
+ann_history = ann_model.fit(X_ANN_train, y_ANN_train, epochs=100, batch_size=64, validation_split=0.15, shuffle=False,
+                            callbacks=budget.callbacks('ANN'))
 
 # model validation
 plt.plot(ann_history.history['loss'], label='train')
@@ -548,4 +537,28 @@ plt.title('Comparison of Model Predictions with Actual Values')
 plt.xlabel('Time')
 plt.ylabel('GHI')
 plt.legend()
-plt.show()
\ No newline at end of file
+plt.show()
+
+"""# **TRAINING BUDGET**"""
+
+# Epochs run per model, what stopped it, and the epochs / seconds saved against 100 epochs
+budget.report()
+
+"""# **WALK-FORWARD BACKTEST**"""
+
+from backtest import backtest, seasonal_metrics, summarize
+
+# One 70/15/15 split says nothing about seasons: forecast 5 consecutive blocks
+# of the whole series instead, each with a model trained on every earlier row
+# (scalers refit per fold). Folds train in parallel.
+backtest_folds, backtest_predictions = backtest(df, 'LSTM', n_folds=5, mode='expanding',
+                                                time_steps=time_steps, epochs=100, batch_size=64,
+                                                budget=budget)
+backtest_folds
+
+summarize(backtest_folds)
+
+# Accuracy of the pooled out-of-sample forecasts per season and per month
+seasonal_metrics(backtest_predictions, by='season')
+
+seasonal_metrics(backtest_predictions, by='month')
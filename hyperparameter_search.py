@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""Parallel hyperparameter search over the model zoo with successive halving.
+
+Configurations are sampled from SPACES and trained by asynchronous
+successive halving (ASHA): every new trial runs for `min_epochs`, and a
+trial is promoted to the next rung (eta times more epochs, continuing from
+its checkpoint) only once it ranks in the top 1/eta of the trials finished at
+its rung. Poor configurations are therefore dropped after a few epochs.
+Trials of all architectures run concurrently in zoo_runner worker processes.
+The windows of each time_steps value are built once and shared through
+shared memory.
+
+Trials are scored on a validation tail of the training windows, never on the
+test set. Valid windows depend on time_steps (longer ones fit in fewer
+daylight runs), so every trial is scored on the same target rows: those of
+the last `validation_split` of the valid windows of the longest time_steps
+searched. A shorter window ending at one of those rows is always valid too.
+Each trial trains on its windows whose target comes before them. Every
+trial and rung result is appended to <directory>/trials.jsonl and each
+model is checkpointed after every rung, under its epoch count, so running
+search() again on the same directory resumes an interrupted search from
+exactly the epochs its last logged result reached.
+
+    trials = search(train, directory='search_results', n_trials=20)
+    best_configs(trials)
+"""
+
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from precision import get_precision
+from windowing import make_windows, valid_starts
+from zoo_runner import ZOO_NAMES, attach_cached, init_worker, share_arrays
+
+# Parameters that shape the data rather than the model
+DATA_PARAMS = ('time_steps', 'batch_size')
+
+_RECURRENT = {'units': [64, 100, 128], 'dropout': [0.2, 0.5], 'time_steps': [6, 7, 10], 'batch_size': [32, 64]}
+
+# models.build_dense: width and number of the hidden layers on the flattened windows
+_DENSE = {'units': [32, 64, 100, 256], 'hidden_layers': [1, 2, 3], 'dropout': [0.2, 0.5],
+          'time_steps': [6, 7, 10], 'batch_size': [32, 64]}
+
+# architecture -> {parameter: choices}; covers the values the scripts hard-code
+SPACES = {
+    'GRU': _RECURRENT,
+    'LSTM': _RECURRENT,
+    'RNN': _RECURRENT,
+    'ANN': _DENSE,
+    'MLP': _DENSE,
+    'DNN': _DENSE,
+    'CNN': {'filters': [32, 64], 'kernel_size': [2, 3], 'dropout': [0.2, 0.5],
+            'time_steps': [6, 7, 10], 'batch_size': [32, 64]},
+    'SVR': {'C': [1, 10, 100, 1000], 'gamma': [0.01, 0.1, 1.0, 'scale'], 'epsilon': [0.01, 0.1],
+            'time_steps': [6, 7, 10]},
+}
+
+TRIALS_FILE = 'trials.jsonl'
+
+
+def rung_epochs(min_epochs, max_epochs, eta):
+    """Epoch budget of every rung: min_epochs * eta**k, capped by (and ending at) max_epochs."""
+    rungs = [min_epochs]
+    while rungs[-1] * eta < max_epochs:
+        rungs.append(rungs[-1] * eta)
+    if rungs[-1] < max_epochs:
+        rungs.append(max_epochs)
+    return rungs
+
+
+class SuccessiveHalving:
+    """Asynchronous successive-halving bookkeeping for one architecture."""
+
+    def __init__(self, rungs, eta):
+        self.rungs = rungs
+        self.eta = eta
+        self.losses = [{} for _ in rungs]
+
+    def record(self, trial_id, rung, loss):
+        self.losses[rung][trial_id] = loss
+
+    def promotion(self, busy=()):
+        """(trial_id, rung) of a trial to promote out of `rung`, highest rung first, or None."""
+        for rung in range(len(self.rungs) - 2, -1, -1):
+            done = self.losses[rung]
+            top = sorted(done, key=done.get)[:len(done) // self.eta]
+            for trial_id in top:
+                if trial_id not in self.losses[rung + 1] and trial_id not in busy:
+                    return trial_id, rung
+        return None
+
+
+def _window_arrays(data, time_steps_values, target, validation_split):
+    """Training then validation windows per time_steps, and where the validation part starts.
+
+    The validation targets are the same rows for every time_steps (see the
+    module docstring).
+    """
+    starts = {ts: valid_starts(data, ts, target=target) for ts in time_steps_values}
+    longest = max(time_steps_values)
+    targets = starts[longest] + longest
+    val_targets = targets[len(targets) - int(len(targets) * validation_split):]
+    first_val = val_targets[0] if len(val_targets) else len(data)
+    arrays, splits = {}, {}
+    for time_steps, ts_starts in starts.items():
+        ts_targets = ts_starts + time_steps
+        train_part = ts_starts[ts_targets < first_val]
+        val_part = ts_starts[np.isin(ts_targets, val_targets)]
+        X, y = make_windows(data, time_steps, target=target, starts=np.concatenate([train_part, val_part]),
+                            dtype=np.float32)
+        arrays['X_%d' % time_steps], arrays['y_%d' % time_steps] = X, y
+        splits[time_steps] = len(train_part)
+    return arrays, splits
+
+
+def checkpoint_path(directory, trial_id, epochs):
+    """Where trial `trial_id` is checkpointed after `epochs` epochs."""
+    return os.path.join(os.path.abspath(directory), 'trial_%04d_e%03d.keras' % (trial_id, epochs))
+
+
+def _run_trial(arch, params, specs, from_epochs, to_epochs, directory, trial_id, split_at, seed):
+    arrays = attach_cached(specs)
+    X, y = arrays['X'], arrays['y']
+    start = time.perf_counter()
+    model_params = {k: v for k, v in params.items() if k not in DATA_PARAMS}
+    if arch == 'SVR':
+        from sklearn.svm import SVR
+
+        X = X.reshape(len(X), -1)
+        model = SVR(kernel='rbf', **model_params).fit(X[:split_at], y[:split_at])
+        val_loss = float(np.mean((model.predict(X[split_at:]) - y[split_at:]) ** 2))
+    else:
+        import tensorflow as tf
+        from models import ZOO, build_model
+
+        if ZOO[arch][1]:
+            X = X.reshape(len(X), -1)
+        if from_epochs:
+            # The checkpoint of the logged rung: one a killed run wrote for a later rung
+            # before logging its result is never picked up
+            model = tf.keras.models.load_model(checkpoint_path(directory, trial_id, from_epochs))
+        else:
+            tf.keras.utils.set_random_seed(seed)
+            model = build_model(arch, params['time_steps'], arrays['X'].shape[2], **model_params)
+        model.fit(X[:split_at], y[:split_at], epochs=to_epochs, initial_epoch=from_epochs,
+                  batch_size=params['batch_size'], shuffle=False, verbose=0)
+        val_loss = float(model.evaluate(X[split_at:], y[split_at:], batch_size=params['batch_size'], verbose=0))
+        # Write then rename, so an interruption never leaves a truncated checkpoint
+        checkpoint = checkpoint_path(directory, trial_id, to_epochs)
+        tmp = checkpoint + '.tmp.keras'
+        model.save(tmp)
+        os.replace(tmp, checkpoint)
+    return {'val_loss': val_loss, 'seconds': time.perf_counter() - start}
+
+
+def _load_log(path):
+    trials, results = {}, []
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    break  # a line cut short by an interruption
+                if event['event'] == 'trial':
+                    trials[event['trial_id']] = event
+                else:
+                    results.append(event)
+    return trials, results
+
+
+def search(data, architectures=ZOO_NAMES, n_trials=10, min_epochs=5, max_epochs=100, eta=3,
+           directory='search_results', spaces=SPACES, target='GHI_Average', validation_split=0.15,
+           workers=None, threads_per_worker=None, seed=0, precision=None):
+    """Search the spaces of `architectures` on the scaled training frame `data`.
+
+    Samples `n_trials` configurations per architecture and trains them with
+    ASHA between `min_epochs` and `max_epochs`. Resumes from `directory` if
+    it holds an earlier search. Returns the trials table (see trials_table).
+    """
+    architectures = list(architectures)
+    os.makedirs(directory, exist_ok=True)
+    log_path = os.path.join(directory, TRIALS_FILE)
+    rungs = rung_epochs(min_epochs, max_epochs, eta)
+    workers = workers or os.cpu_count() or 1
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    precision = precision or get_precision()
+
+    trials, results = _load_log(log_path)
+    schedulers = {arch: SuccessiveHalving(rungs, eta) for arch in architectures}
+    for result in results:
+        if trials[result['trial_id']]['arch'] in schedulers:
+            schedulers[trials[result['trial_id']]['arch']].record(
+                result['trial_id'], result['rung'], result['val_loss'])
+    # Trials started before an interruption but without a first result are run again
+    pending = [t for t, trial in trials.items() if trial['arch'] in schedulers
+               and t not in schedulers[trial['arch']].losses[0]]
+    sampled = {arch: sum(trial['arch'] == arch for trial in trials.values()) for arch in architectures}
+    rng = np.random.default_rng([seed, len(trials)])
+
+    time_steps_values = sorted({ts for arch in architectures for ts in spaces[arch]['time_steps']})
+    arrays, splits = _window_arrays(data, time_steps_values, target, validation_split)
+    handles, specs = share_arrays(**arrays)
+    del arrays
+
+    def log(event):
+        with open(log_path, 'a') as f:
+            f.write(json.dumps(event) + '\n')
+
+    def new_trial(arch):
+        params = {}
+        for name, choices in spaces[arch].items():
+            value = choices[rng.integers(len(choices))]
+            params[name] = value.item() if hasattr(value, 'item') else value
+        trial = {'event': 'trial', 'trial_id': len(trials), 'arch': arch, 'params': params}
+        trials[trial['trial_id']] = trial
+        sampled[arch] += 1
+        log(trial)
+        return trial['trial_id']
+
+    def next_job(busy):
+        for arch in sorted(architectures, key=lambda a: sampled[a]):
+            if arch != 'SVR':
+                promotion = schedulers[arch].promotion(busy)
+                if promotion is not None:
+                    return promotion[0], promotion[1] + 1
+            if pending and trials[pending[0]]['arch'] == arch:
+                return pending.pop(0), 0
+            if sampled[arch] < n_trials:
+                return new_trial(arch), 0
+        if pending:
+            return pending.pop(0), 0
+        return None
+
+    running = {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                 initializer=init_worker, initargs=(threads_per_worker, precision)) as pool:
+            while True:
+                while len(running) < workers:
+                    job = next_job({trial_id for trial_id, _ in running.values()})
+                    if job is None:
+                        break
+                    trial_id, rung = job
+                    trial = trials[trial_id]
+                    time_steps = trial['params']['time_steps']
+                    job_specs = {'X': specs['X_%d' % time_steps], 'y': specs['y_%d' % time_steps]}
+                    from_epochs = rungs[rung - 1] if rung else 0
+                    to_epochs = max_epochs if trial['arch'] == 'SVR' else rungs[rung]
+                    future = pool.submit(_run_trial, trial['arch'], trial['params'], job_specs, from_epochs,
+                                         to_epochs, directory, trial_id, splits[time_steps], seed + trial_id)
+                    running[future] = (trial_id, rung)
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    trial_id, rung = running.pop(future)
+                    result = future.result()
+                    arch = trials[trial_id]['arch']
+                    # SVR has no epochs: its single fit counts as the last rung
+                    rung = len(rungs) - 1 if arch == 'SVR' else rung
+                    schedulers[arch].record(trial_id, rung, result['val_loss'])
+                    log({'event': 'result', 'trial_id': trial_id, 'rung': rung,
+                         'epochs': 0 if arch == 'SVR' else rungs[rung], **result})
+                    if arch != 'SVR' and rung:
+                        # Superseded by the checkpoint of the rung just logged
+                        previous = checkpoint_path(directory, trial_id, rungs[rung - 1])
+                        if os.path.exists(previous):
+                            os.remove(previous)
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+    return trials_table(directory)
+
+
+def trials_table(directory='search_results'):
+    """One row per trial: architecture, parameters, furthest rung, its epochs and val_loss."""
+    trials, results = _load_log(os.path.join(directory, TRIALS_FILE))
+    last = {}
+    for result in results:
+        if result['trial_id'] not in last or result['rung'] >= last[result['trial_id']]['rung']:
+            last[result['trial_id']] = result
+    rows = []
+    for trial_id, trial in trials.items():
+        result = last.get(trial_id, {})
+        rows.append({'trial_id': trial_id, 'arch': trial['arch'], 'params': trial['params'],
+                     'rung': result.get('rung'), 'epochs': result.get('epochs'),
+                     'val_loss': result.get('val_loss')})
+    return pd.DataFrame(rows, columns=['trial_id', 'arch', 'params', 'rung', 'epochs', 'val_loss'])
+
+
+def best_configs(trials):
+    """Best trial per architecture: furthest rung first, then lowest val_loss."""
+    ranked = trials.dropna(subset=['val_loss']).sort_values(['rung', 'val_loss'], ascending=[False, True])
+    return ranked.groupby('arch', sort=False).head(1).set_index('arch')
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Warm-start incremental retraining when new hourly rows arrive.
+
+After a full training run, save_state stores the model, its Preprocessor
+and how far into the data file it was trained. IncrementalTrainer.update
+then reloads that state and handles only the rows appended since:
+- The file is read through the column cache, which parses only the bytes
+  appended since (data_loader.append_cache).
+- The scalers stay frozen.
+- Windows are built for the new tail only.
+- The model is fine-tuned for a few epochs on the new windows plus a replay
+  buffer of the most recent and randomly sampled older windows. Only the
+  sampled windows are gathered and scaled.
+
+With compare_epochs, an update first scores the current model and a model
+retrained from scratch on the same history on the new (unseen) windows,
+and logs the accuracy given up by not retraining fully.
+
+    save_state(lstm_model, prep, '/content/lstm_02_model.keras', train, time_steps=10)
+    ...
+    trainer = IncrementalTrainer('/content/lstm_02_model.keras')
+    trainer.update('/content/busan_dataset.csv', epochs=3)
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import CALENDAR_COLS, load_dataset
+from features import load_features
+from preprocessing import Preprocessor, artifact_path
+from windowing import make_windows, valid_starts
+
+STATE_SUFFIX = '.state.json'
+UPDATES_SUFFIX = '.updates.jsonl'
+
+
+def _save_model(model, model_path):
+    # Write then rename, so an interrupted save keeps the previous model
+    tmp = model_path + '.tmp.keras'
+    model.save(tmp)
+    os.replace(tmp, model_path)
+
+
+def _write_state(model_path, state):
+    tmp = model_path + STATE_SUFFIX + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, model_path + STATE_SUFFIX)
+
+
+def save_state(model, prep, model_path, trained, time_steps, horizon=1):
+    """Save a trained model for warm-start updates.
+
+    `trained` is the (unscaled or scaled) frame the model was trained on, a
+    leading slice of the data file; its length and last timestamp mark
+    where the next update starts.
+    """
+    _save_model(model, model_path)
+    prep.save(artifact_path(model_path))
+    _write_state(model_path, {'rows': len(trained), 'last': int(trained.index[-1].value),
+                              'time_steps': time_steps, 'horizon': horizon})
+    return model_path
+
+
+def load_frame(path, columns):
+    """`columns` of the data file (calendar columns from the feature cache), Date-indexed."""
+    calendar = [c for c in columns if c in CALENDAR_COLS]
+    df = load_dataset(path, columns=[c for c in columns if c not in CALENDAR_COLS])
+    if calendar:
+        df = df.join(load_features(path, calendar))
+    return df[list(columns)]
+
+
+class IncrementalTrainer:
+    """Fine-tunes a model saved with save_state on the rows appended since."""
+
+    def __init__(self, model_path):
+        import tensorflow as tf
+
+        self.model_path = model_path
+        with open(model_path + STATE_SUFFIX) as f:
+            self.state = json.load(f)
+        self.model = tf.keras.models.load_model(model_path)
+        self.prep = Preprocessor.load(artifact_path(model_path))
+
+    @property
+    def time_steps(self):
+        return self.state['time_steps']
+
+    @property
+    def horizon(self):
+        return self.state['horizon']
+
+    def windows(self, data, starts):
+        """Scaled (X, y) for windows `starts` of the unscaled frame `data`."""
+        X, y = make_windows(data, self.time_steps, target=self.prep.target, horizon=self.horizon,
+                            starts=starts, dtype=self.prep.dtype)
+        # The gathered windows are copies: scale them in place, row by row
+        self.prep.transform_(X.reshape(-1, X.shape[-1]))
+        return X, self.prep.transform_target(y, out=y)
+
+    def replay_starts(self, history, replay, recent, rng):
+        """The last `recent` valid windows of `history` plus a random sample of the older ones."""
+        starts = valid_starts(history, self.time_steps, self.horizon, target=self.prep.target)
+        recent_starts, older = starts[-recent:] if recent else starts[:0], starts[:len(starts) - recent]
+        sample = rng.choice(older, size=min(max(replay - len(recent_starts), 0), len(older)), replace=False)
+        return np.sort(np.concatenate([sample, recent_starts]))
+
+    def update(self, path, epochs=3, batch_size=64, replay=2048, recent=512, learning_rate=None,
+               compare_epochs=None, seed=0):
+        """Fine-tune on the rows of `path` added since the last update; returns the update record.
+
+        A record of the rows and windows used, timings and (with
+        `compare_epochs`) the pre-update MSE of the warm model and of a model
+        retrained from scratch for `compare_epochs` epochs is appended to
+        <model_path>.updates.jsonl.
+        """
+        start = time.perf_counter()
+        df = load_frame(path, self.prep.columns)
+        rows = self.state['rows']
+        if len(df) < rows or df.index[rows - 1].value != self.state['last']:
+            raise ValueError('%s no longer starts with the %d rows the model was trained on; '
+                             'retrain from scratch' % (path, rows))
+        record = {'rows': len(df), 'rows_added': len(df) - rows}
+        if len(df) == rows:
+            return record
+
+        # Windows whose target is a new row; they need the preceding rows as context
+        context = max(rows - self.time_steps - self.horizon + 1, 0)
+        tail = df.iloc[context:]
+        X_new, y_new = self.windows(tail, valid_starts(tail, self.time_steps, self.horizon,
+                                                       target=self.prep.target))
+        history = df.iloc[:rows]
+        rng = np.random.default_rng(seed)
+        X_old, y_old = self.windows(history, self.replay_starts(history, replay, recent, rng))
+        record.update(new_windows=len(X_new), replay_windows=len(X_old))
+        if len(X_new) == 0:
+            return record
+
+        if compare_epochs:
+            record.update(self.compare_full_retrain(history, X_new, y_new, compare_epochs, batch_size, seed))
+
+        if learning_rate is not None:
+            self.model.optimizer.learning_rate.assign(learning_rate)
+        X = np.concatenate([X_old, X_new])
+        y = np.concatenate([y_old, y_new])
+        fit_start = time.perf_counter()
+        self.model.fit(X, y, epochs=epochs, batch_size=batch_size, shuffle=True, verbose=0)
+        record['fine_tune_seconds'] = time.perf_counter() - fit_start
+
+        _save_model(self.model, self.model_path)
+        self.state.update(rows=len(df), last=int(df.index[-1].value))
+        _write_state(self.model_path, self.state)
+        record['seconds'] = time.perf_counter() - start
+        with open(self.model_path + UPDATES_SUFFIX, 'a') as f:
+            f.write(json.dumps({'time': pd.Timestamp.now().isoformat(), **record}) + '\n')
+        return record
+
+    def compare_full_retrain(self, history, X_new, y_new, epochs, batch_size=64, seed=0):
+        """MSE on the new windows of the warm model and of a from-scratch retrain on `history`."""
+        import tensorflow as tf
+
+        warm_mse = float(self.model.evaluate(X_new, y_new, batch_size=batch_size, verbose=0))
+        X, y = self.windows(history, valid_starts(history, self.time_steps, self.horizon,
+                                                  target=self.prep.target))
+        tf.keras.utils.set_random_seed(seed)
+        fresh = tf.keras.models.clone_model(self.model)
+        optimizer = self.model.optimizer
+        fresh.compile(loss=self.model.loss, optimizer=type(optimizer).from_config(optimizer.get_config()))
+        start = time.perf_counter()
+        fresh.fit(X, y, epochs=epochs, batch_size=batch_size, shuffle=False, verbose=0)
+        full_seconds = time.perf_counter() - start
+        full_mse = float(fresh.evaluate(X_new, y_new, batch_size=batch_size, verbose=0))
+        return {'warm_mse': warm_mse, 'full_retrain_mse': full_mse, 'mse_gap': warm_mse - full_mse,
+                'full_retrain_seconds': full_seconds}
+
+    def history(self):
+        """The update records logged so far, as a DataFrame."""
+        path = self.model_path + UPDATES_SUFFIX
+        if not os.path.exists(path):
+            return pd.DataFrame()
+        with open(path) as f:
+            return pd.DataFrame([json.loads(line) for line in f if line.strip()])
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""tf.data input pipelines for the Keras models.
+
+Instead of handing model.fit fully materialised window arrays, the scaled
+feature matrix is kept as one tensor and each batch of windows is gathered on
+the fly (the same windows make_windows returns). Batches are built in
+parallel, cached after the first epoch and prefetched, so data preparation
+overlaps with the gradient steps.
+
+    train_ds, val_ds = train_val_datasets(train, time_steps=7, validation_split=0.15)
+    history = model.fit(train_ds, validation_data=val_ds, epochs=100)
+"""
+
+import numpy as np
+import tensorflow as tf
+
+from precision import data_dtype
+from windowing import as_matrix, column_index, window_count
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+
+def _finish(ds, cache, shuffle_buffer, seed):
+    if cache:
+        # True caches in memory, a string caches to that file
+        ds = ds.cache() if cache is True else ds.cache(cache)
+    if shuffle_buffer:
+        ds = ds.shuffle(shuffle_buffer, seed=seed)
+    return ds.prefetch(AUTOTUNE)
+
+
+def make_dataset(data, time_steps, target='GHI_Average', horizon=1, features=None, batch_size=64,
+                 start=0, stop=None, flatten=False, cache=True, shuffle=False, seed=None,
+                 dtype=None, horizons=None, starts=None):
+    """A dataset of (X, y) batches for windows [start, stop) of `data`.
+
+    Windows match make_windows: X = rows [i, i + time_steps) of `features`
+    (all columns by default), y = `target` at row i + time_steps + horizon - 1.
+    `flatten` yields [batch, time_steps * features] for the Dense models.
+    With `shuffle`, whole batches are shuffled each epoch after caching.
+    Passing `horizons` instead of `horizon` yields y as [batch, len(horizons)],
+    the targets of make_multi_horizon. With `starts` (windowing.valid_starts)
+    the windows are starts[start:stop] instead of every row offset. `dtype`
+    defaults to precision.data_dtype().
+    """
+    dtype = dtype or data_dtype()
+    target_idx = column_index(data, target)
+    values = as_matrix(data, dtype=dtype)
+    feature_values = values if features is None else as_matrix(data, features, dtype=dtype)
+    if horizons is not None:
+        horizon = int(np.max(horizons))
+        target_offsets = tf.constant(np.asarray(horizons, dtype=np.int64) + (time_steps - 1))
+    n = window_count(len(values), time_steps, horizon) if starts is None else len(starts)
+    stop = n if stop is None else min(stop, n)
+
+    inputs = tf.constant(feature_values)
+    targets = tf.constant(values[:, target_idx])
+    offsets = tf.range(time_steps, dtype=tf.int64)
+
+    def gather(idx):
+        X = tf.gather(inputs, idx[:, None] + offsets)
+        if flatten:
+            X = tf.reshape(X, (tf.shape(idx)[0], -1))
+        if horizons is not None:
+            return X, tf.gather(targets, idx[:, None] + target_offsets)
+        return X, tf.gather(targets, idx + (time_steps + horizon - 1))
+
+    if starts is None:
+        ds = tf.data.Dataset.range(start, stop)
+    else:
+        ds = tf.data.Dataset.from_tensor_slices(np.asarray(starts[start:stop], dtype=np.int64))
+    ds = ds.batch(batch_size).map(gather, num_parallel_calls=AUTOTUNE, deterministic=True)
+    shuffle_buffer = -(-(stop - start) // batch_size) if shuffle else 0
+    return _finish(ds, cache, shuffle_buffer, seed)
+
+
+def train_val_datasets(data, time_steps, target='GHI_Average', horizon=1, features=None,
+                       batch_size=64, validation_split=0.15, flatten=False, cache=True,
+                       shuffle=False, seed=None, dtype=None, horizons=None, starts=None):
+    """(train, validation) datasets split like fit(validation_split=...): the tail is validation."""
+    if starts is None:
+        n = window_count(len(data), time_steps, horizon if horizons is None else int(np.max(horizons)))
+    else:
+        n = len(starts)
+    split_at = n - int(n * validation_split)
+    kwargs = dict(target=target, horizon=horizon, features=features, batch_size=batch_size,
+                  flatten=flatten, cache=cache, dtype=dtype, horizons=horizons, starts=starts)
+    train_ds = make_dataset(data, time_steps, start=0, stop=split_at, shuffle=shuffle, seed=seed, **kwargs)
+    val_ds = make_dataset(data, time_steps, start=split_at, stop=n, **kwargs)
+    return train_ds, val_ds
+
+
+def interleave_datasets(datasets):
+    """Alternate batches from several datasets (e.g. one per station or file)."""
+    datasets = list(datasets)
+    choice = tf.data.Dataset.range(len(datasets)).repeat()
+    ds = tf.data.Dataset.choose_from_datasets(datasets, choice, stop_on_empty_dataset=False)
+    return ds.prefetch(AUTOTUNE)
+
+
+def store_dataset(store, batch_size=64, start=0, stop=None, flatten=False, cache=False,
+                  shuffle=False, seed=None):
+    """A dataset of (X, y) batches read from a window_store.WindowStore.
+
+    [start, stop) are store window indices, so only the store's `starts`
+    (its gap-free windows) are read. Batches are gathered from the memory-mapped file in parallel worker
+    threads, so the windows never have to fit in memory (leave `cache` off
+    for data larger than RAM).
+    """
+    stop = len(store) if stop is None else stop
+    time_steps, features = store.input_shape
+    x_shape = (None, time_steps * features) if flatten else (None, time_steps, features)
+
+    def gather(idx):
+        X, y = tf.numpy_function(lambda i: store.get_batch(i, flatten=flatten),
+                                 [idx], (tf.as_dtype(store.data.dtype),) * 2)
+        X.set_shape(x_shape)
+        y.set_shape((None,))
+        return X, y
+
+    ds = tf.data.Dataset.range(start, stop).batch(batch_size)
+    ds = ds.map(gather, num_parallel_calls=AUTOTUNE, deterministic=True)
+    shuffle_buffer = -(-(stop - start) // batch_size) if shuffle else 0
+    return _finish(ds, cache, shuffle_buffer, seed)
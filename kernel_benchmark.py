@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""CPU benchmark of the current and fast configurations of the recurrent models.
+
+For each recurrent architecture of "8 MODEL.py" (GRU, LSTM, SimpleRNN) the
+current configuration is trained next to the candidate fast ones:
+fused-kernel compatible settings (tanh instead of relu), an unrolled
+SimpleRNN and XLA-compiled train / predict steps (jit_compile=True). The
+table holds the first epoch (tracing / compilation) and the median later
+epoch time, the test metrics and the speedup over 'current'. XLA does not
+pay off everywhere (on CPU the recurrent loops can get slower), which is
+what this measures before a setting is switched on in the scripts.
+
+    python kernel_benchmark.py /content/busan_dataset.csv --epochs 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+
+from metrics import accuracy_metrics
+from models import build_model, fused_kernel_issues
+
+# name -> [(label, build_model kwargs)]; 'current' is the "8 MODEL.py" setup
+CONFIGS = {
+    'GRU': [('current', {'jit_compile': False}),
+            ('xla', {'jit_compile': True})],
+    'LSTM': [('current', {'jit_compile': False}),
+             ('relu (lstm_07)', {'activation': 'relu', 'jit_compile': False}),
+             ('xla', {'jit_compile': True})],
+    'RNN': [('current', {'jit_compile': False}),
+            ('tanh, unrolled', {'activation': 'tanh', 'unroll': True, 'jit_compile': False}),
+            ('tanh, unrolled, xla', {'activation': 'tanh', 'unroll': True, 'jit_compile': True})],
+}
+
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    """Wall-clock seconds of every epoch."""
+
+    def on_train_begin(self, logs=None):
+        self.times = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.times.append(time.perf_counter() - self._start)
+
+
+def benchmark_recurrent(X_train, y_train, X_test, y_test, GHI_scaler, configs=CONFIGS, epochs=5,
+                        batch_size=64, validation_split=0.15, seed=0):
+    """Train every configuration in `configs` from the same seed; returns the comparison table."""
+    _, time_steps, n_features = X_train.shape
+    y_test_inv = GHI_scaler.inverse_transform(np.asarray(y_test).reshape(-1, 1)).flatten()
+    rows = []
+    for name, variants in configs.items():
+        for label, kwargs in variants:
+            tf.keras.utils.set_random_seed(seed)
+            model = build_model(name, time_steps, n_features, **kwargs)
+            timer = EpochTimer()
+            model.fit(X_train, y_train, epochs=epochs, batch_size=batch_size,
+                      validation_split=validation_split, shuffle=False, verbose=0, callbacks=[timer])
+            start = time.perf_counter()
+            y_pred = model.predict(X_test, batch_size=batch_size, verbose=0)
+            predict_seconds = time.perf_counter() - start
+            y_pred_inv = GHI_scaler.inverse_transform(np.asarray(y_pred).reshape(-1, 1)).flatten()
+            metrics = accuracy_metrics(y_test_inv, y_pred_inv)
+            rows.append({'Model': name, 'Config': label,
+                         'First epoch s': timer.times[0],
+                         'Epoch s': float(np.median(timer.times[1:] or timer.times)),
+                         'Predict s': predict_seconds,
+                         'Fused kernel': not fused_kernel_issues(model) if name != 'RNN' else None,
+                         'RMSE': metrics['RMSE'], 'R^2': metrics['R^2']})
+    df = pd.DataFrame(rows)
+    current = df[df['Config'] == 'current'].set_index('Model')['Epoch s']
+    df['Speedup'] = df['Model'].map(current) / df['Epoch s']
+    return df
+
+
+def _windows(path, time_steps):
+    """Train / test windows and GHI scaler prepared the way "8 MODEL.py" does."""
+    from data_loader import load_dataset
+    from features import load_features
+    from preprocessing import Preprocessor
+    from windowing import make_windows, valid_starts
+
+    required_cols = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure', 'Water', 'AOD', 'wv_500',
+                     'CI_Beyer', 'hour', 'month']
+    df = load_dataset(path, columns=required_cols).join(load_features(path, ['hour', 'month']))[required_cols]
+    train_size, test_size = int(len(df) * 0.7), int(len(df) * 0.15)
+    train, test = df.iloc[:train_size], df.iloc[train_size:train_size + test_size]
+    prep = Preprocessor(required_cols, required_cols[1:], target='GHI_Average').fit(train)
+    train, test = prep.transform_frame(train), prep.transform_frame(test)
+    X_train, y_train = make_windows(train, time_steps, starts=valid_starts(train, time_steps))
+    X_test, y_test = make_windows(test, time_steps, starts=valid_starts(test, time_steps))
+    return X_train, y_train, X_test, y_test, prep.target_scaler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', nargs='?', default='/content/busan_dataset.csv')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--time-steps', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    tf.config.set_visible_devices([], 'GPU')  # CPU benchmark
+    data = _windows(args.path, args.time_steps)
+    df = benchmark_recurrent(*data, epochs=args.epochs, batch_size=args.batch_size)
+    with pd.option_context('display.width', 200, 'display.max_columns', None):
+        print(df.round(4).to_string(index=False))
+    return df
+
+
+if __name__ == '__main__':
+    main()
@@ -19,22 +19,25 @@ import warnings
 warnings.filterwarnings('ignore')
 from sklearn.metrics import mean_squared_error, explained_variance_score, max_error
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import RobustScaler
+from data_loader import load_dataset
+from features import load_features
+from preprocessing import Preprocessor
+from windowing import make_windows, valid_starts, window_count
+from precision import output_dtype, set_precision
 
-"""# LOAD DATA"""
+# Numeric precision of the whole pipeline: 'float32', 'mixed_float16' / 'mixed_bfloat16'
+# (half-precision compute in the Keras models) or 'float64' for a reference run
+set_precision('float32')
 
-# Import the CSV file
-df = pd.read_csv("/content/busan_dataset.csv")
+"""# LOAD DATA"""
 
-df.head()
+# Columns the models use; only these are loaded
+required_cols = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure', 'Water', 'AOD', 'wv_500', 'CI_Beyer']
 
-# remove spaces on the column
-df.columns = df.columns.str.lstrip()
-df.columns = df.columns.str.rstrip()
+# Load the dataset through the columnar cache (float32, column names stripped, indexed by Date)
+df = load_dataset("/content/busan_dataset.csv", columns=required_cols)
 
-# Parse the "Date" column
-df['Date'] = pd.to_datetime(df['Date'])
-df.set_index('Date', inplace=True)
+df.head()
 
 """# Data Exploration"""
 
@@ -56,14 +59,11 @@ df.tail()
 
 """# Data Engineering"""
 
-# Extracting features from the index before filtering the DataFrame
-df['hour'] = df.index.hour
-df['day_of_month'] = df.index.day
-df['day_of_week'] = df.index.dayofweek
-df['month'] = df.index.month
+# Calendar features from the cached feature stage; the model does not use them,
+# they are only joined in for the exploration plots below
+calendar = load_features("/content/busan_dataset.csv", ['hour', 'day_of_month', 'day_of_week', 'month'])
 
-# Now filter the DataFrame to include only the required columns and the new features
-required_cols = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure', 'Water', 'AOD', 'wv_500', 'CI_Beyer']
+# Now filter the DataFrame to include only the required columns
 df = df[required_cols]
 
 # Display the first few rows to confirm the columns are present
@@ -89,19 +89,19 @@ if isinstance(axs, np.ndarray):
     axs = axs.flatten()
 
 # Plot 1: Hourly GHI Average
-sns.pointplot(x='hour', y='GHI_Average', data=df, ax=axs[0])
+sns.pointplot(x='hour', y='GHI_Average', data=df.join(calendar), ax=axs[0])
 axs[0].set_title('Hourly GHI Average')
 
 # Plot 2: GHI Average by Day of the Week
-sns.pointplot(x='day_of_week', y='GHI_Average', data=df, ax=axs[1])
+sns.pointplot(x='day_of_week', y='GHI_Average', data=df.join(calendar), ax=axs[1])
 axs[1].set_title('GHI Average by Day of the Week')
 
 # Plot 3: GHI Average by Day of the Month
-sns.pointplot(x='day_of_month', y='GHI_Average', data=df, ax=axs[2])
+sns.pointplot(x='day_of_month', y='GHI_Average', data=df.join(calendar), ax=axs[2])
 axs[2].set_title('GHI Average by Day of the Month')
 
 # Plot 4: GHI Average by Month
-sns.pointplot(x='month', y='GHI_Average', data=df, ax=axs[3])
+sns.pointplot(x='month', y='GHI_Average', data=df.join(calendar), ax=axs[3])
 axs[3].set_title('GHI Average by Month')
 
 # Show the plots
@@ -119,35 +119,28 @@ print('Test size:', len(test))
 
 cols = ['SunZenith_KMU','Ambient_Pressure','Water','AOD','wv_500','CI_Beyer']
 
-scaler = RobustScaler()
-scaler = scaler.fit(np.asarray(train[cols]))
-
-train.loc[:, cols] = scaler.transform(np.asarray(train[cols]))
-test.loc[:, cols] = scaler.transform(np.asarray(test[cols]))
-
-# scaling GHI
-GHI_scaler = RobustScaler()
-GHI_scaler = GHI_scaler.fit(train[['GHI_Average']])
-train['GHI_Average'] = GHI_scaler.transform(train[['GHI_Average']])
-test['GHI_Average'] = GHI_scaler.transform(test[['GHI_Average']])
+# Fit the input scaler (cols) and the GHI scaler on the training split, then scale
+# float32 copies of train/test in one fused pass (no chained assignment on slices of df)
+prep = Preprocessor(required_cols, cols, target='GHI_Average').fit(train)
+scaler, GHI_scaler = prep.scaler, prep.target_scaler
+train = prep.transform_frame(train)
+test = prep.transform_frame(test)
 
 print('Train shape:',train.shape)
 print('Test shape:', test.shape)
 
 """# Model Building"""
 
-def create_dataset(X, y, time_steps=1):
-    Xs, ys = [], []
-    for i in range(len(X) - time_steps):
-        v = X.iloc[i:(i + time_steps)].values
-        Xs.append(v)
-        ys.append(y.iloc[i + time_steps])
-    return np.array(Xs), np.array(ys)
-
 time_steps = 10
-# reshape to [samples, time_steps, features]
-X_train, y_train = create_dataset(train, train.GHI_Average, time_steps)
-X_test, y_test = create_dataset(test, test.GHI_Average, time_steps)
+# Only gap-free windows (see windowing); gap_aware = False restores every window
+gap_aware = True
+train_starts = valid_starts(train, time_steps, gap_aware=gap_aware)
+test_starts = valid_starts(test, time_steps, gap_aware=gap_aware)
+print(f'Windows kept: train {len(train_starts)} of {window_count(len(train), time_steps)}, '
+      f'test {len(test_starts)} of {window_count(len(test), time_steps)}')
+# [samples, time_steps, features] windows starting at those rows
+X_train, y_train = make_windows(train, time_steps, target='GHI_Average', starts=train_starts)
+X_test, y_test = make_windows(test, time_steps, target='GHI_Average', starts=test_starts)
 print(X_train.shape, y_train.shape)
 
 """# **LSTM**"""
@@ -156,7 +149,7 @@ print(X_train.shape, y_train.shape)
 lstm_model = tf.keras.Sequential()
 lstm_model.add(tf.keras.layers.LSTM(units=128, input_shape=(X_train.shape[1], X_train.shape[2])))
 lstm_model.add(tf.keras.layers.Dropout(rate=0.2))
-lstm_model.add(tf.keras.layers.Dense(units=1))
+lstm_model.add(tf.keras.layers.Dense(units=1, dtype=output_dtype()))
 lstm_model.compile(loss='mse', optimizer='adam')
 
 lstm_history = lstm_model.fit(X_train, y_train,epochs=50,batch_size=32,validation_split=0.1,shuffle=False)
@@ -239,8 +232,8 @@ table = ax.table(cellText=df_metrics_LSTM.values, colLabels=df_metrics_LSTM.colu
 # Display the plot
 plt.show()
 
-# Assuming 'df' has a DateTime index and you want to keep the corresponding dates for the test set
-dates = df.index[train_size + time_steps:].to_list()
+# Dates of the test targets: the row right after each valid window
+dates = test.index[test_starts + time_steps].to_list()
 
 # Combine the predicted and actual values with the dates
 results_LSTM_df = pd.DataFrame({
@@ -262,7 +255,7 @@ results_LSTM_df.to_csv('LSTM_GHI_predictions.csv', index=False)
 gru_model = tf.keras.Sequential()
 gru_model.add(tf.keras.layers.GRU(units=128, input_shape=(X_train.shape[1], X_train.shape[2])))
 gru_model.add(tf.keras.layers.Dropout(rate=0.2))
-gru_model.add(tf.keras.layers.Dense(units=1))
+gru_model.add(tf.keras.layers.Dense(units=1, dtype=output_dtype()))
 gru_model.compile(loss='mean_squared_error', optimizer='adam')
 gru_model.summary()
 
@@ -339,8 +332,8 @@ df_metrics = pd.DataFrame(metrics)
 # Display the DataFrame
 df_metrics.head()
 
-# Assuming 'df' has a DateTime index and you want to keep the corresponding dates for the test set
-dates = df.index[train_size + time_steps:].to_list()
+# Dates of the test targets: the row right after each valid window
+dates = test.index[test_starts + time_steps].to_list()
 
 # Combine the predicted and actual values with the dates
 results_df = pd.DataFrame({
@@ -356,4 +349,73 @@ results_df.head()
 results_df.to_csv('GRU_GHI_predictions.csv', index=False)
 
 # Save the table to an Excel file
-results_df.to_excel('GRU02_GHI_predictions.xlsx', index=False)
\ No newline at end of file
+results_df.to_excel('GRU02_GHI_predictions.xlsx', index=False)
+
+"""# Incremental Updates"""
+
+from incremental import IncrementalTrainer, save_state
+
+# Save the LSTM, its scalers and how many rows it was trained on, so that new hourly
+# rows can be folded in by fine-tuning instead of rerunning the whole notebook
+save_state(lstm_model, prep, '/content/lstm_02_model.keras', train, time_steps=time_steps)
+
+# Once new rows are appended to the CSV: fine-tune on their windows plus a replay buffer
+# of recent and sampled older windows. compare_epochs also logs the MSE gap to a full
+# retrain on the same history (leave it off for routine hourly updates)
+trainer = IncrementalTrainer('/content/lstm_02_model.keras')
+trainer.update('/content/busan_dataset.csv', epochs=3, compare_epochs=50)
+trainer.history()
+
+"""# Distributed Training"""
+
+from distributed import train_distributed, write_shards
+from metrics import accuracy_metrics
+
+# The same LSTM / GRU trained data-parallel: the training windows are written as 4 shards
+# (plus the 10% validation tail), one local worker process trains on each shard and their
+# weights are averaged after every epoch
+write_shards(train, '/content/lstm_02_shards', n_shards=4, time_steps=time_steps, validation_split=0.1)
+lstm_dist_model, lstm_dist_history = train_distributed('/content/lstm_02_shards', 'LSTM', epochs=50,
+                                                       batch_size=32, model_kwargs={'units': 128, 'dropout': 0.2})
+gru_dist_model, gru_dist_history = train_distributed('/content/lstm_02_shards', 'GRU', epochs=50,
+                                                     batch_size=32, model_kwargs={'units': 128, 'dropout': 0.2})
+lstm_dist_history.tail()
+
+y_pred_dist_inv = prep.inverse_target(lstm_dist_model.predict(X_test))
+accuracy_metrics(y_test_inv.flatten(), y_pred_dist_inv)
+
+"""# Out-of-core Training"""
+
+from input_pipeline import store_dataset
+from models import build_model
+from window_store import WindowStore, check_store
+
+# The same LSTM fed from a memory-mapped window store: the scaled training rows are written
+# to disk once and each batch is gathered from the page cache, so the 3D window array never
+# has to fit in memory. check_store first asserts that the store serves exactly X_train / y_train
+train_store = WindowStore.create('/content/lstm_02_train.windows', train, time_steps, target='GHI_Average',
+                                 starts=train_starts)
+check_store(train_store, X_train, y_train)
+(fit_start, fit_stop), (val_start, val_stop) = train_store.split(validation_split=0.1)
+lstm_store_model = build_model('LSTM', time_steps, train.shape[1], units=128, dropout=0.2)
+lstm_store_history = lstm_store_model.fit(store_dataset(train_store, 32, fit_start, fit_stop), epochs=50,
+                                          validation_data=store_dataset(train_store, 32, val_start, val_stop))
+
+y_pred_store_inv = prep.inverse_target(lstm_store_model.predict(X_test))
+accuracy_metrics(y_test_inv.flatten(), y_pred_store_inv)
+
+"""# Streaming Inference"""
+
+from online_inference import StreamingForecaster, check_equivalence, latency
+
+# Serve the LSTM one hour at a time: each site carries 10 staggered hidden / cell states, so a
+# new row costs one batched cell step instead of a fresh 10-step window per call.
+# check_equivalence streams the training frame (the short December test days hold no
+# 10-row window) and asserts that every forecast equals the windowed model's
+check_equivalence(lstm_model, train, time_steps=time_steps)
+
+# Milliseconds per call and microseconds per site for 1 to 5000 sites, next to windowed predict
+latency(lstm_model)
+
+# Live use: one forecaster per fleet of sites, fed unscaled rows (prep.columns order) each hour
+forecaster = StreamingForecaster(lstm_model, n_sites=1, prep=prep)
@@ -18,18 +18,30 @@ from sklearn.metrics import (mean_squared_error, r2_score,
                              mean_absolute_error, explained_variance_score,
                              max_error)
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import RobustScaler
+from data_loader import load_dataset
+from features import load_features
+from preprocessing import Preprocessor
+from windowing import horizon_views, make_multi_horizon, valid_starts, window_count
+from input_pipeline import train_val_datasets
+from models import build_multi_horizon_lstm, fused_kernel_issues
+from precision import output_dtype, set_precision
+from training_budget import TrainingBudget
 plt.rcParams["figure.figsize"] = (12,5)
 import warnings
 warnings.filterwarnings('ignore')
 
+# Numeric precision of the whole pipeline: 'float32', 'mixed_float16' / 'mixed_bfloat16'
+# (half-precision compute in the Keras models) or 'float64' for a reference run
+set_precision('float32')
+
 """# Load Data"""
 
+# Columns the model uses; only these are loaded (hour/month are derived below)
+required_cols = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure',
+                 'Water', 'AOD', 'Uo (atm-cm)', 'CI_Hammer', 'OT', 'hour', 'month']
+
 # Load and preprocess the dataset
-df = pd.read_csv("/content/busan_dataset.csv")
-df.columns = df.columns.str.strip()  # Remove spaces from column names
-df['Date'] = pd.to_datetime(df['Date'])
-df.set_index('Date', inplace=True)
+df = load_dataset("/content/busan_dataset.csv", columns=required_cols)  # Cached float32 columns, Date index
 
 """# Data Exploration"""
 
@@ -37,10 +49,7 @@ df.set_index('Date', inplace=True)
 print(df.shape, df.info(), df.describe(), df.isna().sum(), sep='\n')
 
 # Feature Engineering
-df['hour'] = df.index.hour
-df['month'] = df.index.month
-required_cols = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure',
-                 'Water', 'AOD', 'Uo (atm-cm)', 'CI_Hammer', 'OT', 'hour', 'month']
+df = df.join(load_features("/content/busan_dataset.csv", ['hour', 'month']))  # Cached calendar features
 df = df[required_cols]
 
 df.head()
@@ -91,42 +100,37 @@ train, test, validation = df.iloc[:train_size], df.iloc[train_size:train_size +
 cols = ['SunZenith_KMU', 'Ambient_Pressure', 'Water', 'AOD',
         'OT', 'Uo (atm-cm)', 'CI_Hammer', 'hour', 'month']
 
-scaler = RobustScaler()
-train[cols] = scaler.fit_transform(train[cols])
-test[cols] = scaler.transform(test[cols])
-
-# Scaling GHI
-GHI_scaler = RobustScaler()
-GHI_scaler.fit(train[['GHI_Average']])
-train['GHI_Average'] = GHI_scaler.transform(train[['GHI_Average']])
-test['GHI_Average'] = GHI_scaler.transform(test[['GHI_Average']])
+# Fit the input scaler (cols) and the GHI scaler on the training split, then scale
+# float32 copies of train/test in one fused pass (no chained assignment on slices of df)
+prep = Preprocessor(required_cols, cols, target='GHI_Average').fit(train)
+scaler, GHI_scaler = prep.scaler, prep.target_scaler
+train = prep.transform_frame(train)
+test = prep.transform_frame(test)
 
 print(f'Train size: {len(train)}, Test size: {len(test)}, Validation size: {len(validation)}')
 
 """# Dataset Building"""
 
-# Dataset Creation Function
-def create_dataset(X, y, time_steps=7, horizon=1):
-    """Creates dataset for training/testing with a specified number of previous timesteps including the current one, and horizon."""
-    Xs, ys = [], []
-    for i in range(len(X) - time_steps - horizon + 1):  # Adjust the range to accommodate the current timestep
-        Xs.append(X.iloc[i:i + time_steps].values)  # Include the current timestep in the last position of the window
-        ys.append(y.iloc[i + time_steps + horizon - 1])  # Target variable at the specified horizon
-    return np.array(Xs), np.array(ys)
-
-
-
 # Set the desired forecasting horizons
 horizons = [1, 2, 3]  # 1-hour, 2-hour, and 3-hour ahead
 
-# Create datasets for each horizon
-datasets = {}
-for h in horizons:
-    X_train, y_train = create_dataset(train, train['GHI_Average'], time_steps=7, horizon=h)
-    X_test, y_test = create_dataset(test, test['GHI_Average'], time_steps=7, horizon=h)
-    datasets[h] = (X_train, y_train, X_test, y_test)
+# Only windows gap-free up to the furthest target (see windowing); gap_aware = False restores every window
+gap_aware = True
+train_starts = valid_starts(train, 7, horizon=max(horizons), gap_aware=gap_aware)
+test_starts = valid_starts(test, 7, horizon=max(horizons), gap_aware=gap_aware)
+print(f'Windows kept: train {len(train_starts)} of {window_count(len(train), 7, max(horizons))}, '
+      f'test {len(test_starts)} of {window_count(len(test), 7, max(horizons))}')
+
+# Build the windows of the previous 7 timesteps (current one last) once, plus an
+# (N, H) matrix of the targets h hours ahead; all horizons share the same N windows
+X_train, Y_train = make_multi_horizon(train, time_steps=7, horizons=horizons, target='GHI_Average', starts=train_starts)
+X_test, Y_test = make_multi_horizon(test, time_steps=7, horizons=horizons, target='GHI_Average', starts=test_starts)
+
+# Per-horizon views into the shared arrays
+train_targets, test_targets = horizon_views(Y_train, horizons), horizon_views(Y_test, horizons)
+datasets = {h: (X_train, train_targets[h], X_test, test_targets[h]) for h in horizons}
 
-print(f'X_train shape: {X_train.shape}, y_train shape: {y_train.shape}')
+print(f'X_train shape: {X_train.shape}, Y_train shape: {Y_train.shape}')
 
 """# LSTM"""
 
@@ -135,44 +139,89 @@ results_lstm = {}
 predictions_lstm = {}
 histories_lstm = {}  # Store the training history for each horizon
 
-for h in horizons:
-    X_train, y_train = datasets[h][:2]  # Get the training data for the horizon
-    X_test, y_test = datasets[h][2:]  # Get the testing data for the horizon
-
-    # Build and compile the LSTM model
-    lstm_model = tf.keras.Sequential([
-        tf.keras.layers.LSTM(units=100, activation='relu', input_shape=(X_train.shape[1], X_train.shape[2])),
-        tf.keras.layers.Dropout(rate=0.5),
-        tf.keras.layers.Dense(units=1)
-    ])
-
-    lstm_model.compile(loss='mean_squared_error', optimizer='adam')
-
-    # Train the model and store the history
-    history = lstm_model.fit(X_train, y_train, epochs=100, batch_size=64, validation_split=0.15, shuffle=False)
-    histories_lstm[h] = history  # Save the training history
-
-    # Predictions
-    y_pred = lstm_model.predict(X_test)
-    y_pred_inv = GHI_scaler.inverse_transform(y_pred.reshape(-1, 1))
-    y_test_inv = GHI_scaler.inverse_transform(y_test.reshape(-1, 1))
-
-    # Store predictions for comparison
-    predictions_lstm[h] = (y_test_inv.flatten(), y_pred_inv.flatten())
-
-    # Evaluation
-    def LSTM_accuracy_metrics(y_true, y_pred):
-        """Calculate and print model performance metrics"""
-        metrics = {
-            'R^2': r2_score(y_true, y_pred),
-            'MAE': mean_absolute_error(y_true, y_pred),
-            'MSE': mean_squared_error(y_true, y_pred),
-            'RMSE': np.sqrt(mean_squared_error(y_true, y_pred)),
-        }
-        return metrics
-
-    metrics = LSTM_accuracy_metrics(y_test_inv, y_pred_inv)
-    results_lstm[h] = metrics
+# Evaluation
+def LSTM_accuracy_metrics(y_true, y_pred):
+    """Calculate and print model performance metrics"""
+    metrics = {
+        'R^2': r2_score(y_true, y_pred),
+        'MAE': mean_absolute_error(y_true, y_pred),
+        'MSE': mean_squared_error(y_true, y_pred),
+        'RMSE': np.sqrt(mean_squared_error(y_true, y_pred)),
+    }
+    return metrics
+
+# False: a separate LSTM trained for each horizon (the original runs).
+# True: one LSTM encoder with an output per horizon, trained in a single fit.
+multi_output = False
+
+# Shared training policy for every fit: early stopping on val_loss (best weights restored),
+# learning rate reduced on plateaus, and optional per-fit epoch / wall-clock caps
+budget = TrainingBudget(patience=10, schedule='plateau', max_epochs=None, max_seconds=None)
+
+# 'relu' is the original setup; 'tanh' lets Keras run the LSTM on its fused kernel.
+# jit_compile=True compiles the train / predict steps with XLA (see kernel_benchmark.py)
+lstm_activation = 'relu'
+jit_compile = False
+
+if multi_output:
+    # tf.data pipeline with an (N, H) target matrix; last 15% held out for validation
+    train_ds, val_ds = train_val_datasets(train, time_steps=7, target='GHI_Average', horizons=horizons,
+                                          batch_size=64, validation_split=0.15, starts=train_starts)
+
+    # Build and compile the multi-horizon LSTM model
+    lstm_model = build_multi_horizon_lstm((X_train.shape[1], X_train.shape[2]), len(horizons),
+                                          units=100, activation=lstm_activation, dropout=0.5,
+                                          jit_compile=jit_compile)
+    print(fused_kernel_issues(lstm_model) or 'LSTM runs on the fused kernel')
+
+    # Train the model once for all horizons; every horizon shares the history
+    history = lstm_model.fit(train_ds, validation_data=val_ds, epochs=100,
+                             callbacks=budget.callbacks('LSTM multi-horizon'))
+
+    # Predictions for all horizons at once
+    Y_pred = lstm_model.predict(X_test)
+
+    for j, h in enumerate(horizons):
+        histories_lstm[h] = history
+        y_pred_inv = GHI_scaler.inverse_transform(Y_pred[:, j].reshape(-1, 1))
+        y_test_inv = GHI_scaler.inverse_transform(test_targets[h].reshape(-1, 1))
+
+        # Store predictions for comparison
+        predictions_lstm[h] = (y_test_inv.flatten(), y_pred_inv.flatten())
+        results_lstm[h] = LSTM_accuracy_metrics(y_test_inv, y_pred_inv)
+else:
+    for h in horizons:
+        X_train, y_train = datasets[h][:2]  # Get the training data for the horizon
+        X_test, y_test = datasets[h][2:]  # Get the testing data for the horizon
+
+        # Build and compile the LSTM model
+        lstm_model = tf.keras.Sequential([
+            tf.keras.layers.LSTM(units=100, activation=lstm_activation, input_shape=(X_train.shape[1], X_train.shape[2])),
+            tf.keras.layers.Dropout(rate=0.5),
+            tf.keras.layers.Dense(units=1, dtype=output_dtype())
+        ])
+
+        lstm_model.compile(loss='mean_squared_error', optimizer='adam', jit_compile=jit_compile)
+
+        # tf.data pipeline for this horizon: windows gathered on the fly, last 15% held out for validation
+        train_ds, val_ds = train_val_datasets(train, time_steps=7, target='GHI_Average', horizon=h,
+                                              batch_size=64, validation_split=0.15, starts=train_starts)
+
+        # Train the model and store the history
+        history = lstm_model.fit(train_ds, validation_data=val_ds, epochs=100,
+                                 callbacks=budget.callbacks('LSTM %d-hour' % h))
+        histories_lstm[h] = history  # Save the training history
+
+        # Predictions
+        y_pred = lstm_model.predict(X_test)
+        y_pred_inv = GHI_scaler.inverse_transform(y_pred.reshape(-1, 1))
+        y_test_inv = GHI_scaler.inverse_transform(y_test.reshape(-1, 1))
+
+        # Store predictions for comparison
+        predictions_lstm[h] = (y_test_inv.flatten(), y_pred_inv.flatten())
+
+        metrics = LSTM_accuracy_metrics(y_test_inv, y_pred_inv)
+        results_lstm[h] = metrics
 
 # Plot loss for each horizon using LSTM
 plt.figure(figsize=(15, 5))
@@ -301,28 +350,17 @@ plt.show()
 
 """------"""
 
-# Create a DataFrame to store the results
+# Create a DataFrame to store the results: one row per test window (test_starts), with the
+# target time and actual GHI of every horizon taken from the same window
 results_df = pd.DataFrame()
 
-# Add the Date column
-results_df['Date'] = test.index[:len(predictions_lstm[1][0])]
+for j, h in enumerate(horizons):
+    suffix = '' if h == 1 else f' ({h}-Hour Ahead)'
 
-# Add actual GHI values (ensure length matches)
-actual_ghi_values = GHI_scaler.inverse_transform(test['GHI_Average'].values.reshape(-1, 1)).flatten()
-results_df['Actual GHI'] = actual_ghi_values[:len(predictions_lstm[1][0])]
-
-# Add predictions for each horizon
-for h in horizons:
-    pred_col_name = f'Predicted GHI ({h}-Hour Ahead)'
-    pred_values = predictions_lstm[h][1]  # Get prediction values
-
-    # Align lengths by truncating or filling with NaN
-    if len(pred_values) > len(results_df):
-        pred_values = pred_values[:len(results_df)]
-    else:
-        pred_values = np.concatenate((pred_values, [np.nan] * (len(results_df) - len(pred_values))))
-
-    results_df[pred_col_name] = pred_values
+    # Target row of horizon h for window s is s + 7 + h - 1
+    results_df['Date' + suffix] = test.index[test_starts + 7 + h - 1]
+    results_df['Actual GHI' + suffix] = GHI_scaler.inverse_transform(Y_test[:, j].reshape(-1, 1)).flatten()
+    results_df[f'Predicted GHI ({h}-Hour Ahead)'] = predictions_lstm[h][1]
 
 # Save to CSV
 results_df.to_csv('LSTM07_ghi_predictions.csv', index=False)
@@ -333,4 +371,7 @@ print("CSV file 'LSTM07a_ghi_predictions.csv' has been created successfully.")
 results_df.to_excel('GRU07a_ghi_predictions.xlsx', index=False)
 print("Excel file 'GRU07a_ghi_predictions.xlsx' has been created successfully.")
 
-results_df.head()
\ No newline at end of file
+results_df.head()
+
+# Epochs run per fit, what stopped it, and the epochs / seconds saved against 100 epochs
+budget.report()
@@ -17,7 +17,6 @@ import matplotlib.cm as cm
 import seaborn as sns
 from math import sqrt
 from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import MinMaxScaler, LabelEncoder
 from keras.models import Sequential, load_model
 from keras.layers import Dense, LSTM, Dropout, BatchNormalization
 from sklearn.metrics import mean_squared_error as mse
@@ -26,15 +25,23 @@ from tensorflow.keras.losses import MeanSquaredError
 from tensorflow.keras.metrics import RootMeanSquaredError
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint
+from data_loader import load_dataset
+from windowing import make_windows, valid_starts, window_count
+from preprocessing import Preprocessor, artifact_path
 
 """## Load Data"""
 
-df_train = pd.read_csv('/content/busan_dataset.csv')
+# Columns the model uses; only these are loaded
+required_cols = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure', 'CI_Beyer']
+
+# Load through the columnar cache; keep 'Date' as a column like the raw CSV
+df_train = load_dataset('/content/busan_dataset.csv', columns=required_cols).reset_index()
 df_train
 
 df_train.info()
 
-df_test = pd.read_csv("/content/busan_dataset.csv")
+# Same source file as the training frame, so reuse it instead of parsing it twice
+df_test = df_train
 df_test
 
 # Checking null values
@@ -70,7 +77,6 @@ df_train_scaled['Date'] = pd.to_datetime(df_train_scaled['Date'])
 df_train_scaled.set_index('Date', inplace=True)
 df_train_scaled.head()
 
-required_cols = ['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure', 'CI_Beyer']
 df_train_scaled = df_train_scaled[required_cols]
 df_test_scaled = df_test_scaled[required_cols]
 
@@ -123,16 +129,14 @@ sns.histplot(data=df_test_scaled, x="CI_Beyer", kde=True, color="teal", ax=axs[1
 
 plt.show()
 
-scaler = MinMaxScaler()
-
 # Define the columns to scale
 columns = (['GHI_Average', 'SunZenith_KMU', 'Ambient_Pressure', 'CI_Beyer'])
 
-df_test_scaled = df_test_scaled[columns]
-
-# Scale the selected columns to the range 0-1
-df_train_scaled[columns] = scaler.fit_transform(df_train_scaled[columns])
-df_test_scaled[columns] = scaler.transform(df_test_scaled[columns])
+# Scale the selected columns to the range 0-1 on float32 buffers; GHI_Average gets
+# its own scaler so it can be inverse-transformed on its own
+prep = Preprocessor(columns, columns[1:], target='GHI_Average', scaler_factory='MinMaxScaler').fit(df_train_scaled)
+df_train_scaled = prep.transform_frame(df_train_scaled)
+df_test_scaled = prep.transform_frame(df_test_scaled)
 
 # Show the scaled data
 df_train_scaled.head()
@@ -141,28 +145,31 @@ df_test_scaled.head()
 
 """## Split the data into training and test sets"""
 
+n_future = 1
+n_past = 6
+
+# Only gap-free windows (see windowing); the test frame keeps 'Date' as a column, so its timestamps are passed
+gap_aware = True
+train_starts = valid_starts(df_train_scaled, n_past, horizon=n_future, gap_aware=gap_aware)
+test_starts = valid_starts(df_test_scaled, n_past, horizon=n_future, index=df_test['Date'], gap_aware=gap_aware)
+print(f'Windows kept: train {len(train_starts)} of {window_count(len(df_train_scaled), n_past, n_future)}, '
+      f'test {len(test_starts)} of {window_count(len(df_test_scaled), n_past, n_future)}')
+
 df_train_scaled = np.array(df_train_scaled)
 df_test_scaled = np.array(df_test_scaled)
 
-X = []
-y = []
-n_future = 1
-n_past = 6
+# Windows of the n_past previous rows of the inputs (columns 1:) and the GHI
+# value (column 0) n_future steps ahead, for the valid start rows; y as [samples, 1]
 
 #  Train Sets
-for i in range(n_past, len(df_train_scaled) - n_future+1):
-    X.append(df_train_scaled[i - n_past:i, 1:df_train_scaled.shape[1]])
-    y.append(df_train_scaled[i + n_future - 1:i + n_future, 0])
-X_train, y_train = np.array(X), np.array(y)
+X_train, y_train = make_windows(df_train_scaled, n_past, target=0, horizon=n_future, features=slice(1, None),
+                                starts=train_starts)
+y_train = y_train[:, None]
 
 #  Test Sets
-
-X = []
-y = []
-for i in range(n_past, len(df_test_scaled) - n_future+1):
-    X.append(df_test_scaled[i - n_past:i, 1:df_test_scaled.shape[1]])
-    y.append(df_test_scaled[i + n_future - 1:i + n_future, 0])
-X_test, y_test = np.array(X), np.array(y)
+X_test, y_test = make_windows(df_test_scaled, n_past, target=0, horizon=n_future, features=slice(1, None),
+                              starts=test_starts)
+y_test = y_test[:, None]
 
 print('X_train shape : {}   y_train shape : {} \n'
       'X_test shape : {}      y_test shape : {} '.format(X_train.shape, y_train.shape, X_test.shape, y_test.shape))
@@ -189,6 +196,9 @@ model.summary()
 # fit network
 history = model.fit(X_train, y_train, epochs=50, batch_size=32, validation_split=0.1, callbacks=[early_stopping, checkpoint], shuffle=False)
 
+# Save the fitted scalers next to the model checkpoint
+prep.save(artifact_path('/content/best_model.h5.keras'))
+
 """## Evaluate the Model"""
 
 # Load the best model
@@ -222,27 +232,10 @@ print('Test RMSE: %.5f' % rmse)
 # Make predictions
 y_pred_scaled = model.predict(X_test)
 
-# Since only the 'pollution' column was used as the output,
-# create an empty array with the same shape as the original dataset
-# but only fill the pollution column with predictions
-y_pred_actual = np.zeros((y_pred_scaled.shape[0], df_test_scaled.shape[1]))
-y_pred_actual[:, 0] = y_pred_scaled[:, 0]  # fill only the pollution column
-
-# Inverse transform the predictions
-y_pred_actual = scaler.inverse_transform(y_pred_actual)
-
-# Get the actual pollution values
-y_pred_actual = y_pred_actual[:, 0]  # extract the pollution column
-
-# Create an empty array to store the actual y_test values
-y_test_actual = np.zeros((y_test.shape[0], df_test_scaled.shape[1]))
-y_test_actual[:, 0] = y_test[:, 0]
-
-# Inverse transform the y_test values
-y_test_actual = scaler.inverse_transform(y_test_actual)
-
-# Get the actual pollution values
-y_test_actual = y_test_actual[:, 0]  # extract the pollution column
+# Inverse transform the predictions and the y_test values; only the GHI column
+# was used as the output, so only its scaler is applied
+y_pred_actual = prep.inverse_target(y_pred_scaled[:, 0])
+y_test_actual = prep.inverse_target(y_test[:, 0])
 
 import matplotlib.pyplot as plt
 
@@ -264,8 +257,8 @@ print('Test RMSE: %.3f' % rmse)
 
 import pandas as pd
 
-# Assuming df_test has a 'Date' column
-date_column = df_test['Date'].iloc[n_past:len(df_test_scaled) - n_future + 1]
+# Date of each test target (n_future steps after its window)
+date_column = df_test['Date'].iloc[test_starts + n_past + n_future - 1]
 
 # Create a DataFrame for the results
 results_df = pd.DataFrame({
@@ -281,4 +274,31 @@ results_df.head()
 results_df.to_csv('pollution_predictions.csv', index=False)
 
 # Save the table to an Excel file
-results_df.to_excel('pollution_predictions.xlsx', index=False)
\ No newline at end of file
+results_df.to_excel('pollution_predictions.xlsx', index=False)
+
+"""# TFLite Export"""
+
+from tflite_export import TFLiteModel, benchmark, export_tflite
+
+# Flatbuffers of the best checkpoint for CPU serving without Keras: batch 1 for per-sample
+# latency and batch 256 with float16 weights for bulk scoring
+export_tflite('/content/best_model.h5.keras', batch_size=1)
+export_tflite('/content/best_model.h5.keras', batch_size=256, quantization='float16')
+lite_model = TFLiteModel('/content/best_model.h5.float16.b256.tflite')
+y_pred_lite = prep.inverse_target(lite_model.predict(X_test)[:, 0])
+
+# Load time, per-sample latency, throughput and drift of each quantization against Keras
+benchmark('/content/best_model.h5.keras', X_test)
+
+"""# NumPy Inference"""
+
+import numpy_inference
+
+# The same checkpoint scored without TensorFlow: the weights are read with h5py and the
+# LSTM(32) -> LSTM(16) -> Dense forward pass runs as NumPy matmuls
+numpy_model = numpy_inference.load('/content/best_model.h5.keras')
+y_pred_numpy = prep.inverse_target(numpy_model.predict(X_test)[:, 0])
+numpy_inference.parity('/content/best_model.h5.keras', X_test)
+
+# Cold start and peak RSS of a fresh process, per-sample latency and throughput against Keras
+numpy_inference.benchmark('/content/best_model.h5.keras', X_test)
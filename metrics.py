@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""Accuracy metrics shared by the model scripts."""
+
+import numpy as np
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+
+
+def accuracy_metrics(y_test_inv, y_pred_inv):
+    """R^2, MAE, MSE, RMSE, MBE, RRMSE and RMBE of inverse-scaled GHI values."""
+    # Flatten the arrays
+    y_test_flat = np.asarray(y_test_inv, dtype=np.float64).flatten()
+    y_pred_flat = np.asarray(y_pred_inv, dtype=np.float64).flatten()
+
+    # Compute the differences
+    diff = y_test_flat - y_pred_flat
+
+    # Compute metrics
+    mse = mean_squared_error(y_test_flat, y_pred_flat)
+    rmse = np.sqrt(mse)
+    mbe = np.mean(diff)
+    return {
+        'R^2': r2_score(y_test_flat, y_pred_flat),
+        'MAE': mean_absolute_error(y_test_flat, y_pred_flat),
+        'MSE': mse,
+        'RMSE': rmse,
+        'MBE': mbe,
+        'RRMSE': rmse / np.mean(y_test_flat),
+        'RMBE': mbe / np.mean(y_test_flat),
+    }
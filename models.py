@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""Keras model builders shared by the scripts.
+
+Every builder takes `jit_compile`: True compiles the train and predict steps
+with XLA, None leaves Keras' default. LSTM and GRU layers only run on Keras'
+fused kernel with the FUSED_KERNEL_CONFIG settings (the lstm_07.py
+relu LSTM does not); fused_kernel_issues lists what keeps a model off it.
+"""
+
+import warnings
+
+import tensorflow as tf
+
+from precision import output_dtype
+
+# LSTM / GRU settings Keras needs to use its fused (cuDNN) kernel
+FUSED_KERNEL_CONFIG = {'activation': 'tanh', 'recurrent_activation': 'sigmoid',
+                       'recurrent_dropout': 0, 'unroll': False, 'use_bias': True}
+
+
+def fused_kernel_issues(model):
+    """Messages for every LSTM / GRU setting of `model` that rules out the fused kernel."""
+    issues = []
+    for layer in model.layers:
+        if not isinstance(layer, (tf.keras.layers.LSTM, tf.keras.layers.GRU)):
+            continue
+        config = layer.get_config()
+        for key, value in FUSED_KERNEL_CONFIG.items():
+            if config.get(key, value) != value:
+                issues.append('%s %r: %s=%r (fused kernel needs %r)' % (
+                    type(layer).__name__, layer.name, key, config[key], value))
+        if isinstance(layer, tf.keras.layers.GRU) and not config.get('reset_after', True):
+            issues.append('GRU %r: reset_after=False (fused kernel needs True)' % (layer.name,))
+    return issues
+
+
+def check_fused_kernels(model):
+    """Warn about (and return) the fused_kernel_issues of `model`."""
+    issues = fused_kernel_issues(model)
+    for issue in issues:
+        warnings.warn(issue, stacklevel=2)
+    return issues
+
+
+def _compile(model, loss, optimizer='adam', jit_compile=None):
+    kwargs = {} if jit_compile is None else {'jit_compile': jit_compile}
+    model.compile(loss=loss, optimizer=optimizer, **kwargs)
+    return model
+
+
+def build_multi_horizon_lstm(input_shape, n_horizons, units=100, activation='relu', dropout=0.5,
+                             heads='shared', loss='mean_squared_error', optimizer='adam', jit_compile=None):
+    """One LSTM encoder with an output per forecast horizon, trained in a single fit.
+
+    The encoder is the lstm_07.py LSTM (100 units, relu, Dropout 0.5).
+    heads='shared' ends in one Dense(n_horizons); heads='separate' gives
+    every horizon its own Dense(1), concatenated into the same [batch, H] output.
+    """
+    inputs = tf.keras.Input(shape=input_shape)
+    x = tf.keras.layers.LSTM(units=units, activation=activation)(inputs)
+    x = tf.keras.layers.Dropout(rate=dropout)(x)
+    if heads == 'shared':
+        outputs = tf.keras.layers.Dense(units=n_horizons, dtype=output_dtype())(x)
+    elif heads == 'separate':
+        outputs = tf.keras.layers.Concatenate()(
+            [tf.keras.layers.Dense(units=1, name='horizon_%d' % j, dtype=output_dtype())(x)
+             for j in range(n_horizons)])
+    else:
+        raise ValueError("heads must be 'shared' or 'separate', got %r" % (heads,))
+    return _compile(tf.keras.Model(inputs, outputs), loss, optimizer, jit_compile)
+
+
+# The "8 MODEL.py" zoo: same layers, sizes and compile settings as the script.
+# Outputs are float32 under the mixed precision policies (see precision.py)
+
+def build_gru(input_shape, units=100, dropout=0.5, jit_compile=None):
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=input_shape),
+        tf.keras.layers.GRU(units=units),
+        tf.keras.layers.Dropout(rate=dropout),
+        tf.keras.layers.Dense(units=1, dtype=output_dtype()),
+    ])
+    return _compile(model, 'mean_squared_error', jit_compile=jit_compile)
+
+
+def build_lstm(input_shape, units=100, dropout=0.5, activation='tanh', jit_compile=None):
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=input_shape),
+        tf.keras.layers.LSTM(units=units, activation=activation),
+        tf.keras.layers.Dropout(rate=dropout),
+        tf.keras.layers.Dense(units=1, dtype=output_dtype()),
+    ])
+    return _compile(model, 'mse', jit_compile=jit_compile)
+
+
+def build_rnn(input_shape, units=100, dropout=0.5, activation='relu', unroll=False, jit_compile=None):
+    """SimpleRNN has no fused kernel; unroll=True trades memory for speed on short windows."""
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=input_shape),
+        tf.keras.layers.SimpleRNN(units=units, activation=activation, unroll=unroll),
+        tf.keras.layers.Dropout(rate=dropout),
+        tf.keras.layers.Dense(units=1, dtype=output_dtype()),
+    ])
+    return _compile(model, 'mse', jit_compile=jit_compile)
+
+
+def build_cnn(input_shape, filters=64, kernel_size=3, dropout=0.5, jit_compile=None):
+    model = tf.keras.Sequential([
+        tf.keras.Input(shape=input_shape),
+        tf.keras.layers.Conv1D(filters=filters, kernel_size=kernel_size, activation='relu'),
+        tf.keras.layers.MaxPooling1D(pool_size=2),
+        tf.keras.layers.Dropout(rate=dropout),
+        tf.keras.layers.Flatten(),
+        tf.keras.layers.Dense(units=1, dtype=output_dtype()),
+    ])
+    return _compile(model, 'mse', jit_compile=jit_compile)
+
+
+def build_dense(input_shape, units=100, dropout=0.5, hidden_layers=1, jit_compile=None):
+    """The ANN, MLP and DNN of the zoo: `hidden_layers` Dense layers (one in the scripts) on flattened windows."""
+    hidden = []
+    for _ in range(hidden_layers):
+        hidden += [tf.keras.layers.Dense(units=units, activation='relu'), tf.keras.layers.Dropout(rate=dropout)]
+    model = tf.keras.Sequential([tf.keras.Input(shape=input_shape)] + hidden
+                                + [tf.keras.layers.Dense(units=1, dtype=output_dtype())])
+    return _compile(model, 'mean_squared_error', jit_compile=jit_compile)
+
+
+# name -> (builder, takes flattened [samples, time_steps * features] windows)
+ZOO = {
+    'GRU': (build_gru, False),
+    'LSTM': (build_lstm, False),
+    'RNN': (build_rnn, False),
+    'ANN': (build_dense, True),
+    'CNN': (build_cnn, False),
+    'MLP': (build_dense, True),
+    'DNN': (build_dense, True),
+}
+
+
+def build_model(name, time_steps, n_features, **kwargs):
+    """Build zoo model `name` for [time_steps, n_features] windows."""
+    builder, flatten = ZOO[name]
+    input_shape = (time_steps * n_features,) if flatten else (time_steps, n_features)
+    return builder(input_shape, **kwargs)
+
+
+def _legacy_layer(base):
+    # Keras 2 H5 files store RNN arguments Keras 3 no longer accepts
+    class Legacy(base):
+        def __init__(self, *args, time_major=False, **kwargs):
+            super().__init__(*args, **kwargs)
+
+    Legacy.__name__ = base.__name__
+    return Legacy
+
+
+LEGACY_OBJECTS = {layer.__name__: _legacy_layer(layer)
+                  for layer in (tf.keras.layers.LSTM, tf.keras.layers.GRU, tf.keras.layers.SimpleRNN)}
+
+
+def load_model(path, compile=False):
+    """Load a saved model, including Keras 2 .h5 files such as best_model.h5."""
+    custom_objects = LEGACY_OBJECTS if str(path).endswith(('.h5', '.hdf5')) else None
+    return tf.keras.models.load_model(path, compile=compile, custom_objects=custom_objects)
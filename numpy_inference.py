@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+"""Pure-NumPy inference for the trained models, without TensorFlow.
+
+load() reads a saved Sequential model (.keras, or Keras 2 .h5 such as
+best_model.h5) with only json, zipfile and h5py, and rebuilds its forward
+pass from the layer stacks the scripts use:
+- LSTM, GRU and SimpleRNN, with or without return_sequences (e.g. the
+  stacked LSTM(32) -> LSTM(16) of the multivariate script);
+- Conv1D, MaxPooling1D and Flatten;
+- Dense, and Dropout (the identity at inference).
+Each layer works on the whole batch with vectorised matmuls. The recurrent
+cells are shared with online_inference.StreamingForecaster.
+
+    model = load('/content/best_model.h5.keras')
+    y_pred = model.predict(X_test)
+
+    python numpy_inference.py /content/best_model.h5.keras --check --bench
+    python numpy_inference.py --zoo    # parity of every models.ZOO model, .keras and .h5
+"""
+
+import argparse
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import zipfile
+
+import numpy as np
+
+
+def _sigmoid(x):
+    return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+
+def _relu(x):
+    return np.maximum(x, 0.0)
+
+
+def _linear(x):
+    return x
+
+
+ACTIVATIONS = {'tanh': np.tanh, 'sigmoid': _sigmoid, 'relu': _relu, 'linear': _linear}
+
+
+def activation(name):
+    """NumPy function of Keras activation `name`."""
+    if callable(name):
+        name = name.__name__
+    if isinstance(name, dict):  # a serialized activation
+        name = name.get('config', {}).get('name', name.get('class_name'))
+    if name is None:
+        name = 'linear'
+    if name not in ACTIVATIONS:
+        raise ValueError('unsupported activation %r (supported: %s)' % (name, ', '.join(ACTIVATIONS)))
+    return ACTIVATIONS[name]
+
+
+class LSTMCell:
+    """keras.layers.LSTM step: gates i, f, c, o."""
+
+    n_states = 2
+
+    def __init__(self, kernel, recurrent_kernel, bias=None, activation_='tanh', recurrent_activation='sigmoid'):
+        self.kernel = kernel
+        self.recurrent_kernel = recurrent_kernel
+        self.bias = np.zeros(kernel.shape[1], dtype=kernel.dtype) if bias is None else bias
+        self.units = recurrent_kernel.shape[0]
+        self.act = activation(activation_)
+        self.recurrent_act = activation(recurrent_activation)
+
+    def step(self, x, h, c):
+        u = self.units
+        z = x @ self.kernel
+        z += h @ self.recurrent_kernel
+        z += self.bias
+        i = self.recurrent_act(z[:, :u])
+        f = self.recurrent_act(z[:, u:2 * u])
+        o = self.recurrent_act(z[:, 3 * u:])
+        c = f * c + i * self.act(z[:, 2 * u:3 * u])
+        return o * self.act(c), c
+
+
+class GRUCell:
+    """keras.layers.GRU step: gates z, r, h (reset_after as in Keras' default)."""
+
+    n_states = 1
+
+    def __init__(self, kernel, recurrent_kernel, bias=None, activation_='tanh', recurrent_activation='sigmoid',
+                 reset_after=True):
+        self.kernel = kernel
+        self.recurrent_kernel = recurrent_kernel
+        if bias is None:
+            bias = np.zeros((2, kernel.shape[1]) if reset_after else kernel.shape[1], dtype=kernel.dtype)
+        self.input_bias, self.recurrent_bias = (bias[0], bias[1]) if reset_after else (bias, 0.0)
+        self.units = recurrent_kernel.shape[0]
+        self.reset_after = reset_after
+        self.act = activation(activation_)
+        self.recurrent_act = activation(recurrent_activation)
+
+    def step(self, x, h):
+        u = self.units
+        zx = x @ self.kernel
+        zx += self.input_bias
+        if self.reset_after:
+            zh = h @ self.recurrent_kernel
+            zh += self.recurrent_bias
+            z = self.recurrent_act(zx[:, :u] + zh[:, :u])
+            r = self.recurrent_act(zx[:, u:2 * u] + zh[:, u:2 * u])
+            candidate = self.act(zx[:, 2 * u:] + r * zh[:, 2 * u:])
+        else:
+            zh = h @ self.recurrent_kernel[:, :2 * u]
+            z = self.recurrent_act(zx[:, :u] + zh[:, :u])
+            r = self.recurrent_act(zx[:, u:2 * u] + zh[:, u:])
+            candidate = self.act(zx[:, 2 * u:] + (r * h) @ self.recurrent_kernel[:, 2 * u:])
+        return (z * h + (1.0 - z) * candidate,)
+
+
+class SimpleRNNCell:
+    """keras.layers.SimpleRNN step."""
+
+    n_states = 1
+
+    def __init__(self, kernel, recurrent_kernel, bias=None, activation_='tanh'):
+        self.kernel = kernel
+        self.recurrent_kernel = recurrent_kernel
+        self.bias = np.zeros(kernel.shape[1], dtype=kernel.dtype) if bias is None else bias
+        self.units = recurrent_kernel.shape[0]
+        self.act = activation(activation_)
+
+    def step(self, x, h):
+        z = x @ self.kernel
+        z += h @ self.recurrent_kernel
+        z += self.bias
+        return (self.act(z),)
+
+
+def make_cell(class_name, config, weights):
+    """NumPy cell of recurrent layer `class_name` ('LSTM', 'GRU', 'SimpleRNN') from its config and weights."""
+    kernel, recurrent_kernel = weights[:2]
+    bias = weights[2] if len(weights) > 2 else None
+    if class_name == 'LSTM':
+        return LSTMCell(kernel, recurrent_kernel, bias, config['activation'], config['recurrent_activation'])
+    if class_name == 'GRU':
+        return GRUCell(kernel, recurrent_kernel, bias, config['activation'], config['recurrent_activation'],
+                       reset_after=config.get('reset_after', True))
+    if class_name == 'SimpleRNN':
+        return SimpleRNNCell(kernel, recurrent_kernel, bias, config['activation'])
+    raise ValueError('%s is not a recurrent layer' % (class_name,))
+
+
+class Recurrent:
+    """An LSTM / GRU / SimpleRNN layer over [n, time_steps, features] inputs."""
+
+    def __init__(self, cell, return_sequences=False):
+        self.cell = cell
+        self.return_sequences = return_sequences
+
+    def __call__(self, X):
+        n = len(X)
+        state = tuple(np.zeros((n, self.cell.units), dtype=X.dtype) for _ in range(self.cell.n_states))
+        outputs = []
+        for t in range(X.shape[1]):
+            state = self.cell.step(X[:, t], *state)
+            if self.return_sequences:
+                outputs.append(state[0])
+        return np.stack(outputs, axis=1) if self.return_sequences else state[0]
+
+
+class Dense:
+    def __init__(self, kernel, bias=None, activation_='linear'):
+        self.kernel = kernel
+        self.bias = bias
+        self.act = activation(activation_)
+
+    def __call__(self, X):
+        y = X @ self.kernel
+        if self.bias is not None:
+            y += self.bias
+        return self.act(y)
+
+
+def _same_padding(length, size, stride, dilation=1):
+    out = -(-length // stride)
+    total = max((out - 1) * stride + (size - 1) * dilation + 1 - length, 0)
+    return total // 2, total - total // 2
+
+
+class Conv1D:
+    """keras.layers.Conv1D (channels_last) as one matmul over the gathered patches."""
+
+    def __init__(self, kernel, bias=None, strides=1, padding='valid', dilation_rate=1, activation_='linear'):
+        self.size, in_channels, self.filters = kernel.shape
+        self.kernel = kernel.reshape(self.size * in_channels, self.filters)
+        self.bias = bias
+        self.strides = strides
+        self.padding = padding
+        self.dilation = dilation_rate
+        self.act = activation(activation_)
+
+    def __call__(self, X):
+        span = (self.size - 1) * self.dilation
+        if self.padding == 'causal':
+            X = np.pad(X, ((0, 0), (span, 0), (0, 0)))
+        elif self.padding == 'same':
+            X = np.pad(X, ((0, 0), _same_padding(X.shape[1], self.size, self.strides, self.dilation), (0, 0)))
+        steps = (X.shape[1] - span - 1) // self.strides + 1
+        idx = np.arange(steps)[:, None] * self.strides + np.arange(self.size) * self.dilation
+        patches = X[:, idx].reshape(len(X) * steps, -1)
+        y = patches @ self.kernel
+        if self.bias is not None:
+            y += self.bias
+        return self.act(y).reshape(len(X), steps, self.filters)
+
+
+class MaxPooling1D:
+    def __init__(self, pool_size=2, strides=None, padding='valid'):
+        self.pool_size = pool_size
+        self.strides = strides or pool_size
+        self.padding = padding
+
+    def __call__(self, X):
+        if self.padding == 'same':
+            X = np.pad(X, ((0, 0), _same_padding(X.shape[1], self.pool_size, self.strides), (0, 0)),
+                       constant_values=-np.inf)
+        steps = (X.shape[1] - self.pool_size) // self.strides + 1
+        idx = np.arange(steps)[:, None] * self.strides + np.arange(self.pool_size)
+        return X[:, idx].max(axis=2)
+
+
+def _flatten(X):
+    return X.reshape(len(X), -1)
+
+
+def _scalar(value):
+    return value[0] if isinstance(value, (list, tuple)) else value
+
+
+def build_layer(class_name, config, weights):
+    """NumPy layer for one Keras layer config; None for layers that do nothing at inference."""
+    if class_name in ('InputLayer', 'Dropout'):
+        return None
+    if class_name in ('LSTM', 'GRU', 'SimpleRNN'):
+        if config.get('go_backwards'):
+            raise ValueError('%s %r runs backwards, which is not supported' % (class_name, config.get('name')))
+        return Recurrent(make_cell(class_name, config, weights), config.get('return_sequences', False))
+    if class_name == 'Dense':
+        return Dense(weights[0], weights[1] if len(weights) > 1 else None, config.get('activation'))
+    if class_name == 'Conv1D':
+        if config.get('data_format', 'channels_last') != 'channels_last':
+            raise ValueError('Conv1D %r: only channels_last is supported' % (config.get('name'),))
+        return Conv1D(weights[0], weights[1] if len(weights) > 1 else None, _scalar(config.get('strides', 1)),
+                      config.get('padding', 'valid'), _scalar(config.get('dilation_rate', 1)),
+                      config.get('activation'))
+    if class_name == 'MaxPooling1D':
+        return MaxPooling1D(_scalar(config.get('pool_size', 2)), _scalar(config.get('strides')),
+                            config.get('padding', 'valid'))
+    if class_name == 'Flatten':
+        return _flatten
+    raise ValueError('layer %s %r is not supported' % (class_name, config.get('name')))
+
+
+class NumpyModel:
+    """A Sequential model's forward pass as a list of NumPy layers."""
+
+    def __init__(self, layers, input_shape, dtype=np.float32):
+        self.layers = layers
+        self.input_shape = input_shape
+        self.dtype = np.dtype(dtype)
+
+    def __call__(self, X):
+        X = np.asarray(X, dtype=self.dtype)
+        for layer in self.layers:
+            X = layer(X)
+        return X
+
+    def predict(self, X, batch_size=None):
+        """Outputs [n, outputs] for X [n, *input_shape], like model.predict."""
+        X = np.asarray(X, dtype=self.dtype)
+        if batch_size is None or len(X) <= batch_size:
+            return self(X)
+        return np.concatenate([self(X[i:i + batch_size]) for i in range(0, len(X), batch_size)])
+
+
+def _snake_case(name):
+    # Keras' naming.to_snake_case: the paths of layers in .keras weight files
+    name = re.sub(r'\W+', '', name)
+    name = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
+    name = re.sub('([a-z])([A-Z])', r'\1_\2', name)
+    return name.lower()
+
+
+def _layer_configs(config):
+    if config.get('class_name') != 'Sequential':
+        raise ValueError('only Sequential models are supported, got %s' % (config.get('class_name'),))
+    return [(layer['class_name'], layer['config']) for layer in config['config']['layers']]
+
+
+def _input_shape(layers):
+    for class_name, config in layers:
+        shape = config.get('batch_shape') or config.get('batch_input_shape')
+        if shape:
+            return tuple(shape[1:])
+    return None
+
+
+def _read_keras(path):
+    """(layer configs, weights per layer) of a Keras 3 .keras archive."""
+    import h5py
+
+    with zipfile.ZipFile(path) as archive:
+        layers = _layer_configs(json.loads(archive.read('config.json')))
+        weights_file = h5py.File(io.BytesIO(archive.read('model.weights.h5')), 'r')
+    weights, seen = [], {}
+    with weights_file:
+        for class_name, config in layers:
+            if class_name == 'InputLayer':
+                weights.append([])
+                continue
+            base = _snake_case(class_name)
+            key = base if base not in seen else '%s_%d' % (base, seen[base])
+            seen[base] = seen.get(base, 0) + 1
+            group = weights_file['layers'][key]
+            if 'cell' in group:
+                group = group['cell']
+            variables = group['vars']
+            weights.append([np.asarray(variables[str(i)]) for i in range(len(variables))])
+    return layers, weights
+
+
+def _read_h5(path):
+    """(layer configs, weights per layer) of a Keras 2 style .h5 file."""
+    import h5py
+
+    with h5py.File(path, 'r') as f:
+        config = f.attrs['model_config']
+        layers = _layer_configs(json.loads(config.decode() if isinstance(config, bytes) else config))
+        root = f['model_weights'] if 'model_weights' in f else f
+        weights = []
+        for class_name, config in layers:
+            if class_name == 'InputLayer' or config['name'] not in root:
+                weights.append([])
+                continue
+            group = root[config['name']]
+            names = [n.decode() if isinstance(n, bytes) else n for n in group.attrs['weight_names']]
+            weights.append([np.asarray(group[name]) for name in names])
+    return layers, weights
+
+
+def load(path, dtype=np.float32):
+    """NumpyModel of the Sequential model saved at `path` (.keras or .h5)."""
+    layers, weights = _read_keras(path) if zipfile.is_zipfile(path) else _read_h5(path)
+    built = []
+    for (class_name, config), layer_weights in zip(layers, weights):
+        layer = build_layer(class_name, config, [w.astype(dtype) for w in layer_weights])
+        if layer is not None:
+            built.append(layer)
+    return NumpyModel(built, _input_shape(layers), dtype)
+
+
+def parity(path, X, atol=1e-4):
+    """Max abs difference between the NumPy engine and Keras on X; raises if above `atol`."""
+    from models import load_model
+
+    expected = np.asarray(load_model(path).predict(X, verbose=0))
+    diff = float(np.abs(load(path).predict(X) - expected).max())
+    if diff > atol:
+        raise AssertionError('%s: NumPy engine differs from Keras by %.3g (> %.3g)' % (path, diff, atol))
+    return diff
+
+
+def _parity_models(time_steps, n_features):
+    # Every zoo model, plus the layer settings the zoo does not cover
+    import tensorflow as tf
+    from models import ZOO, build_model
+
+    built = {name: build_model(name, time_steps, n_features) for name in ZOO}
+    layers = tf.keras.layers
+    extras = {
+        'stacked LSTM': [layers.LSTM(32, return_sequences=True), layers.Dropout(0.2), layers.LSTM(16)],
+        'GRU reset_after=False': [layers.GRU(16, reset_after=False, return_sequences=True),
+                                  layers.SimpleRNN(8, activation='tanh')],
+        'LSTM relu': [layers.LSTM(16, activation='relu')],
+        'Conv1D same / causal': [layers.Conv1D(8, 3, padding='same', activation='relu'),
+                                 layers.Conv1D(4, 2, padding='causal', dilation_rate=2), layers.Flatten()],
+    }
+    for name, stack in extras.items():
+        built[name] = tf.keras.Sequential([tf.keras.Input(shape=(time_steps, n_features))] + stack
+                                          + [layers.Dense(1)])
+    return built
+
+
+def check_zoo(directory=None, time_steps=7, n_features=9, samples=256, atol=1e-5, seed=0):
+    """Parity of load() with model.predict for every zoo model, saved as .keras and as .h5.
+
+    Models are built with fixed seeds (random weights, no training) and
+    scored on seeded standard-normal windows. Returns one row per model and
+    format with the max abs difference; raises AssertionError if any output
+    is not np.allclose to Keras within `atol`.
+    """
+    import tempfile
+
+    import pandas as pd
+    import tensorflow as tf
+
+    rng = np.random.default_rng(seed)
+    X = rng.standard_normal((samples, time_steps, n_features)).astype(np.float32)
+    tf.keras.utils.set_random_seed(seed)
+    rows, failed = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = directory or tmp
+        for name, model in _parity_models(time_steps, n_features).items():
+            inputs = X.reshape(samples, -1) if len(model.input_shape) == 2 else X
+            expected = np.asarray(model.predict(inputs, verbose=0))
+            for ext in ('.keras', '.h5'):
+                path = os.path.join(directory, re.sub(r'\W+', '_', name).strip('_') + ext)
+                model.save(path)
+                actual = load(path).predict(inputs)
+                diff = float(np.abs(actual - expected).max())
+                rows.append({'Model': name, 'Format': ext, 'Max abs diff': diff})
+                if not np.allclose(actual, expected, atol=atol):
+                    failed.append('%s (%s): %.3g' % (name, ext, diff))
+    if failed:
+        raise AssertionError('NumPy engine differs from Keras by more than %.3g: %s' % (atol, ', '.join(failed)))
+    return pd.DataFrame(rows)
+
+
+_COLD_START = {
+    'numpy': 'import numpy_inference; m = numpy_inference.load(%r)',
+    'keras': 'import models; m = models.load_model(%r)',
+}
+
+
+def cold_start(path, engine):
+    """Seconds and peak RSS MB of a fresh process that imports `engine` ('numpy' or 'keras') and loads `path`."""
+    # VmHWM, unlike ru_maxrss, is not carried over from the parent across exec
+    code = ('import time; t = time.perf_counter(); %s; s = time.perf_counter() - t; '
+            'hwm = [l.split()[1] for l in open("/proc/self/status") if l.startswith("VmHWM")]; '
+            'print(s, hwm[0])' % (_COLD_START[engine] % (path,)))
+    env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL='3')
+    here = os.path.dirname(os.path.abspath(__file__))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [here, env.get('PYTHONPATH')]))
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, env=env, check=True)
+    seconds, max_rss = out.stdout.split()[-2:]
+    return float(seconds), int(max_rss) / 1024
+
+
+def benchmark(path, X, repeats=50, batch_size=256):
+    """Cold start, RSS, single-sample latency and batch throughput of the NumPy engine and Keras."""
+    import pandas as pd
+    from models import load_model
+    from tflite_export import median_seconds
+
+    engines = {'numpy': load(path), 'keras': load_model(path)}
+    predict = {'numpy': lambda X: engines['numpy'].predict(X),
+               'keras': lambda X: engines['keras'].predict_on_batch(X)}
+    rows = []
+    for name in engines:
+        seconds, rss = cold_start(path, name)
+        latency = median_seconds(lambda: predict[name](X[:1]), repeats)
+        throughput = median_seconds(lambda: [predict[name](X[i:i + batch_size])
+                                              for i in range(0, len(X), batch_size)], max(repeats // 10, 3))
+        rows.append({'Engine': name, 'Cold start s': seconds, 'Peak RSS MB': rss,
+                     'Latency ms': latency * 1e3, 'Samples/s': len(X) / throughput})
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('model', nargs='?', help='saved Sequential model (.keras or .h5)')
+    parser.add_argument('--check', action='store_true', help='compare the outputs with Keras')
+    parser.add_argument('--bench', action='store_true', help='cold start, latency and throughput against Keras')
+    parser.add_argument('--zoo', action='store_true',
+                        help='parity of every models.ZOO model saved as .keras and .h5 (no model needed)')
+    parser.add_argument('--samples', type=int, default=2048)
+    args = parser.parse_args(argv)
+
+    if args.zoo:
+        df = check_zoo()
+        print(df.to_string(index=False))
+        return df
+    if args.model is None:
+        parser.error('a model path is required unless --zoo is given')
+
+    model = load(args.model)
+    X = np.random.default_rng(0).standard_normal((args.samples,) + model.input_shape).astype(np.float32)
+    if args.check:
+        print('max abs diff to Keras: %.3g' % parity(args.model, X))
+    if args.bench:
+        print(benchmark(args.model, X).round(4).to_string(index=False))
+    if not (args.check or args.bench):
+        print(model.predict(X[:5]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""Stateful streaming inference for the recurrent models.
+
+Serving a windowed LSTM / GRU re-runs all time_steps cell steps for every new
+hour, one call per site. StreamingForecaster instead keeps each site's
+recurrent states between calls and ingests one new scaled feature row per
+call. It holds time_steps staggered states per site, each restarted from
+zero every time_steps rows, so one of them has always seen exactly the last
+time_steps rows: every forecast equals the windowed model's prediction. A
+call is one cell step over all of them, vectorised over sites, so one call
+serves thousands of sites. The cells are the NumPy LSTM, GRU and SimpleRNN
+cells of numpy_inference (RecurrentEngine loads a trained model's weights
+into them).
+
+A site's states are reset at every gap in its series (a row not one `freq`
+after the previous one, e.g. overnight) and at rows with NaNs, the same
+breaks windowing.valid_starts honours. A forecast is emitted once
+`warmup` rows (time_steps by default) have been ingested since the reset.
+check_equivalence streams a scaled frame and asserts that the forecasts
+match the windowed model's.
+
+    forecaster = StreamingForecaster(lstm_model, n_sites=1000, prep=prep)
+    ghi_next_hour = forecaster.step(rows, times=now)    # rows: [1000, features], unscaled
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+
+from numpy_inference import activation, make_cell
+from windowing import HOURLY, WindowIndex, as_matrix, column_index
+
+
+def cell_from_layer(layer, dtype=np.float32):
+    """NumPy cell with the weights and settings of a Keras LSTM, GRU or SimpleRNN layer."""
+    import tensorflow as tf
+
+    config = layer.get_config()
+    if config.get('go_backwards'):
+        raise ValueError('%s %r runs backwards and cannot be streamed' % (type(layer).__name__, layer.name))
+    weights = [np.asarray(w, dtype=dtype) for w in layer.get_weights()]
+    for class_name in ('LSTM', 'GRU', 'SimpleRNN'):
+        if isinstance(layer, getattr(tf.keras.layers, class_name)):
+            return make_cell(class_name, config, weights)
+    raise ValueError('%s %r is not a recurrent layer' % (type(layer).__name__, layer.name))
+
+
+class RecurrentEngine:
+    """NumPy forward pass of a Sequential recurrent model, one time step at a time.
+
+    The model is one or more LSTM / GRU / SimpleRNN layers (all but the last
+    with return_sequences=True) followed by Dense layers. Dropout is the
+    identity at inference and is skipped.
+    """
+
+    def __init__(self, model, dtype=np.float32):
+        import tensorflow as tf
+
+        self.dtype = np.dtype(dtype)
+        self.cells, self.head = [], []
+        for layer in model.layers:
+            if isinstance(layer, (tf.keras.layers.Dropout, tf.keras.layers.InputLayer)):
+                continue
+            if isinstance(layer, tf.keras.layers.RNN):
+                if self.head:
+                    raise ValueError('recurrent layer %r follows a Dense layer' % (layer.name,))
+                self.cells.append(cell_from_layer(layer, dtype))
+            elif isinstance(layer, tf.keras.layers.Dense):
+                weights = [np.asarray(w, dtype=dtype) for w in layer.get_weights()]
+                bias = weights[1] if len(weights) > 1 else np.zeros(weights[0].shape[1], dtype=dtype)
+                self.head.append((weights[0], bias, activation(layer.get_config()['activation'])))
+            else:
+                raise ValueError('%s %r cannot be streamed' % (type(layer).__name__, layer.name))
+        if not self.cells:
+            raise ValueError('the model has no LSTM, GRU or SimpleRNN layer')
+        self.n_features = self.cells[0].kernel.shape[0]
+        self.time_steps = model.input_shape[1]
+
+    def zero_state(self, n):
+        """Initial (all-zero) state of `n` sequences: one tuple of arrays per recurrent layer."""
+        return [tuple(np.zeros((n, cell.units), dtype=self.dtype) for _ in range(cell.n_states))
+                for cell in self.cells]
+
+    def advance(self, x, state):
+        """Feed rows x [n, features] through the recurrent layers; returns (last output, new state)."""
+        new_state = []
+        for cell, cell_state in zip(self.cells, state):
+            cell_state = cell.step(x, *cell_state)
+            new_state.append(cell_state)
+            x = cell_state[0]
+        return x, new_state
+
+    def output(self, h):
+        """Apply the Dense head to the last recurrent output h [n, units]; returns [n] (or [n, outputs])."""
+        for kernel, bias, act in self.head:
+            h = act(h @ kernel + bias)
+        return h[:, 0] if h.shape[1] == 1 else h
+
+    def predict(self, X):
+        """Windowed prediction from a zero state, like model.predict on X [n, time_steps, features]."""
+        X = np.asarray(X, dtype=self.dtype)
+        state = self.zero_state(len(X))
+        for t in range(X.shape[1]):
+            h, state = self.advance(X[:, t], state)
+        return self.output(h)
+
+
+class StreamingForecaster:
+    """Next-step forecasts for `n_sites` series, carrying each site's recurrent state.
+
+    Each site keeps time_steps staggered states ("lanes"): lane k restarts
+    from zero at every time_steps-th row, so at any row one lane has seen
+    exactly the last time_steps rows and its output is the windowed model's
+    prediction. A call advances all lanes of the given sites by one
+    vectorised cell step.
+
+    With a preprocessing.Preprocessor `prep`, step() takes unscaled rows in
+    prep.columns order and returns forecasts in target units; without one,
+    rows are scaled and forecasts are scaled.
+    """
+
+    def __init__(self, model, n_sites=1, prep=None, warmup=None, freq=HOURLY, dtype=np.float32):
+        self.engine = model if isinstance(model, RecurrentEngine) else RecurrentEngine(model, dtype)
+        self.n_sites = n_sites
+        self.prep = prep
+        self.time_steps = self.engine.time_steps
+        self.warmup = self.time_steps if warmup is None else warmup
+        self.freq = np.timedelta64(freq, 'ns').astype(np.int64)
+        # [n_sites, time_steps, units] per state array: one lane per window offset
+        self.state = [tuple(array.reshape(n_sites, self.time_steps, -1) for array in layer_state)
+                      for layer_state in self.engine.zero_state(n_sites * self.time_steps)]
+        self.seen = np.zeros(n_sites, dtype=np.int64)
+        self.last_time = np.zeros(n_sites, dtype=np.int64)
+
+    def reset(self, sites=None):
+        """Zero the state of `sites` (all by default)."""
+        idx = slice(None) if sites is None else np.asarray(sites)
+        for layer_state in self.state:
+            for array in layer_state:
+                array[idx] = 0.0
+        self.seen[idx] = 0
+
+    def step(self, rows, sites=None, times=None):
+        """Ingest one new row per site and return each site's forecast for the next step.
+
+        `rows` is [len(sites), features] (sites defaults to all sites, in
+        order). `times` (a timestamp or one per site) enables the gap check:
+        a site whose previous row is not exactly `freq` earlier is reset
+        before its row is ingested. The forecast is the windowed model's on
+        the site's last time_steps rows; with fewer rows since the last
+        reset it is the model's on those rows, and NaN before `warmup`.
+        """
+        idx = np.arange(self.n_sites) if sites is None else np.asarray(sites).reshape(-1)
+        x = np.array(rows, dtype=self.engine.dtype, ndmin=2)
+        if self.prep is not None:
+            x = self.prep.transform_(x)
+        nan_rows = np.isnan(x).any(axis=1)
+        broken = nan_rows.copy()
+        if times is not None:
+            t = np.broadcast_to(np.asarray(times, dtype='datetime64[ns]').astype(np.int64), idx.shape)
+            broken |= t - self.last_time[idx] != self.freq
+            self.last_time[idx] = t
+        if broken.any():
+            self.reset(idx[broken])
+            x[nan_rows] = 0.0
+        n, T = len(idx), self.time_steps
+        # The lane that starts its window at this row begins from a zero state
+        starting = self.seen[idx] % T
+        state = []
+        for layer_state in self.state:
+            for array in layer_state:
+                array[idx, starting] = 0.0
+            state.append(tuple(array[idx].reshape(n * T, -1) for array in layer_state))
+        h, state = self.engine.advance(np.repeat(x, T, axis=0), state)
+        for layer_state, new in zip(self.state, state):
+            for array, value in zip(layer_state, new):
+                array[idx] = value.reshape(n, T, -1)
+        self.seen[idx] += 1
+        seen = self.seen[idx]
+        # Lane 0 started at the reset; from time_steps rows on, the lane started time_steps rows ago
+        done = np.where(seen >= T, seen % T, 0)
+        h = h.reshape(n, T, -1)[np.arange(n), done]
+        if nan_rows.any():
+            # A row with NaNs ends the segment: the next row starts from a clean state
+            self.reset(idx[nan_rows])
+        y = self.engine.output(h)
+        y = self.prep.inverse_target(y) if self.prep is not None else y
+        y[seen < max(self.warmup, 1)] = np.nan
+        return y
+
+
+def check_equivalence(model, data, time_steps=None, target='GHI_Average', index=None, freq=HOURLY, atol=1e-5):
+    """Compare streaming forecasts with the windowed model on the scaled frame `data`.
+
+    The frame is streamed row by row as one site, timed by its index (or
+    `index`), and every valid window is also predicted by `model`. Returns
+    the differences and both errors against the actual targets (in scaled
+    units); raises AssertionError if a forecast is not np.allclose to the
+    windowed prediction within `atol`.
+    """
+    time_steps = time_steps or model.input_shape[1]
+    index = data.index if index is None else index
+    values = as_matrix(data, dtype=np.float32)
+    target_values = values[:, column_index(data, target)]
+    starts = WindowIndex.from_frame(data, target=target, index=index, freq=freq).valid_starts(time_steps)
+    if not len(starts):
+        raise ValueError('no window of %d rows in `data` is free of gaps and NaNs' % time_steps)
+
+    forecaster = StreamingForecaster(model, warmup=time_steps, freq=freq)
+    times = np.asarray(index, dtype='datetime64[ns]')
+    streamed = np.full(len(values), np.nan, dtype=np.float32)
+    for r in range(len(values)):
+        streamed[r] = forecaster.step(values[r], times=times[r])[0]
+
+    windowed = np.asarray(model.predict(np.stack([values[s:s + time_steps] for s in starts]), verbose=0))
+    windowed = windowed.reshape(-1)
+    streaming = streamed[starts + time_steps - 1]
+    actual = target_values[starts + time_steps]
+    diff = np.abs(streaming - windowed)
+    if not np.allclose(streaming, windowed, atol=atol):
+        raise AssertionError('%d of %d streaming forecasts differ from the windowed model by more than %.3g '
+                             '(max %.3g)' % (int((diff > atol).sum()), len(starts), atol, float(diff.max())))
+    return {'windows': len(starts), 'max abs diff': float(diff.max()), 'mean abs diff': float(diff.mean()),
+            'windowed RMSE': float(np.sqrt(np.mean((windowed - actual) ** 2))),
+            'streaming RMSE': float(np.sqrt(np.mean((streaming - actual) ** 2)))}
+
+
+def latency(model, sites=(1, 100, 1000, 5000), calls=200, seed=0):
+    """Per-call and per-site latency of StreamingForecaster.step next to windowed model.predict_on_batch."""
+    rng = np.random.default_rng(seed)
+    time_steps, n_features = model.input_shape[1:]
+    rows = []
+    for n in sites:
+        forecaster = StreamingForecaster(model, n_sites=n, warmup=0)
+        x = rng.standard_normal((n, n_features)).astype(np.float32)
+        forecaster.step(x)
+        start = time.perf_counter()
+        for _ in range(calls):
+            forecaster.step(x)
+        streaming = (time.perf_counter() - start) / calls
+        X = rng.standard_normal((n, time_steps, n_features)).astype(np.float32)
+        model.predict_on_batch(X)
+        keras_calls = max(calls // 10, 3)
+        start = time.perf_counter()
+        for _ in range(keras_calls):
+            model.predict_on_batch(X)
+        windowed = (time.perf_counter() - start) / keras_calls
+        rows.append({'Sites': n, 'Streaming ms/call': streaming * 1e3, 'Streaming us/site': streaming * 1e6 / n,
+                     'Windowed ms/call': windowed * 1e3, 'Windowed us/site': windowed * 1e6 / n,
+                     'Speedup': windowed / streaming})
+    return pd.DataFrame(rows)
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""Pipeline-wide numeric precision.
+
+One setting picks the dtype of the data arrays (scaling, windowing, input
+pipelines) and the Keras dtype policy of the models:
+
+    'float32'         float32 arrays and weights (the default)
+    'mixed_float16'   float32 arrays, float16 compute with float32 weights
+    'mixed_bfloat16'  as above with bfloat16
+    'float64'         float64 arrays and weights, the reference run
+
+Model outputs stay float32 under the mixed policies (output_dtype()), so the
+loss and the inverse scaling are never computed in half precision.
+metric_deltas compares runs at several precisions against the float64 one.
+
+    set_precision('mixed_float16')
+"""
+
+import numpy as np
+import pandas as pd
+
+PRECISIONS = ('float32', 'mixed_float16', 'mixed_bfloat16', 'float64')
+
+_precision = 'float32'
+
+
+def set_precision(precision):
+    """Use `precision` for the data arrays and as the global Keras policy."""
+    global _precision
+    if precision not in PRECISIONS:
+        raise ValueError('precision must be one of %s, got %r' % (', '.join(PRECISIONS), precision))
+    import tensorflow as tf
+
+    tf.keras.mixed_precision.set_global_policy(precision)
+    _precision = precision
+    return precision
+
+
+def get_precision():
+    return _precision
+
+
+def data_dtype(precision=None):
+    """dtype of the data arrays: float64 for the reference run, float32 otherwise."""
+    return np.float64 if (precision or _precision) == 'float64' else np.float32
+
+
+def output_dtype(precision=None):
+    """dtype for the final layer of a model, float32 unless running in float64."""
+    return 'float64' if (precision or _precision) == 'float64' else 'float32'
+
+
+def metric_deltas(metrics, reference='float64'):
+    """Compare per-model metric tables of runs at several precisions.
+
+    `metrics` maps a precision to a DataFrame with a 'Model' column and one
+    numeric column per metric (the train_zoo table). Returns the metrics of
+    every (Model, Precision) pair, plus 'Delta <metric>' columns holding the
+    difference to the `reference` run.
+    """
+    ref = metrics[reference].set_index('Model').select_dtypes('number')
+    frames = []
+    for precision, table in metrics.items():
+        table = table.set_index('Model')[ref.columns]
+        deltas = (table - ref).add_prefix('Delta ')
+        frames.append(pd.concat([table, deltas], axis=1).assign(Precision=precision))
+    return pd.concat(frames).set_index('Precision', append=True)
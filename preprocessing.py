@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""Feature and target scaling on float32 (or float64) buffers.
+
+Preprocessor fits the input scaler (on `cols`) and the GHI scaler (on the
+target) the way the scripts do, then folds both into one per-column affine
+map x * a + b over the full required_cols matrix. Transforms and inverse
+transforms run in place on a float32 array (float64 for a precision.py
+reference run), with no DataFrame round trips and no silent upcast; the
+target alone can be inverse-transformed without building zero-padded
+full-width arrays. The fitted state is saved next to the model artifact so
+it can be reloaded for prediction; a loaded Preprocessor transforms with the
+affine maps alone and imports sklearn only when its scaler objects are first
+used.
+
+StreamingRobustScaler is a drop-in for RobustScaler that is fitted one chunk
+at a time from quantile sketches, so the scalers can be fitted on histories
+that do not fit in memory, and partial fits from several files or workers
+can be merged:
+
+    prep = Preprocessor(required_cols, cols, scaler_factory=StreamingRobustScaler)
+    prep.fit_stream(iter_chunks(path, required_cols))
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from precision import data_dtype
+from quantile_sketch import KLLSketch
+from windowing import as_matrix
+
+
+def artifact_path(model_path):
+    """Where the scalers of the model saved at `model_path` live."""
+    return os.fspath(model_path) + '.scalers.npz'
+
+
+def scaler_class(name):
+    """StreamingRobustScaler or the sklearn.preprocessing scaler called `name`."""
+    if name == StreamingRobustScaler.__name__:
+        return StreamingRobustScaler
+    import sklearn.preprocessing
+
+    return getattr(sklearn.preprocessing, name)
+
+
+def affine_params(scaler, n_features):
+    """(a, b) with scaler.transform(x) == x * a + b for a fitted per-column scaler.
+
+    Holds for RobustScaler, StandardScaler, MinMaxScaler and MaxAbsScaler.
+    """
+    b = scaler.transform(np.zeros((1, n_features)))[0]
+    a = scaler.transform(np.ones((1, n_features)))[0] - b
+    return a, b
+
+
+class StreamingRobustScaler:
+    """RobustScaler fitted in one pass over chunks, from a KLLSketch per column.
+
+    center_ is the median and scale_ the `quantile_range` spread, as in
+    sklearn's RobustScaler (zero spreads become 1); both are exact until the
+    sketches start compacting, then within the sketch rank error (see
+    quantile_sketch). Scalers fitted on separate chunks combine with merge().
+    get_state / from_state save and restore the sketches with the statistics,
+    so a loaded scaler keeps accumulating with partial_fit.
+    """
+
+    def __init__(self, with_centering=True, with_scaling=True, quantile_range=(25.0, 75.0),
+                 k=200, seed=None):
+        self.with_centering = with_centering
+        self.with_scaling = with_scaling
+        self.quantile_range = quantile_range
+        self.k = k
+        self.seed = seed
+        self.sketches_ = None
+        self.center_ = None
+        self.scale_ = None
+        self._without_sketches = False
+
+    def _check_sketches(self):
+        if self._without_sketches:
+            raise ValueError('this StreamingRobustScaler was loaded from a file saved without its sketches, '
+                             'so it cannot be updated or merged; refit it with fit() or fit_stream()')
+
+    def partial_fit(self, X):
+        """Add a [rows, features] chunk to the sketches and refresh center_ / scale_."""
+        self._check_sketches()
+        X = np.asarray(X, dtype=np.float64)
+        X = X.reshape(-1, 1) if X.ndim == 1 else X
+        if self.sketches_ is None:
+            seeds = np.random.SeedSequence(self.seed).spawn(X.shape[1])
+            self.sketches_ = [KLLSketch(self.k, seed) for seed in seeds]
+            self.n_features_in_ = X.shape[1]
+        elif X.shape[1] != self.n_features_in_:
+            raise ValueError('X has %d features, the scaler was fitted with %d'
+                             % (X.shape[1], self.n_features_in_))
+        for j, sketch in enumerate(self.sketches_):
+            sketch.update(X[:, j])
+        self._update_stats()
+        return self
+
+    def fit(self, X, y=None):
+        self.sketches_ = None
+        self._without_sketches = False
+        return self.partial_fit(X)
+
+    def merge(self, other):
+        """Fold another StreamingRobustScaler, fitted on other data, into this one."""
+        self._check_sketches()
+        other._check_sketches()
+        if self.sketches_ is None:
+            self.sketches_ = [KLLSketch(self.k).merge(s) for s in other.sketches_]
+            self.n_features_in_ = other.n_features_in_
+        else:
+            for sketch, other_sketch in zip(self.sketches_, other.sketches_):
+                sketch.merge(other_sketch)
+        self._update_stats()
+        return self
+
+    def get_state(self):
+        """{name: array} of the settings, statistics and sketches; see from_state."""
+        params = {'with_centering': self.with_centering, 'with_scaling': self.with_scaling,
+                  'quantile_range': list(self.quantile_range), 'k': self.k, 'seed': self.seed}
+        state = {'params': np.array(json.dumps(params))}
+        for key in ('center_', 'scale_', 'n_features_in_'):
+            if getattr(self, key, None) is not None:
+                state[key] = np.asarray(getattr(self, key))
+        for j, sketch in enumerate(self.sketches_ or ()):
+            for name, value in sketch.get_state().items():
+                state['sketch_%d.%s' % (j, name)] = value
+        return state
+
+    @classmethod
+    def from_state(cls, state):
+        """Rebuild a scaler from get_state(), or from the bare statistics older files hold."""
+        params = json.loads(str(state['params'])) if 'params' in state else {}
+        self = cls(**params)
+        self.quantile_range = tuple(self.quantile_range)
+        for key in ('center_', 'scale_'):
+            if key in state:
+                setattr(self, key, np.asarray(state[key]))
+        if 'n_features_in_' in state:
+            self.n_features_in_ = int(state['n_features_in_'])
+        n_sketches = len({key.split('.')[0] for key in state if key.startswith('sketch_')})
+        if n_sketches:
+            seeds = np.random.SeedSequence(self.seed).spawn(n_sketches)
+            self.sketches_ = [KLLSketch.from_state({name: state['sketch_%d.%s' % (j, name)]
+                                                    for name in ('items', 'sizes', 'stats')}, seeds[j])
+                              for j in range(n_sketches)]
+        else:
+            self._without_sketches = True
+        return self
+
+    def _update_stats(self):
+        q_min, q_max = self.quantile_range
+        quantiles = np.array([sketch.quantile([0.5, q_min / 100, q_max / 100])
+                              for sketch in self.sketches_])
+        self.center_ = quantiles[:, 0] if self.with_centering else None
+        if self.with_scaling:
+            scale = quantiles[:, 2] - quantiles[:, 1]
+            self.scale_ = np.where(scale == 0, 1.0, scale)
+        else:
+            self.scale_ = None
+
+    def transform(self, X):
+        X = np.array(X, dtype=np.float64)
+        if self.center_ is not None:
+            X -= self.center_
+        if self.scale_ is not None:
+            X /= self.scale_
+        return X
+
+    def inverse_transform(self, X):
+        X = np.array(X, dtype=np.float64)
+        if self.scale_ is not None:
+            X *= self.scale_
+        if self.center_ is not None:
+            X += self.center_
+        return X
+
+    def fit_transform(self, X, y=None):
+        return self.fit(X).transform(X)
+
+
+class Preprocessor:
+    """Input and target scalers for a [rows, len(columns)] matrix.
+
+    `columns` is the matrix column order (the scripts' required_cols), `cols`
+    the inputs scaled by the feature scaler and `target` the column scaled by
+    its own scaler. Columns in neither are passed through unchanged.
+    `scaler_factory` is a scaler class or the name of one (see scaler_class),
+    resolved when first fitted. `dtype` defaults to precision.data_dtype().
+    """
+
+    def __init__(self, columns, cols, target='GHI_Average', scaler_factory='RobustScaler', dtype=None):
+        self.columns = list(columns)
+        self.cols = list(cols)
+        self.target = target
+        self.scaler_factory = scaler_factory
+        self.dtype = np.dtype(dtype or data_dtype())
+        self._scaler = None
+        self._target_scaler = None
+        self._saved = None
+        self.a = None
+        self.b = None
+
+    @property
+    def target_idx(self):
+        return self.columns.index(self.target)
+
+    def _factory(self):
+        if isinstance(self.scaler_factory, str):
+            self.scaler_factory = scaler_class(self.scaler_factory)
+        return self.scaler_factory
+
+    def _restore_scalers(self):
+        # Rebuild the scalers of a loaded Preprocessor from their saved statistics
+        saved, self._saved = self._saved, None
+        factory = self._factory()
+        for prefix in ('scaler', 'target_scaler'):
+            state = {name.partition('.')[2]: value for name, value in saved.items()
+                     if name.partition('.')[0] == prefix}
+            if hasattr(factory, 'from_state'):
+                scaler = factory.from_state(state)
+            else:
+                scaler = factory()
+                for key, value in state.items():
+                    setattr(scaler, key, value if value.ndim else value.item())
+            setattr(self, '_' + prefix, scaler)
+
+    @property
+    def scaler(self):
+        if self._saved is not None:
+            self._restore_scalers()
+        return self._scaler
+
+    @scaler.setter
+    def scaler(self, scaler):
+        if self._saved is not None:
+            self._restore_scalers()
+        self._scaler = scaler
+
+    @property
+    def target_scaler(self):
+        if self._saved is not None:
+            self._restore_scalers()
+        return self._target_scaler
+
+    @target_scaler.setter
+    def target_scaler(self, scaler):
+        if self._saved is not None:
+            self._restore_scalers()
+        self._target_scaler = scaler
+
+    def fit(self, data):
+        """Fit both scalers on the training split (DataFrame or array in `columns` order)."""
+        values = self._matrix(data)
+        col_idx = [self.columns.index(c) for c in self.cols]
+        self.scaler = self._factory()().fit(values[:, col_idx])
+        self.target_scaler = self._factory()().fit(values[:, [self.target_idx]])
+        self._set_affine()
+        return self
+
+    def partial_fit(self, data):
+        """Update both scalers with one chunk; needs a scaler_factory with partial_fit."""
+        values = self._matrix(data)
+        col_idx = [self.columns.index(c) for c in self.cols]
+        if self.scaler is None:
+            self.scaler, self.target_scaler = self._factory()(), self._factory()()
+        self.scaler.partial_fit(values[:, col_idx])
+        self.target_scaler.partial_fit(values[:, [self.target_idx]])
+        self._set_affine()
+        return self
+
+    def fit_stream(self, blocks):
+        """Fit on an iterable of chunks (e.g. data_loader.iter_chunks) in one pass."""
+        self.scaler = self.target_scaler = None
+        for block in blocks:
+            self.partial_fit(block)
+        return self
+
+    def merge(self, other):
+        """Combine with a Preprocessor fitted on other data (StreamingRobustScaler only)."""
+        self.scaler.merge(other.scaler)
+        self.target_scaler.merge(other.target_scaler)
+        self._set_affine()
+        return self
+
+    def _set_affine(self):
+        a = np.ones(len(self.columns))
+        b = np.zeros(len(self.columns))
+        col_idx = [self.columns.index(c) for c in self.cols]
+        a[col_idx], b[col_idx] = affine_params(self.scaler, len(col_idx))
+        ta, tb = affine_params(self.target_scaler, 1)
+        a[self.target_idx], b[self.target_idx] = ta[0], tb[0]
+        self.a = a.astype(self.dtype)
+        self.b = b.astype(self.dtype)
+
+    def _matrix(self, data, copy=False):
+        if hasattr(data, 'columns'):
+            return np.ascontiguousarray(data[self.columns].to_numpy(dtype=self.dtype, copy=copy))
+        values = as_matrix(data, dtype=self.dtype)
+        return values.copy() if copy and np.shares_memory(values, data) else values
+
+    def transform_(self, values):
+        """Scale a [rows, columns] buffer of self.dtype in place and return it."""
+        np.multiply(values, self.a, out=values)
+        np.add(values, self.b, out=values)
+        return values
+
+    def inverse_transform_(self, values):
+        """Undo transform_ on a [rows, columns] buffer in place."""
+        np.subtract(values, self.b, out=values)
+        np.divide(values, self.a, out=values)
+        return values
+
+    def transform(self, data):
+        """Scaled copy of `data` (DataFrame or array in `columns` order)."""
+        return self.transform_(self._matrix(data, copy=True))
+
+    def transform_frame(self, df):
+        """Scaled DataFrame with the same index, for the script cells."""
+        return pd.DataFrame(self.transform(df), index=df.index, columns=self.columns)
+
+    def transform_target(self, y, out=None):
+        """Scale target values only (any shape), into `out` if given."""
+        y = np.asarray(y, dtype=self.dtype)
+        out = np.empty_like(y) if out is None else out
+        np.multiply(y, self.a[self.target_idx], out=out)
+        np.add(out, self.b[self.target_idx], out=out)
+        return out
+
+    def inverse_target(self, y, out=None):
+        """Inverse-scale target values only (any shape), into `out` if given."""
+        y = np.asarray(y, dtype=self.dtype)
+        out = np.empty_like(y) if out is None else out
+        a, b = self.a[self.target_idx], self.b[self.target_idx]
+        np.subtract(y, b, out=out)
+        np.divide(out, a, out=out)
+        return out
+
+    def save(self, path):
+        """Save the fitted state (affine maps and sklearn scaler statistics) to `path`."""
+        meta = {'columns': self.columns, 'cols': self.cols, 'target': self.target,
+                'scaler': getattr(self.scaler_factory, '__name__', self.scaler_factory), 'dtype': self.dtype.name}
+        state = {'a': self.a, 'b': self.b, 'meta': np.array(json.dumps(meta))}
+        for prefix, scaler in (('scaler', self.scaler), ('target_scaler', self.target_scaler)):
+            if hasattr(scaler, 'get_state'):
+                items = scaler.get_state().items()
+            else:
+                items = [(key, value) for key, value in vars(scaler).items()
+                         if key.endswith('_') and isinstance(value, (np.ndarray, float, int))]
+            for key, value in items:
+                state['%s.%s' % (prefix, key)] = np.asarray(value)
+        with open(path, 'wb') as f:
+            np.savez(f, **state)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Load a Preprocessor saved with save(); the scalers are rebuilt from their statistics on first use."""
+        with np.load(path, allow_pickle=False) as state:
+            meta = json.loads(str(state['meta']))
+            self = cls(meta['columns'], meta['cols'], meta['target'], scaler_factory=meta['scaler'],
+                       dtype=meta.get('dtype', 'float32'))
+            self.a, self.b = state['a'], state['b']
+            self._saved = {name: state[name] for name in state.files
+                           if name.partition('.')[0] in ('scaler', 'target_scaler')}
+        return self
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Mergeable streaming quantile sketch (KLL).
+
+A KLLSketch summarises a stream of values in O(k log(n / k)) memory. Items
+live in compactors; an item at level h stands for 2**h input values. When a
+level overflows it is sorted and every other item (random offset) is promoted
+to the next level, which keeps quantile queries unbiased with a normalized
+rank error of about 1.7 / k (k=200: ~1%). Sketches built on different chunks,
+files or workers merge into the sketch of the combined data. While nothing
+has been compacted the sketch holds the raw values and quantiles are exact,
+with np.percentile's linear interpolation.
+
+    sketch = KLLSketch()
+    for chunk in chunks:
+        sketch.update(chunk['GHI_Average'])
+    q25, median, q75 = sketch.quantile([0.25, 0.5, 0.75])
+"""
+
+import numpy as np
+
+COMPACTOR_DECAY = 2 / 3
+
+
+class KLLSketch:
+    """Quantile sketch of a stream of floats; NaNs are ignored like np.nanpercentile."""
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.n = 0
+        self.min = np.inf
+        self.max = -np.inf
+        self.levels = [np.empty(0)]
+        self._rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return self.n
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * COMPACTOR_DECAY ** depth)), 2)
+
+    def update(self, values):
+        """Add a batch of values."""
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.n += len(values)
+            self.min = min(self.min, values.min())
+            self.max = max(self.max, values.max())
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """Fold `other` (a sketch with the same k) into this one."""
+        if other.k != self.k:
+            raise ValueError('cannot merge sketches with k=%d and k=%d' % (self.k, other.k))
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # An odd item stays behind so the total weight is conserved
+                odd = len(items) % 2
+                promoted = items[odd + self._rng.integers(2)::2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                self.levels[level] = items[:odd]
+            level += 1
+
+    def get_state(self):
+        """The sketch as {'items', 'sizes', 'stats'} arrays (e.g. for np.savez); see from_state."""
+        return {'items': np.concatenate(self.levels),
+                'sizes': np.array([len(items) for items in self.levels], dtype=np.int64),
+                'stats': np.array([self.k, self.n, self.min, self.max], dtype=np.float64)}
+
+    @classmethod
+    def from_state(cls, state, seed=None):
+        """Rebuild a sketch from get_state(); the compaction RNG restarts from `seed`."""
+        k, n, lo, hi = state['stats']
+        self = cls(int(k), seed)
+        self.n, self.min, self.max = int(n), float(lo), float(hi)
+        self.levels = np.split(np.asarray(state['items'], dtype=np.float64), np.cumsum(state['sizes'])[:-1])
+        return self
+
+    def quantile(self, q):
+        """Approximate quantile(s) `q` in [0, 1] of everything added so far."""
+        q = np.asarray(q, dtype=np.float64)
+        if self.n == 0:
+            return np.full(q.shape, np.nan)
+        if len(self.levels) == 1:
+            return np.percentile(self.levels[0], q * 100)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level, dtype=np.int64)
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items, cumulative = items[order], np.cumsum(weights[order])
+        idx = np.searchsorted(cumulative, q * cumulative[-1], side='left')
+        result = items[np.minimum(idx, len(items) - 1)]
+        # The extremes are tracked exactly
+        return np.where(q <= 0, self.min, np.where(q >= 1, self.max, result))
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""TFLite export of the trained models and a small runtime for CPU inference.
+
+export_tflite converts any model of the scripts (LSTM, GRU, SimpleRNN,
+Conv1D, Dense, and best_model.h5 from the multivariate script) to a TFLite
+flatbuffer, optionally with float16 or dynamic-range (int8 weights)
+quantization. The recurrent layers convert only with a static batch
+dimension, so every flatbuffer has a fixed `batch_size`: 1 for per-sample
+latency, larger for throughput. TFLiteModel pads or splits inputs to fit.
+
+TFLiteModel runs a flatbuffer with the standalone LiteRT / tflite_runtime
+interpreter when one is installed (no TensorFlow import) and falls back to
+tf.lite.Interpreter. num_threads='auto' picks the fastest thread count on a
+sample batch. benchmark() compares load time, per-sample latency, batch
+throughput and output drift against Keras.
+
+    python tflite_export.py /content/best_model.h5.keras --quantization float16
+    python tflite_export.py /content/best_model.h5.keras --bench
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+QUANTIZATIONS = (None, 'float16', 'dynamic')
+
+
+def tflite_path(model_path, quantization=None, batch_size=1):
+    """Default flatbuffer path next to `model_path`, e.g. best_model.h5.float16.b1.tflite."""
+    parts = [os.path.splitext(model_path)[0]] + ([quantization] if quantization else []) + ['b%d' % batch_size]
+    return '.'.join(parts) + '.tflite'
+
+
+def export_tflite(model, path=None, batch_size=1, quantization=None):
+    """Convert a Keras model (or saved model path) to a TFLite flatbuffer at `path`; returns the path."""
+    import tensorflow as tf
+    from models import load_model
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError('quantization must be one of %r, got %r' % (QUANTIZATIONS, quantization))
+    if isinstance(model, str):
+        path = path or tflite_path(model, quantization, batch_size)
+        model = load_model(model)
+    elif path is None:
+        raise ValueError('pass the output path when exporting an in-memory model')
+    signature = [tf.TensorSpec([batch_size] + list(model.input_shape[1:]), tf.float32)]
+    with tempfile.TemporaryDirectory() as saved_model:
+        model.export(saved_model, format='tf_saved_model', input_signature=signature, verbose=False)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model)
+        if quantization:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+        flatbuffer = converter.convert()
+    with open(path, 'wb') as f:
+        f.write(flatbuffer)
+    return path
+
+
+def _interpreter_class():
+    # The standalone runtimes run a flatbuffer without importing TensorFlow
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteModel:
+    """A TFLite flatbuffer with a Keras-like predict(X)."""
+
+    def __init__(self, path, num_threads='auto'):
+        self.path = path
+        if num_threads == 'auto':
+            num_threads = tune_threads(path)
+        self.num_threads = num_threads
+        self.interpreter = _interpreter_class()(model_path=path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.batch_size = int(self._input['shape'][0])
+        self.input_shape = tuple(int(d) for d in self._input['shape'][1:])
+
+    def _invoke(self, X):
+        self.interpreter.set_tensor(self._input['index'], X)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self._output['index'])
+
+    def predict(self, X):
+        """Outputs [n, outputs] for inputs [n, *input_shape], in fixed-size batches."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n, b = len(X), self.batch_size
+        outputs = []
+        for i in range(0, n - n % b, b):
+            outputs.append(self._invoke(X[i:i + b]).copy())
+        if n % b:
+            padded = np.zeros((b,) + self.input_shape, dtype=np.float32)
+            padded[:n % b] = X[n - n % b:]
+            outputs.append(self._invoke(padded)[:n % b].copy())
+        return np.concatenate(outputs) if outputs else np.zeros((0,) + tuple(self._output['shape'][1:]))
+
+
+def tune_threads(path, candidates=None, repeats=20):
+    """The interpreter thread count with the lowest median invoke time for `path`."""
+    cpus = os.cpu_count() or 1
+    candidates = candidates or sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+    best, best_seconds = 1, np.inf
+    for threads in candidates:
+        model = TFLiteModel(path, num_threads=threads)
+        X = np.zeros((model.batch_size,) + model.input_shape, dtype=np.float32)
+        model._invoke(X)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model._invoke(X)
+            times.append(time.perf_counter() - start)
+        if np.median(times) < best_seconds:
+            best, best_seconds = threads, np.median(times)
+    return best
+
+
+def median_seconds(fn, repeats):
+    """Median wall-clock seconds of `repeats` calls of `fn`, after one warm-up call."""
+    fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def benchmark(model_path, X, quantizations=QUANTIZATIONS, throughput_batch=256, repeats=50, directory=None):
+    """Keras against TFLite (each quantization) on the scaled inputs X.
+
+    Per-sample latency uses a batch-1 flatbuffer and throughput a
+    `throughput_batch` one. Max abs diff is against Keras on X.
+    """
+    import tensorflow as tf
+    from models import load_model
+
+    X = np.asarray(X, dtype=np.float32)
+    start = time.perf_counter()
+    model = load_model(model_path)
+    load_seconds = time.perf_counter() - start
+    reference = np.asarray(model.predict(X, batch_size=throughput_batch, verbose=0))
+    rows = [{'Runtime': 'keras', 'Quantization': None, 'Load s': load_seconds, 'File KB': os.path.getsize(model_path) / 1024,
+             'Latency ms': median_seconds(lambda: model.predict_on_batch(X[:1]), repeats) * 1e3,
+             'Samples/s': len(X) / median_seconds(lambda: model.predict(X, batch_size=throughput_batch, verbose=0),
+                                                   max(repeats // 10, 3)),
+             'Max abs diff': 0.0}]
+    tf.keras.backend.clear_session()
+
+    directory = directory or os.path.dirname(os.path.abspath(model_path))
+    for quantization in quantizations:
+        single = export_tflite(model, os.path.join(directory, os.path.basename(
+            tflite_path(model_path, quantization, 1))), 1, quantization)
+        batched = export_tflite(model, os.path.join(directory, os.path.basename(
+            tflite_path(model_path, quantization, throughput_batch))), throughput_batch, quantization)
+        start = time.perf_counter()
+        lite = TFLiteModel(single, num_threads=1)
+        load_seconds = time.perf_counter() - start
+        lite_batched = TFLiteModel(batched, num_threads='auto')
+        rows.append({'Runtime': 'tflite (%d threads)' % lite_batched.num_threads, 'Quantization': quantization,
+                     'Load s': load_seconds, 'File KB': os.path.getsize(single) / 1024,
+                     'Latency ms': median_seconds(lambda: lite.predict(X[:1]), repeats) * 1e3,
+                     'Samples/s': len(X) / median_seconds(lambda: lite_batched.predict(X), max(repeats // 10, 3)),
+                     'Max abs diff': float(np.abs(lite_batched.predict(X) - reference).max())})
+    return pd.DataFrame(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('model', help='saved Keras model (.keras or .h5)')
+    parser.add_argument('--out', help='flatbuffer path (default: next to the model)')
+    parser.add_argument('--quantization', choices=[q for q in QUANTIZATIONS if q])
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--bench', action='store_true', help='benchmark Keras against every quantization')
+    parser.add_argument('--samples', type=int, default=2048)
+    args = parser.parse_args(argv)
+
+    if args.bench:
+        from models import load_model
+
+        input_shape = load_model(args.model).input_shape[1:]
+        X = np.random.default_rng(0).standard_normal((args.samples,) + tuple(input_shape)).astype(np.float32)
+        df = benchmark(args.model, X)
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(df.round(4).to_string(index=False))
+        return df
+    path = export_tflite(args.model, args.out, args.batch_size, args.quantization)
+    print(path)
+    return path
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""Shared training controller: early stopping, LR schedules and budgets.
+
+Every fit gets the same policy instead of a fixed 100 epochs: patience-based
+early stopping on val_loss with the best weights restored, a learning-rate
+schedule (ReduceLROnPlateau or one-cycle) and hard epoch / wall-clock caps.
+The budget records how each fit ended, so report() can show the epochs and
+seconds saved against the planned epochs.
+
+    budget = TrainingBudget(patience=10, schedule='plateau', max_seconds=600)
+    history = gru_model.fit(train_ds, validation_data=val_ds, epochs=100,
+                            callbacks=budget.callbacks('GRU'))
+    budget.report()
+"""
+
+import math
+import time
+
+import pandas as pd
+import tensorflow as tf
+
+SCHEDULES = (None, 'plateau', 'one_cycle')
+
+
+class OneCycleSchedule(tf.keras.callbacks.Callback):
+    """One-cycle learning rate, updated every batch.
+
+    Rises linearly from max_lr / div_factor to `max_lr` over the first
+    `warmup` fraction of the planned steps, then cosine-anneals to
+    max_lr / final_div_factor. Without a known steps-per-epoch the cycle is
+    laid out per epoch.
+    """
+
+    def __init__(self, max_lr=1e-2, warmup=0.3, div_factor=25.0, final_div_factor=1e4):
+        super().__init__()
+        self.max_lr = max_lr
+        self.warmup = warmup
+        self.div_factor = div_factor
+        self.final_div_factor = final_div_factor
+        self._epoch = 0
+
+    def learning_rate(self, progress):
+        start, end = self.max_lr / self.div_factor, self.max_lr / self.final_div_factor
+        if progress < self.warmup:
+            return start + (self.max_lr - start) * progress / self.warmup
+        progress = (progress - self.warmup) / max(1.0 - self.warmup, 1e-12)
+        return end + (self.max_lr - end) * 0.5 * (1 + math.cos(math.pi * min(progress, 1.0)))
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch = epoch
+
+    def on_train_batch_begin(self, batch, logs=None):
+        epochs, steps = self.params.get('epochs') or 1, self.params.get('steps')
+        progress = (self._epoch * steps + batch) / (epochs * steps) if steps else self._epoch / epochs
+        self.model.optimizer.learning_rate.assign(self.learning_rate(progress))
+
+
+class _BudgetMonitor(tf.keras.callbacks.Callback):
+    """Enforces the epoch / wall-clock caps and records how the fit ended."""
+
+    def __init__(self, budget, name, early_stopping):
+        super().__init__()
+        self.budget = budget
+        self.name = name
+        self.early_stopping = early_stopping
+        self.reason = 'completed'
+
+    def on_train_begin(self, logs=None):
+        self.start = time.perf_counter()
+        self.epochs_run = 0
+        self.reason = 'completed'
+
+    def on_train_batch_end(self, batch, logs=None):
+        max_seconds = self.budget.max_seconds
+        if max_seconds is not None and time.perf_counter() - self.start > max_seconds:
+            self.reason = 'wall_clock'
+            self.model.stop_training = True
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epochs_run = epoch + 1
+        if self.budget.max_epochs is not None and self.epochs_run >= self.budget.max_epochs:
+            self.reason = 'max_epochs'
+            self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        if self.reason == 'completed' and self.early_stopping is not None and self.early_stopping.stopped_epoch > 0:
+            self.reason = 'early_stopping'
+        seconds = time.perf_counter() - self.start
+        planned = self.params.get('epochs') or self.epochs_run
+        per_epoch = seconds / self.epochs_run if self.epochs_run else 0.0
+        self.budget.records[self.name] = {
+            'Planned epochs': planned, 'Epochs': self.epochs_run, 'Stopped by': self.reason,
+            'Best epoch': self.early_stopping.best_epoch + 1 if self.early_stopping is not None else None,
+            'Seconds': seconds, 'Epochs saved': planned - self.epochs_run,
+            'Seconds saved (est.)': (planned - self.epochs_run) * per_epoch,
+        }
+
+
+class TrainingBudget:
+    """Training policy shared by all fits; callbacks(name) plugs it into model.fit.
+
+    `patience` epochs without a `min_delta` improvement of `monitor` stop a
+    fit (None disables early stopping) and restore its best weights.
+    `schedule` is 'plateau' (ReduceLROnPlateau by `factor` after
+    `lr_patience` epochs), 'one_cycle' (OneCycleSchedule up to `max_lr`) or
+    None. `max_epochs` and `max_seconds` cap every fit regardless of the
+    epochs it asks for. The budget is picklable, so it can be handed to
+    worker processes (zoo_runner.train_zoo).
+    """
+
+    def __init__(self, patience=10, schedule='plateau', max_epochs=None, max_seconds=None,
+                 monitor='val_loss', min_delta=0.0, factor=0.5, lr_patience=5, min_lr=1e-6,
+                 max_lr=1e-2):
+        if schedule not in SCHEDULES:
+            raise ValueError('schedule must be one of %r, got %r' % (SCHEDULES, schedule))
+        self.patience = patience
+        self.schedule = schedule
+        self.max_epochs = max_epochs
+        self.max_seconds = max_seconds
+        self.monitor = monitor
+        self.min_delta = min_delta
+        self.factor = factor
+        self.lr_patience = lr_patience
+        self.min_lr = min_lr
+        self.max_lr = max_lr
+        self.records = {}
+
+    def callbacks(self, name):
+        """Fresh callbacks for one fit; its outcome is recorded under `name`."""
+        callbacks = []
+        early_stopping = None
+        if self.patience is not None:
+            early_stopping = tf.keras.callbacks.EarlyStopping(
+                monitor=self.monitor, patience=self.patience, min_delta=self.min_delta,
+                restore_best_weights=True)
+            callbacks.append(early_stopping)
+        if self.schedule == 'plateau':
+            callbacks.append(tf.keras.callbacks.ReduceLROnPlateau(
+                monitor=self.monitor, factor=self.factor, patience=self.lr_patience, min_lr=self.min_lr))
+        elif self.schedule == 'one_cycle':
+            callbacks.append(OneCycleSchedule(max_lr=self.max_lr))
+        callbacks.append(_BudgetMonitor(self, name, early_stopping))
+        return callbacks
+
+    def report(self):
+        """One row per recorded fit, plus a 'Total' row of the epochs and seconds saved."""
+        df = pd.DataFrame.from_dict(self.records, orient='index')
+        if len(df):
+            totals = df[['Planned epochs', 'Epochs', 'Seconds', 'Epochs saved', 'Seconds saved (est.)']].sum()
+            df.loc['Total'] = totals
+        return df
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Memory-mapped window store for out-of-core training.
+
+The scaled feature matrix is written once to a raw float32 file and opened as
+an np.memmap. Windows are never materialised as a 3D array: a batch of window
+indices is turned into row indices (start + arange(time_steps)) and gathered
+from the page cache, so memory use is one batch, not time_steps times the data.
+Only the windows at `starts` (windowing.valid_starts by default) are served,
+so none spans an overnight gap or a NaN row.
+
+    store = WindowStore.create('train.windows', train, time_steps=7)
+    model.fit(store.keras_sequence(64, subset='training', validation_split=0.15),
+              validation_data=store.keras_sequence(64, subset='validation', validation_split=0.15),
+              epochs=100)
+
+check_store verifies that the store serves exactly the windows make_windows
+builds in memory.
+"""
+
+import json
+import os
+
+import numpy as np
+
+from windowing import as_matrix, valid_starts, window_count
+
+
+class WindowStore:
+    """Windows over a memory-mapped [rows, features] matrix.
+
+    Window s is rows [s, s + time_steps) of `feature_idx` (all columns by
+    default); its target is column `target` at row s + time_steps + horizon - 1,
+    matching make_windows. Window indices i (len, get_batch, batches, ...)
+    refer to the window starting at row starts[i], or at row i without
+    `starts`.
+    """
+
+    def __init__(self, path, time_steps, target=0, horizon=1, feature_idx=None, starts=None):
+        with open(path + '.json') as f:
+            meta = json.load(f)
+        self.path = path
+        self.data = np.memmap(path, dtype=meta['dtype'], mode='r',
+                              shape=(meta['rows'], meta['features']))
+        self.columns = meta.get('columns')
+        self.time_steps = time_steps
+        self.horizon = horizon
+        self.target = self._index(target)
+        self.feature_idx = None if feature_idx is None else [self._index(c) for c in feature_idx]
+        self.starts = None if starts is None else np.asarray(starts, dtype=np.int64)
+        self._offsets = np.arange(time_steps)
+
+    def _index(self, col):
+        return self.columns.index(col) if isinstance(col, str) else col
+
+    @staticmethod
+    def write(path, blocks, columns=None, dtype=np.float32):
+        """Write the scaled matrix to `path`, one [rows, features] block at a time.
+
+        `blocks` is a DataFrame/array or an iterable of blocks (e.g.
+        data_loader.stream_scaled), so the matrix never has to fit in memory.
+        """
+        if hasattr(blocks, 'shape'):
+            if columns is None and hasattr(blocks, 'columns'):
+                columns = list(blocks.columns)
+            blocks = [blocks]
+        rows, features = 0, None
+        with open(path, 'wb') as f:
+            for block in blocks:
+                block = as_matrix(block, dtype=dtype)
+                features = block.shape[1]
+                f.write(block.tobytes())
+                rows += len(block)
+        with open(path + '.json', 'w') as f:
+            json.dump({'rows': rows, 'features': features, 'dtype': np.dtype(dtype).name,
+                       'columns': columns}, f)
+        return path
+
+    @classmethod
+    def create(cls, path, blocks, time_steps, target=0, horizon=1, feature_idx=None, columns=None,
+               starts=None):
+        """Write `blocks` to `path` and open a store over it.
+
+        `starts` defaults to valid_starts of `blocks` when it is a
+        Date-indexed frame. Streamed blocks carry no dates: pass the
+        valid_starts of their source, or every window is served.
+        """
+        if starts is None and hasattr(blocks, 'index'):
+            starts = valid_starts(blocks, time_steps, horizon, target=target)
+        cls.write(path, blocks, columns=columns)
+        return cls(path, time_steps, target=target, horizon=horizon, feature_idx=feature_idx, starts=starts)
+
+    def __len__(self):
+        if self.starts is not None:
+            return len(self.starts)
+        return window_count(len(self.data), self.time_steps, self.horizon)
+
+    @property
+    def input_shape(self):
+        features = self.data.shape[1] if self.feature_idx is None else len(self.feature_idx)
+        return (self.time_steps, features)
+
+    def split(self, validation_split=0.0):
+        """(train, validation) window ranges; the validation part is the tail, like Keras."""
+        n = len(self)
+        split_at = n - int(n * validation_split)
+        return (0, split_at), (split_at, n)
+
+    def get_batch(self, idx, flatten=False):
+        """Gather windows `idx` into X [len(idx), time_steps, features] and y [len(idx)]."""
+        idx = np.asarray(idx)
+        if self.starts is not None:
+            idx = self.starts[idx]
+        rows = idx[:, None] + self._offsets
+        X = self.data[rows] if self.feature_idx is None else self.data[rows[..., None], self.feature_idx]
+        y = np.asarray(self.data[idx + self.time_steps + self.horizon - 1, self.target])
+        if flatten:
+            X = X.reshape(len(idx), -1)
+        return X, y
+
+    def batches(self, batch_size, start=0, stop=None, flatten=False, shuffle=False, seed=None):
+        """Yield (X, y) batches for windows [start, stop)."""
+        stop = len(self) if stop is None else stop
+        order = np.arange(start, stop)
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+        for i in range(0, len(order), batch_size):
+            yield self.get_batch(order[i:i + batch_size], flatten=flatten)
+
+    def as_arrays(self, start=0, stop=None, flatten=False):
+        """Materialise windows [start, stop) for fit paths that need arrays (e.g. SVR)."""
+        stop = len(self) if stop is None else stop
+        return self.get_batch(np.arange(start, stop), flatten=flatten)
+
+    def keras_sequence(self, batch_size=64, subset=None, validation_split=0.0, flatten=False, shuffle=False):
+        """A tf.keras.utils.Sequence over the store for model.fit / model.predict.
+
+        `subset` is None (all windows), 'training' or 'validation', split the
+        way fit(validation_split=...) does. Works unchanged with the LSTM, GRU,
+        SimpleRNN, Conv1D (3D windows) and Dense (`flatten=True`) models.
+        """
+        import tensorflow as tf
+
+        (train_start, train_stop), (val_start, val_stop) = self.split(validation_split)
+        start, stop = {None: (0, len(self)), 'training': (train_start, train_stop),
+                       'validation': (val_start, val_stop)}[subset]
+        store = self
+
+        class WindowSequence(tf.keras.utils.Sequence):
+            def __init__(self):
+                super().__init__()
+                self.order = np.arange(start, stop)
+
+            def __len__(self):
+                return -(-len(self.order) // batch_size)
+
+            def __getitem__(self, i):
+                return store.get_batch(self.order[i * batch_size:(i + 1) * batch_size], flatten=flatten)
+
+            def on_epoch_end(self):
+                if shuffle:
+                    np.random.shuffle(self.order)
+
+        return WindowSequence()
+
+    def close(self):
+        mm = getattr(self.data, '_mmap', None)
+        self.data = None
+        if mm is not None:
+            mm.close()
+
+    def remove(self):
+        """Close the store and delete its files."""
+        self.close()
+        for p in (self.path, self.path + '.json'):
+            if os.path.exists(p):
+                os.remove(p)
+
+
+def check_store(store, X, y, batch_size=1024, flatten=False):
+    """Compare every get_batch of `store` with the in-memory windows X, y (e.g. make_windows).
+
+    Returns the window count; raises AssertionError if the counts or any
+    window or target differ.
+    """
+    if len(store) != len(X):
+        raise AssertionError('the store serves %d windows, the arrays hold %d' % (len(store), len(X)))
+    for i in range(0, len(store), batch_size):
+        X_batch, y_batch = store.get_batch(np.arange(i, min(i + batch_size, len(store))), flatten=flatten)
+        if not (np.array_equal(X_batch, X[i:i + batch_size], equal_nan=True)
+                and np.array_equal(y_batch, y[i:i + batch_size], equal_nan=True)):
+            raise AssertionError('store windows %d-%d differ from the arrays' % (i, i + len(X_batch) - 1))
+    return len(store)
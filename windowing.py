@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Sliding-window datasets as zero-copy views.
+
+Replaces the Python-loop create_dataset / create_ann_dataset functions in the
+scripts. Windows are strided views onto one contiguous [rows, features]
+array, so building them costs O(1) regardless of time_steps; only the model
+(or an explicit np.array call) ever materialises them.
+
+The data only holds daytime hours and has missing rows, so sliding blindly
+over the index stitches 18:00 yesterday to 08:00 today. WindowIndex splits
+the rows into contiguous hourly segments and valid_starts lists the windows
+that stay inside one segment and hold no NaN; pass them as `starts`:
+
+    X_train, y_train = make_windows(train, 7, starts=valid_starts(train, 7))
+
+The contiguous daylight runs of busan_dataset.csv average about 10 rows, so
+far fewer windows fit than when they slid across the overnight breaks, and
+few or none at all in the short December days. The scripts print how many
+they keep; their gap_aware = False switch restores every window.
+"""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+HOURLY = np.timedelta64(1, 'h')
+
+
+def column_index(data, col):
+    if isinstance(col, str):
+        return list(data.columns).index(col)
+    return col
+
+
+def as_matrix(data, features=None, dtype=None):
+    """Contiguous 2D array from a DataFrame or array, optionally one column subset.
+
+    Selecting `features` (names or positions) copies the source once; every
+    window built from the result is then a view.
+    """
+    if features is not None:
+        if isinstance(features, slice):
+            data = data.iloc[:, features] if hasattr(data, 'iloc') else np.asarray(data)[:, features]
+        else:
+            idx = [column_index(data, c) for c in features]
+            data = data.iloc[:, idx] if hasattr(data, 'iloc') else np.asarray(data)[:, idx]
+    values = data.to_numpy(dtype=dtype) if hasattr(data, 'to_numpy') else np.asarray(data, dtype=dtype)
+    if values.ndim == 1:
+        values = values[:, None]
+    return np.ascontiguousarray(values)
+
+
+def window_count(rows, time_steps, horizon=1):
+    """Number of windows create_dataset produces from `rows` rows."""
+    return max(rows - time_steps - horizon + 1, 0)
+
+
+def windows(values, time_steps, n=None, flatten=False):
+    """View of the first `n` windows of `values` ([rows, features], contiguous).
+
+    Returns [n, time_steps, features], or [n, time_steps * features] with
+    `flatten` (the layout the ANN/MLP/SVR/DNN models take).
+    """
+    rows, features = values.shape
+    n = max(rows - time_steps + 1, 0) if n is None else n
+    if n == 0:
+        shape = (0, time_steps * features) if flatten else (0, time_steps, features)
+        return np.empty(shape, dtype=values.dtype)
+    # Consecutive rows are adjacent in memory, so window i is the flat slice
+    # [i * features, (i + time_steps) * features)
+    flat = sliding_window_view(values.reshape(-1), time_steps * features)[::features][:n]
+    return flat if flatten else flat.reshape(n, time_steps, features)
+
+
+def target_view(values, time_steps, horizon=1, n=None):
+    """Targets aligned with windows(): row i + time_steps + horizon - 1 of `values`."""
+    start = time_steps + horizon - 1
+    n = len(values) - start if n is None else n
+    return values[start:start + n]
+
+
+class WindowIndex:
+    """Contiguous segments of a time-indexed series and its NaN rows.
+
+    A segment is a run of rows exactly `freq` apart; a new one starts at every
+    overnight break or missing row. With a prefix sum over the rows whose
+    inputs hold a NaN, checking whether a window lies inside one segment and
+    is NaN-free is O(1).
+    """
+
+    def __init__(self, dates, nan_rows=None, target_nan=None, freq=HOURLY):
+        dates = np.asarray(dates, dtype='datetime64[ns]').astype(np.int64)
+        breaks = np.diff(dates) != np.timedelta64(freq, 'ns').astype(np.int64)
+        self.rows = len(dates)
+        self.segment = np.concatenate([[0], np.cumsum(breaks)])
+        nan_rows = np.zeros(self.rows, dtype=bool) if nan_rows is None else np.asarray(nan_rows)
+        self.nan_prefix = np.concatenate([[0], np.cumsum(nan_rows)])
+        self.target_nan = np.zeros(self.rows, dtype=bool) if target_nan is None else np.asarray(target_nan)
+
+    @classmethod
+    def from_frame(cls, data, target='GHI_Average', features=None, index=None, freq=HOURLY):
+        """Index of `data`, timed by its DatetimeIndex (or `index`); NaNs in `features` / `target`."""
+        index = data.index if index is None else index
+        inputs = as_matrix(data, features, dtype=np.float64)
+        target_values = as_matrix(data, [column_index(data, target)], dtype=np.float64)[:, 0]
+        return cls(index, np.isnan(inputs).any(axis=1), np.isnan(target_values), freq=freq)
+
+    def segments(self):
+        """(start, length) arrays of the contiguous segments."""
+        starts = np.flatnonzero(np.diff(self.segment, prepend=-1))
+        return starts, np.diff(starts, append=self.rows)
+
+    def is_valid(self, start, time_steps, horizon=1):
+        """Whether window `start` (scalar or array) is inside one segment and NaN-free."""
+        end = np.asarray(start) + time_steps + horizon - 1
+        return ((self.segment[start] == self.segment[end])
+                & (self.nan_prefix[np.asarray(start) + time_steps] == self.nan_prefix[start])
+                & ~self.target_nan[end])
+
+    def valid_starts(self, time_steps, horizon=1):
+        """Start rows of the valid windows, in order."""
+        starts = np.arange(window_count(self.rows, time_steps, horizon))
+        return starts[self.is_valid(starts, time_steps, horizon)]
+
+
+def valid_starts(data, time_steps, horizon=1, target='GHI_Average', features=None, index=None,
+                 freq=HOURLY, gap_aware=True):
+    """Start rows of the windows of `data` that do not span a gap or a NaN.
+
+    With gap_aware=False every window is returned, as when windows slid
+    straight across the overnight breaks.
+    """
+    if not gap_aware:
+        return np.arange(window_count(len(data), time_steps, horizon))
+    return WindowIndex.from_frame(data, target, features, index, freq).valid_starts(time_steps, horizon)
+
+
+def make_windows(data, time_steps, target='GHI_Average', horizon=1, features=None,
+                 flatten=False, dtype=None, starts=None):
+    """Build (X, y) like create_dataset, as views.
+
+    X[i] holds rows [i, i + time_steps) of `features` (all columns by default)
+    and y[i] the `target` column at row i + time_steps + horizon - 1. With
+    `starts` (e.g. valid_starts) only those windows are returned, as copies.
+    """
+    target_idx = column_index(data, target)
+    if features is None:
+        values = as_matrix(data, dtype=dtype)
+        y_source = values[:, target_idx]
+    else:
+        values = as_matrix(data, features, dtype=dtype)
+        y_source = as_matrix(data, [target_idx], dtype=dtype)[:, 0]
+    n = window_count(len(values), time_steps, horizon)
+    X, y = windows(values, time_steps, n, flatten=flatten), target_view(y_source, time_steps, horizon, n)
+    if starts is not None:
+        return X[starts], y[starts]
+    return X, y
+
+
+def make_multi_horizon(data, time_steps, horizons, target='GHI_Average', features=None,
+                       flatten=False, dtype=None, starts=None):
+    """Build the windows once plus an [n, len(horizons)] target matrix, as views.
+
+    Column j of Y is the target `horizons[j]` steps after each window. All
+    horizons share the same n windows: the count valid for the longest one.
+    Evenly spaced horizons (e.g. 1..48) make Y a strided view; otherwise only
+    the small [n, H] matrix is copied. `starts` selects windows like in
+    make_windows (compute them with the longest horizon).
+    """
+    horizons = np.asarray(horizons)
+    target_idx = column_index(data, target)
+    values = as_matrix(data, dtype=dtype)
+    y_source = values[:, target_idx]
+    if features is not None:
+        values = as_matrix(data, features, dtype=dtype)
+
+    lo, hi = int(horizons.min()), int(horizons.max())
+    n = window_count(len(values), time_steps, hi)
+    X = windows(values, time_steps, n, flatten=flatten)
+    if n == 0:
+        return X, np.empty((0, len(horizons)), dtype=y_source.dtype)
+
+    # Row i of `span` holds the targets 1..hi (offset by lo) after window i
+    span = sliding_window_view(y_source[time_steps + lo - 1:], hi - lo + 1)[:n]
+    steps = np.diff(horizons)
+    if len(horizons) == 1 or (np.all(steps == steps[0]) and steps[0] > 0):
+        step = int(steps[0]) if len(horizons) > 1 else 1
+        Y = span[:, int(horizons[0]) - lo::step][:, :len(horizons)]
+    else:
+        Y = span[:, horizons - lo]
+    if starts is not None:
+        return X[starts], Y[starts]
+    return X, Y
+
+
+def horizon_views(Y, horizons):
+    """{horizon: target column} views into a make_multi_horizon target matrix."""
+    return {h: Y[:, j] for j, h in enumerate(horizons)}
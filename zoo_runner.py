@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Train the "8 MODEL.py" zoo concurrently in a process pool.
+
+The scaled, windowed train/test arrays are placed in shared memory once; each
+worker attaches to them instead of receiving a pickled copy. Workers are
+spawned (TensorFlow is not fork-safe) and capped to a few intra-op threads
+each so that N workers do not oversubscribe the cores. Histories, predictions
+and metrics come back to the parent and are collected into the comparison
+table.
+
+    results, metrics_df = train_zoo(X_train, y_train, X_test, y_test, GHI_scaler)
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from metrics import accuracy_metrics
+from precision import data_dtype, get_precision, metric_deltas
+
+ZOO_NAMES = ('GRU', 'LSTM', 'RNN', 'ANN', 'CNN', 'MLP', 'SVR', 'DNN')
+
+
+def share_arrays(**arrays):
+    """Copy arrays into shared memory. Returns (handles, specs) with specs picklable."""
+    handles, specs = [], {}
+    for key, value in arrays.items():
+        value = np.ascontiguousarray(value)
+        shm = shared_memory.SharedMemory(create=True, size=max(value.nbytes, 1))
+        np.ndarray(value.shape, dtype=value.dtype, buffer=shm.buf)[...] = value
+        handles.append(shm)
+        specs[key] = (shm.name, value.shape, value.dtype.str)
+    return handles, specs
+
+
+def attach_arrays(specs):
+    """Map shared-memory specs from share_arrays back to read-only arrays."""
+    handles, arrays = [], {}
+    for key, (name, shape, dtype) in specs.items():
+        # Workers share the parent's resource tracker, which owns and unlinks the segment
+        shm = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        array.flags.writeable = False
+        handles.append(shm)
+        arrays[key] = array
+    return handles, arrays
+
+
+def init_worker(threads, precision):
+    """Process-pool initializer: cap the worker's threads and set its precision."""
+    # Must run before TensorFlow creates its thread pools
+    for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS'):
+        os.environ[var] = str(threads)
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    from precision import set_precision
+
+    set_precision(precision)
+
+
+# Segments attached in this worker, kept open for the worker's lifetime: arrays
+# handed to Keras may outlive a task, and closing under them would crash
+_attached = {}
+
+
+def attach_cached(specs):
+    """attach_arrays, attaching each set of segments only once per worker."""
+    key = tuple(sorted((k, v[0]) for k, v in specs.items()))
+    if key not in _attached:
+        _attached[key] = attach_arrays(specs)
+    return _attached[key][1]
+
+
+def _train_one(name, specs, epochs, batch_size, validation_split, model_kwargs, seed, budget):
+    arrays = attach_cached(specs)
+    X_train, y_train, X_test = arrays['X_train'], arrays['y_train'], arrays['X_test']
+    start = time.perf_counter()
+    if name == 'SVR':
+        from sklearn.svm import SVR
+
+        # Flatten X_train and X_test to be 2D arrays for SVR
+        model = SVR(**{'kernel': 'rbf', 'C': 100, 'gamma': 0.1, 'epsilon': 0.1, **model_kwargs})
+        model.fit(X_train.reshape(len(X_train), -1), y_train)
+        y_pred = model.predict(X_test.reshape(len(X_test), -1))
+        history = {}
+    else:
+        import tensorflow as tf
+        from models import ZOO, build_model
+
+        if seed is not None:
+            tf.keras.utils.set_random_seed(seed)
+        flatten = ZOO[name][1]
+        _, time_steps, n_features = X_train.shape
+        model = build_model(name, time_steps, n_features, **model_kwargs)
+        if flatten:
+            X_train = X_train.reshape(len(X_train), -1)
+            X_test = X_test.reshape(len(X_test), -1)
+        callbacks = budget.callbacks(name) if budget is not None else None
+        history = model.fit(X_train, y_train, epochs=epochs, batch_size=batch_size,
+                            validation_split=validation_split, shuffle=False, verbose=0,
+                            callbacks=callbacks).history
+        y_pred = model.predict(X_test, verbose=0)
+    return {'model': name, 'history': history, 'y_pred': np.asarray(y_pred).reshape(-1),
+            'seconds': time.perf_counter() - start,
+            'budget': budget.records.get(name) if budget is not None else None}
+
+
+def train_zoo(X_train, y_train, X_test, y_test, GHI_scaler, models=ZOO_NAMES, workers=None,
+              threads_per_worker=None, epochs=100, batch_size=64, validation_split=0.15,
+              model_kwargs=None, precision=None, seed=None, budget=None):
+    """Train `models` concurrently and evaluate them on the test windows.
+
+    Returns ({name: result dict with history, y_pred_inv, metrics, seconds},
+    comparison DataFrame with one row per model). `model_kwargs` maps a model
+    name to extra builder (or SVR) arguments. `precision` (precision.py,
+    the current setting by default) applies to the shared arrays and the
+    workers' Keras policy; `seed` makes the weight initialisation repeatable.
+    With a training_budget.TrainingBudget every Keras fit runs under it and
+    its outcome is recorded in `budget` under the model name.
+    """
+    models = list(models)
+    workers = workers or min(len(models), os.cpu_count() or 1)
+    threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    model_kwargs = model_kwargs or {}
+    precision = precision or get_precision()
+    dtype = data_dtype(precision)
+
+    handles, specs = share_arrays(X_train=np.asarray(X_train, dtype=dtype),
+                                  y_train=np.asarray(y_train, dtype=dtype),
+                                  X_test=np.asarray(X_test, dtype=dtype))
+    y_test_inv = GHI_scaler.inverse_transform(np.asarray(y_test).reshape(-1, 1)).flatten()
+    results = {}
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                 initializer=init_worker, initargs=(threads_per_worker, precision)) as pool:
+            futures = [pool.submit(_train_one, name, specs, epochs, batch_size, validation_split,
+                                   model_kwargs.get(name, {}), seed, budget) for name in models]
+            for future in as_completed(futures):
+                result = future.result()
+                if result['budget'] is not None:
+                    budget.records[result['model']] = result['budget']
+                result['y_pred_inv'] = GHI_scaler.inverse_transform(result['y_pred'].reshape(-1, 1)).flatten()
+                result['metrics'] = accuracy_metrics(y_test_inv, result['y_pred_inv'])
+                results[result['model']] = result
+    finally:
+        for shm in handles:
+            shm.close()
+            shm.unlink()
+
+    metrics_df = pd.DataFrame([{'Model': name, **results[name]['metrics'],
+                                'Seconds': results[name]['seconds']} for name in models])
+    return results, metrics_df
+
+
+def compare_precision(X_train, y_train, X_test, y_test, GHI_scaler,
+                      precisions=('float64', 'float32', 'mixed_float16'), seed=0, **kwargs):
+    """Train the zoo once per precision and report the metric deltas to float64.
+
+    Every run starts from the same `seed`, so the deltas come from the
+    precision rather than the initialisation. Keyword arguments are passed on
+    to train_zoo. Returns the precision.metric_deltas table, with a 'Data MB'
+    column holding the size of the shared train/test arrays at each precision.
+    """
+    tables = {}
+    for precision in precisions:
+        _, table = train_zoo(X_train, y_train, X_test, y_test, GHI_scaler, precision=precision,
+                             seed=seed, **kwargs)
+        itemsize = np.dtype(data_dtype(precision)).itemsize
+        table['Data MB'] = (np.size(X_train) + np.size(y_train) + np.size(X_test)) * itemsize / 2 ** 20
+        tables[precision] = table
+    return metric_deltas(tables)